@@ -0,0 +1,65 @@
+"""
+Failed login tracking shared by every worker and node.
+
+One document per email in the `login_lockouts` collection, keyed by the
+SHA-256 of the normalized email so addresses are not stored in clear:
+
+    {_id, count, locked_until (epoch seconds), expires_at}
+
+A failure is one atomic `find_one_and_update` (`$inc` with upsert), so
+concurrent workers never lose a count. From the LOCKOUT_FREE_ATTEMPTS-th
+failure on, the email is locked for a growing LOCKOUT_TIMES delay. A TTL
+index on `expires_at` drops an entry LOGIN_LOCKOUT_WINDOW_SECONDS after its
+last failure, which keeps the collection bounded.
+"""
+import hashlib
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from pymongo import ReturnDocument
+
+from document.services.mongo import get_database
+
+
+COLLECTION = 'login_lockouts'
+LOCKOUT_FREE_ATTEMPTS = 3
+LOCKOUT_TIMES = [60, 180, 300]  # 1 min, 3 min, 5 min
+
+
+def _collection():
+    return get_database()[COLLECTION]
+
+
+def _key(email):
+    return hashlib.sha256(email.strip().lower().encode()).hexdigest()
+
+
+def seconds_left(email):
+    """Seconds until `email` may try again, 0 if it is not locked."""
+    entry = _collection().find_one({'_id': _key(email)}, projection={'locked_until': 1})
+    if entry is None:
+        return 0
+    return max(0, int(entry.get('locked_until', 0) - time.time()))
+
+
+def record_failure(email):
+    """Count a failed login for `email`, locking it once over the limit."""
+    entry = _collection().find_one_and_update(
+        {'_id': _key(email)},
+        {
+            '$inc': {'count': 1},
+            '$set': {'expires_at': datetime.utcnow() + timedelta(seconds=settings.LOGIN_LOCKOUT_WINDOW_SECONDS)},
+            '$setOnInsert': {'locked_until': 0},
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    if entry['count'] >= LOCKOUT_FREE_ATTEMPTS:
+        lock_time = LOCKOUT_TIMES[min(entry['count'] - LOCKOUT_FREE_ATTEMPTS, len(LOCKOUT_TIMES) - 1)]
+        # $max: a concurrent, longer lock is never shortened
+        _collection().update_one({'_id': entry['_id']}, {'$max': {'locked_until': time.time() + lock_time}})
+
+
+def clear(email):
+    _collection().delete_one({'_id': _key(email)})
@@ -0,0 +1,48 @@
+# Generated by Django 3.1.12 on 2026-10-18 09:15
+
+from django.db import migrations, models
+
+
+# djongo does not reliably translate index DDL, so the indexes are built with
+# pymongo and only recorded in the migration state through AddIndex.
+INDEXES = [
+    ('authentication_customuser', 'customuser_hospital_role_idx', [('hospital_id', 1), ('role', 1)]),
+    ('authentication_customuser', 'customuser_role_idx', [('role', 1)]),
+]
+
+
+def create_indexes(apps, schema_editor):
+    db = schema_editor.connection.connection
+    for collection, name, keys in INDEXES:
+        db[collection].create_index(keys, name=name, background=True)
+
+
+def drop_indexes(apps, schema_editor):
+    db = schema_editor.connection.connection
+    for collection, name, keys in INDEXES:
+        db[collection].drop_index(name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0002_customuser_hospital'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='customuser',
+                    index=models.Index(fields=['hospital', 'role'], name='customuser_hospital_role_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='customuser',
+                    index=models.Index(fields=['role'], name='customuser_role_idx'),
+                ),
+            ],
+        ),
+    ]
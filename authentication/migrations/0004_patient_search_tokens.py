@@ -0,0 +1,63 @@
+# Generated by Django 3.1.12 on 2026-10-18 16:45
+
+from django.db import migrations, models
+from pymongo import UpdateOne
+import djongo.models.fields
+
+
+# See 0003: indexes are built with pymongo, AddIndex only updates the state.
+INDEXES = [
+    ('authentication_patient', 'patient_search_idx', [('search_tokens', 1)]),
+]
+
+
+def create_indexes(apps, schema_editor):
+    db = schema_editor.connection.connection
+    for collection, name, keys in INDEXES:
+        db[collection].create_index(keys, name=name, background=True)
+
+
+def drop_indexes(apps, schema_editor):
+    db = schema_editor.connection.connection
+    for collection, name, keys in INDEXES:
+        db[collection].drop_index(name)
+
+
+def fill_search_tokens(apps, schema_editor):
+    from authentication.search import tokens_for
+
+    collection = schema_editor.connection.connection['authentication_patient']
+    fields = ('nom', 'prenom', 'numero_identite', 'numero_telephone')
+    updates = [
+        UpdateOne({'id': row['id']}, {'$set': {'search_tokens': tokens_for(*(row.get(f) for f in fields))}})
+        for row in collection.find({}, projection={'_id': 0, 'id': 1, **{f: 1 for f in fields}})
+    ]
+    for start in range(0, len(updates), 1000):
+        collection.bulk_write(updates[start:start + 1000], ordered=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0003_auto_20261018_0915'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='search_tokens',
+            field=djongo.models.fields.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.RunPython(fill_search_tokens, migrations.RunPython.noop),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='patient',
+                    index=models.Index(fields=['search_tokens'], name='patient_search_idx'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.1.12 on 2026-10-18 17:30
+
+from django.db import migrations
+
+
+# Failed login counters (authentication/lockout.py) live in a collection without
+# a model; the TTL index deletes each entry once its expires_at has passed.
+COLLECTION = 'login_lockouts'
+INDEX_NAME = 'login_lockout_ttl_idx'
+
+
+def create_ttl_index(apps, schema_editor):
+    db = schema_editor.connection.connection
+    db[COLLECTION].create_index([('expires_at', 1)], name=INDEX_NAME, expireAfterSeconds=0, background=True)
+
+
+def drop_ttl_index(apps, schema_editor):
+    db = schema_editor.connection.connection
+    db[COLLECTION].drop_index(INDEX_NAME)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0004_patient_search_tokens'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_ttl_index, drop_ttl_index),
+    ]
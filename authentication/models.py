@@ -4,6 +4,8 @@ from django.utils import timezone
 import secrets
 import hashlib
 
+from . import search
+
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
         if not email:
@@ -47,6 +49,12 @@ class CustomUser(AbstractBaseUser):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['hospital', 'role'], name='customuser_hospital_role_idx'),
+            models.Index(fields=['role'], name='customuser_role_idx'),
+        ]
+
 
     def generate_otp(self):
         otp = str(secrets.randbelow(999999)).zfill(6)
@@ -82,7 +90,21 @@ class Patient(models.Model):
     date_naissance = models.DateField()
     sex = models.CharField(max_length=1, choices=SEX_CHOICES)
     numero_telephone = models.CharField(max_length=8, unique=True)
+    # Normalized words, prefixes and trigrams for the type-ahead (authentication/search.py)
+    search_tokens = models.JSONField(default=list, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['search_tokens'], name='patient_search_idx'),
+        ]
 
     def __str__(self):
         return f"{self.nom} {self.prenom}"
+
+    def save(self, *args, **kwargs):
+        self.search_tokens = search.patient_tokens(self)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'search_tokens' not in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['search_tokens']
+        super().save(*args, **kwargs)
     
\ No newline at end of file
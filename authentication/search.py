@@ -0,0 +1,153 @@
+"""
+Patient type-ahead search.
+
+Every patient carries `search_tokens`, an indexed array rebuilt on save from
+the names, ID number and phone number, normalized (accents removed, case
+folded):
+
+    w:<word>     each whole word
+    p:<prefix>   each prefix of a word, up to MAX_PREFIX_LENGTH characters
+    t:<trigram>  each 3-character slice of a name, for typos
+
+A query matches the patients holding the prefix token of every query word,
+which is one multikey index lookup instead of the `icontains` regex scan of
+SearchFilter. When nothing matches, patients sharing enough trigrams with
+the query are tried instead. Other filters of the request (`?sex=`) are
+part of the same match, and the whole match set is ranked by an
+aggregation pipeline: whole-word matches first, then prefixes, then trigram
+overlap. Only the best ids come back from Mongo.
+"""
+import re
+import unicodedata
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from rest_framework.filters import SearchFilter
+
+
+MAX_PREFIX_LENGTH = 15
+MIN_TRIGRAM_SCORE = 0.3  # Share of the query trigrams a fuzzy match must have
+
+_separators = re.compile(r"[^0-9a-z]+")
+
+
+def normalize(text):
+    """Lowercase words of `text`, without accents or punctuation."""
+    text = unicodedata.normalize('NFKD', str(text or ''))
+    text = ''.join(char for char in text if not unicodedata.combining(char)).casefold()
+    return [word for word in _separators.split(text) if word]
+
+
+def trigrams(word):
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def tokens_for(nom, prenom, numero_identite, numero_telephone):
+    """The `search_tokens` of a patient with these values."""
+    tokens = set()
+    names = normalize(nom) + normalize(prenom)
+    for word in names + normalize(numero_identite) + normalize(numero_telephone):
+        tokens.add('w:' + word)
+        tokens.update('p:' + word[:length] for length in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1))
+    for word in names:
+        tokens.update('t:' + trigram for trigram in trigrams(word))
+    return sorted(tokens)
+
+
+def patient_tokens(patient):
+    return tokens_for(patient.nom, patient.prenom, patient.numero_identite, patient.numero_telephone)
+
+
+def score_expression(words):
+    """Aggregation expression of a patient's relevance for the query `words`."""
+    terms = []
+    for word in words:
+        query_trigrams = sorted('t:' + t for t in trigrams(word))
+        fuzzy = {'$divide': [
+            {'$size': {'$filter': {'input': '$search_tokens', 'cond': {'$in': ['$$this', query_trigrams]}}}},
+            len(query_trigrams),
+        ]} if query_trigrams else 0
+        terms.append({'$cond': [
+            {'$in': ['w:' + word, '$search_tokens']}, 3,
+            {'$cond': [{'$in': ['p:' + word[:MAX_PREFIX_LENGTH], '$search_tokens']}, 2, fuzzy]},
+        ]})
+    return {'$add': terms}
+
+
+def search(query, filters=None, limit=None):
+    """
+    Ids of the patients matching `query` and the Mongo `filters`, most
+    relevant first, at most `limit` of them.
+    """
+    from .models import Patient
+    from document.services.mongo import get_collection
+
+    words = normalize(query)
+    if not words:
+        return []
+
+    collection = get_collection(Patient)
+    filters = filters or {}
+
+    def ranked(match, min_score=0):
+        pipeline = [
+            {'$match': {**filters, **match}},
+            {'$project': {'_id': 0, 'id': 1, 'score': score_expression(words)}},
+            {'$match': {'score': {'$gte': min_score}}},
+            {'$sort': {'score': -1, 'id': 1}},
+        ]
+        if limit:
+            pipeline.append({'$limit': limit})
+        return [row['id'] for row in collection.aggregate(pipeline)]
+
+    ids = ranked({'search_tokens': {'$all': ['p:' + word[:MAX_PREFIX_LENGTH] for word in words]}})
+    if ids:
+        return ids
+
+    # Nothing starts with the query: fall back to names sharing its trigrams
+    query_trigrams = sorted({'t:' + t for word in words for t in trigrams(word)})
+    if not query_trigrams:
+        return []
+    return ranked({'search_tokens': {'$in': query_trigrams}}, MIN_TRIGRAM_SCORE * len(words))
+
+
+class PatientSearchFilter(SearchFilter):
+    """
+    `?search=` backed by `search()`. The list action returns the best
+    PATIENT_SEARCH_MAX_RESULTS patients in relevance order; other actions only
+    keep the matching patients.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+
+        is_list = getattr(view, 'action', None) == 'list'
+        ids = search(
+            ' '.join(terms),
+            filters=self.get_mongo_filters(request, queryset, view),
+            limit=settings.PATIENT_SEARCH_MAX_RESULTS if is_list else None,
+        )
+        # The queryset filters still apply, the Mongo ones only rank the right set
+        queryset = queryset.filter(id__in=ids)
+        if not is_list:
+            return queryset
+
+        rank = {patient_id: position for position, patient_id in enumerate(ids)}
+        return sorted(queryset, key=lambda patient: rank[patient.id])
+
+    @staticmethod
+    def get_mongo_filters(request, queryset, view):
+        """The view's `filterset_fields` given in the query string, as a Mongo match."""
+        filters = {}
+        for name in getattr(view, 'filterset_fields', None) or []:
+            value = request.query_params.get(name)
+            if value in (None, ''):
+                continue
+            field = queryset.model._meta.get_field(name)
+            try:
+                filters[field.column] = field.to_python(value)
+            except ValidationError:
+                continue  # Rejected by the filterset, which returns no patient
+        return filters
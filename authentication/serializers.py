@@ -1,6 +1,7 @@
 from rest_framework import serializers
 
 from document.models import Hospital
+from document.serializers import ValuesSerializer
 from .models import CustomUser
 from django.core.validators import validate_email
 from .models import Patient
@@ -76,5 +77,8 @@ class PatientSerializer(serializers.ModelSerializer):
     sex = serializers.ChoiceField(choices=Patient.SEX_CHOICES)
     class Meta:
         model = Patient
-        fields = '__all__'
+        exclude = ['search_tokens']
+
+
+PATIENT_VALUES = ValuesSerializer(PatientSerializer)
         
\ No newline at end of file
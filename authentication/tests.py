@@ -1,3 +1,161 @@
-from django.test import TestCase
+import datetime
+import json
+import time
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from authentication import lockout, search
+from authentication.models import CustomUser, Patient
+from authentication.views import AllPatientsViewSet, DoctorListAPIView, PatientViewSet
+from document.models import Hospital
+from document.renderers import ORJSONRenderer
+
+
+def make_patient(nom, prenom, sex='M', number=None):
+    number = number or str(Patient.objects.count() + 1)
+    return Patient.objects.create(
+        numero_identite='ID' + number, nom=nom, prenom=prenom, date_naissance=datetime.date(1990, 1, 1),
+        sex=sex, numero_telephone='2' + number.zfill(7),
+    )
+
+
+class PatientSearchTests(TestCase):
+    def test_tokens_fold_accents_and_case(self):
+        tokens = search.tokens_for('Béchir', 'ÉLODIE', 'A-12', '22 33')
+        self.assertIn('w:bechir', tokens)
+        self.assertIn('w:elodie', tokens)
+        self.assertIn('p:bec', tokens)
+        self.assertIn('t:lod', tokens)
+        self.assertIn('w:a', tokens)
+        self.assertIn('w:12', tokens)
+
+    def test_accented_query_matches_plain_name(self):
+        patient = make_patient('Bechir', 'Ali')
+        self.assertEqual(search.search('BÉCH'), [patient.id])
+        self.assertEqual(search.search('béchir ali'), [patient.id])
+
+    def test_whole_words_rank_before_prefixes(self):
+        prefix = make_patient('Alioune', 'Sow')
+        whole = make_patient('Ali', 'Sow')
+        self.assertEqual(search.search('ali'), [whole.id, prefix.id])
+
+    def test_ranking_covers_every_match_before_the_limit(self):
+        prefixes = [make_patient('Alibert%s' % letter, 'Sow') for letter in 'abcdef']
+        whole = make_patient('Ali', 'Sow')
+        self.assertEqual(search.search('ali', limit=1), [whole.id])
+        self.assertEqual(len(search.search('ali')), len(prefixes) + 1)
+
+    def test_typo_falls_back_to_trigrams(self):
+        patient = make_patient('Mohamed', 'Salem')
+        make_patient('Diallo', 'Awa')
+        self.assertEqual(search.search('mohamde'), [patient.id])
+
+    def test_filters_apply_before_the_limit(self):
+        make_patient('Ali', 'Sow', sex='M')
+        woman = make_patient('Alia', 'Sow', sex='F')
+        self.assertEqual(search.search('ali', filters={'sex': 'F'}, limit=1), [woman.id])
+
+
+@override_settings(PATIENT_SEARCH_MAX_RESULTS=1)
+class PatientSearchViewTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='doctor@example.com', password='secret', role='Doctor')
+        self.view = PatientViewSet.as_view({'get': 'list'}, throttle_classes=[])
+
+    def get(self, params):
+        request = APIRequestFactory().get('/api/auth/patients/', params)
+        force_authenticate(request, user=self.user)
+        response = self.view(request)
+        self.assertEqual(response.status_code, 200)
+        return [patient['id'] for patient in response.data]
+
+    def test_sex_filter_is_part_of_the_search(self):
+        make_patient('Ali', 'Sow', sex='M')
+        woman = make_patient('Alia', 'Sow', sex='F')
+        self.assertEqual(self.get({'search': 'ali', 'sex': 'F'}), [woman.id])
+
+    def test_best_match_is_returned(self):
+        make_patient('Alioune', 'Sow')
+        whole = make_patient('Ali', 'Sow')
+        self.assertEqual(self.get({'search': 'ali'}), [whole.id])
+
+
+class LoginLockoutTests(TestCase):
+    email = 'Doctor@Example.com'
+
+    def setUp(self):
+        lockout._collection().delete_many({})
+
+    def test_locks_after_the_free_attempts_with_growing_delays(self):
+        for _ in range(lockout.LOCKOUT_FREE_ATTEMPTS - 1):
+            lockout.record_failure(self.email)
+        self.assertEqual(lockout.seconds_left(self.email), 0)
+
+        lockout.record_failure(self.email)
+        self.assertAlmostEqual(lockout.seconds_left(self.email), lockout.LOCKOUT_TIMES[0], delta=2)
+        lockout.record_failure(self.email)
+        self.assertAlmostEqual(lockout.seconds_left(self.email), lockout.LOCKOUT_TIMES[1], delta=2)
+        for _ in range(5):
+            lockout.record_failure(self.email)
+        self.assertAlmostEqual(lockout.seconds_left(self.email), lockout.LOCKOUT_TIMES[-1], delta=2)
+
+    def test_email_is_normalized_and_not_stored_in_clear(self):
+        lockout.record_failure(self.email)
+        lockout.record_failure(' doctor@example.COM ')
+        entry, = lockout._collection().find()
+        self.assertEqual(entry['count'], 2)
+        self.assertNotIn('example', entry['_id'])
+        self.assertGreater(entry['expires_at'], datetime.datetime.utcnow())
+
+    def test_expired_lock_lets_the_user_try_again(self):
+        for _ in range(lockout.LOCKOUT_FREE_ATTEMPTS):
+            lockout.record_failure(self.email)
+        lockout._collection().update_many({}, {'$set': {'locked_until': time.time() - 1}})
+        self.assertEqual(lockout.seconds_left(self.email), 0)
+
+    def test_success_clears_the_counter(self):
+        for _ in range(lockout.LOCKOUT_FREE_ATTEMPTS):
+            lockout.record_failure(self.email)
+        lockout.clear(self.email)
+        self.assertEqual(lockout.seconds_left(self.email), 0)
+        lockout.record_failure(self.email)
+        self.assertEqual(lockout.seconds_left(self.email), 0)
+
+
+class FastSerializerParityTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create_user(email='admin@example.com', password='secret', role='Admin')
+        hospital = Hospital.objects.create(name='CHN')
+        CustomUser.objects.create_user(email='a@example.com', password='secret', role='Doctor', hospital=hospital)
+        CustomUser.objects.create_user(email='b@example.com', password='secret', role='Doctor')  # No hospital
+        make_patient('Bechir', 'Ali')
+        make_patient('Diallo', 'Awa', sex='F')
+
+    def render(self, view_class, actions, path, fast):
+        renderer = ORJSONRenderer if fast else JSONRenderer
+        initkwargs = {'throttle_classes': [], 'renderer_classes': [renderer]}
+        view = view_class.as_view(actions, **initkwargs) if actions else view_class.as_view(**initkwargs)
+        request = APIRequestFactory().get(path)
+        force_authenticate(request, user=self.admin)
+        with override_settings(API_FAST_SERIALIZERS=fast):
+            response = view(request)
+            response.render()
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def assert_same_output(self, *endpoint):
+        drf, fast = self.render(*endpoint, fast=False), self.render(*endpoint, fast=True)
+        self.assertEqual(json.loads(fast), json.loads(drf))
+        self.assertEqual(fast, drf)
+
+    def test_patients_all(self):
+        self.assert_same_output(AllPatientsViewSet, {'get': 'list'}, '/api/auth/patients-all/')
+        patients = json.loads(self.render(AllPatientsViewSet, {'get': 'list'}, '/api/auth/patients-all/', True))
+        self.assertEqual(patients[0]['date_naissance'], '1990-01-01')
+
+    def test_doctors(self):
+        self.assert_same_output(DoctorListAPIView, None, '/api/auth/doctors/')
+        doctors = json.loads(self.render(DoctorListAPIView, None, '/api/auth/doctors/', True))
+        self.assertIn(None, [doctor['hospital'] for doctor in doctors])
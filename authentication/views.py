@@ -7,12 +7,13 @@ from django.core.mail import send_mail
 from django.contrib.auth import authenticate
 
 from document.models import Hospital
-from document.serializers import DoctorSerializer
+from document.serializers import DOCTOR_VALUES, DoctorSerializer
 
 from .models import Patient
-from .serializers import PatientSerializer
+from .search import PatientSearchFilter
+from . import lockout
+from .serializers import PATIENT_VALUES, PatientSerializer
 from rest_framework import viewsets, permissions
-from rest_framework import filters
 from .serializers import CreateDoctorSerializer
 from django_filters.rest_framework import DjangoFilterBackend 
 from rest_framework.permissions import IsAuthenticated
@@ -25,7 +26,6 @@ from .serializers import (
 from .models import CustomUser
 from rest_framework_simplejwt.tokens import RefreshToken
 from .serializers import CreateDoctorSerializer
-import time
 import threading
 from django.conf import settings
 from django.shortcuts import get_object_or_404
@@ -58,8 +58,7 @@ class UserRegistrationView(APIView):
 
 
 
-FAILED_LOGIN_ATTEMPTS = {}
-LOGIN_LOCKOUT_TIMES = [60, 180, 300]  # 1 min, 3 min, 5 min
+# Failed attempts live in MongoDB (lockout.py) so every worker enforces the same lockout
 class LoginView(APIView):
     throttle_classes = [AnonRateThrottle]
     permission_classes = [AllowAny]
@@ -70,13 +69,13 @@ class LoginView(APIView):
             email = serializer.validated_data['email']
             password = serializer.validated_data['password']
             
-            if email in FAILED_LOGIN_ATTEMPTS and FAILED_LOGIN_ATTEMPTS[email]['locked_until'] > time.time():
-                time_left = FAILED_LOGIN_ATTEMPTS[email]['locked_until'] - time.time()
-                return Response({"error": "Too many failed attempts. Try again later.", "lockout_time": int(time_left)}, status=status.HTTP_403_FORBIDDEN)            
+            time_left = lockout.seconds_left(email)
+            if time_left:
+                return Response({"error": "Too many failed attempts. Try again later.", "lockout_time": time_left}, status=status.HTTP_403_FORBIDDEN)            
             user = authenticate(email=email, password=password)
             
             if user:
-                FAILED_LOGIN_ATTEMPTS.pop(email, None)
+                lockout.clear(email)
                 otp = user.generate_otp()
                 # send_mail(
                 #     'Your OTP Code',
@@ -187,12 +186,7 @@ class LoginView(APIView):
                 threading.Thread(target=_send, daemon=True).start()
                 return Response({'message': 'OTP sent to your email', 'email': email, 'otp': otp}, status=status.HTTP_200_OK)
             
-            attempts = FAILED_LOGIN_ATTEMPTS.get(email, {'count': 0, 'locked_until': 0})
-            attempts['count'] += 1
-            if attempts['count'] >= 3:
-                lock_time = LOGIN_LOCKOUT_TIMES[min(attempts['count'] - 3, len(LOGIN_LOCKOUT_TIMES) - 1)]
-                attempts['locked_until'] = time.time() + lock_time
-            FAILED_LOGIN_ATTEMPTS[email] = attempts
+            lockout.record_failure(email)
             
             return Response({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
         
@@ -207,6 +201,8 @@ class AllPatientsViewSet(viewsets.ViewSet):
     """
     def list(self, request):
         patients = Patient.objects.all()
+        if settings.API_FAST_SERIALIZERS:
+            return Response(PATIENT_VALUES.many(patients))
         serializer = PatientSerializer(patients, many=True)
         return Response(serializer.data)
 
@@ -443,9 +439,9 @@ class PatientViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     queryset = Patient.objects.all()
     serializer_class = PatientSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
+    # ?search= is answered from the patients' search_tokens index, ranked (see search.py)
+    filter_backends = [DjangoFilterBackend, PatientSearchFilter]
     filterset_fields = ['sex'] 
-    search_fields = ['numero_identite','nom', 'prenom'] 
 
 
 class DoctorListAPIView(APIView):
@@ -468,6 +464,8 @@ class DoctorListAPIView(APIView):
         else:
             # If no hospital_id is provided, fetch all doctors
             doctors = CustomUser.objects.filter(role="Doctor")
-            
+
+        if settings.API_FAST_SERIALIZERS:
+            return Response(DOCTOR_VALUES.many(doctors), status=status.HTTP_200_OK)
         serializer = DoctorSerializer(doctors, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
\ No newline at end of file
@@ -33,8 +33,66 @@ if not AES_KEY_HEX:
 RAW_AES_KEY = bytes.fromhex(AES_KEY_HEX)
 if len(RAW_AES_KEY) != 32:
     raise ValueError("AES_KEY must decode to 32 bytes for AES-256 encryption.")
+
+# Keyring for the ciphertext envelope (document/services/envelope.py): AES_KEY is
+# key AES_KEY_ID and encrypts new documents; AES_KEYS="2:<hex>,3:<hex>" adds the
+# other keys still needed to read older documents. Rows written before the
+# envelope (bare AES-CBC) are read with key AES_LEGACY_KEY_ID.
+AES_KEY_ID = int(os.getenv("AES_KEY_ID", "1"))
+AES_LEGACY_KEY_ID = int(os.getenv("AES_LEGACY_KEY_ID", str(AES_KEY_ID)))
+AES_KEYRING = {AES_KEY_ID: RAW_AES_KEY}
+for _entry in filter(None, os.getenv("AES_KEYS", "").split(",")):
+    _key_id, _key_hex = _entry.split(":", 1)
+    AES_KEYRING[int(_key_id)] = bytes.fromhex(_key_hex.strip())
+for _key_id, _key in AES_KEYRING.items():
+    if not 0 <= _key_id <= 255 or len(_key) != 32:
+        raise ValueError("AES_KEYS entries must be '<id 0-255>:<64 hex chars>'.")
+
+# zlib compression of document results before encryption (0 disables it);
+# smaller payloads are stored as they are
+DOCUMENT_COMPRESSION_LEVEL = int(os.getenv("DOCUMENT_COMPRESSION_LEVEL", "6"))
+DOCUMENT_COMPRESSION_MIN_BYTES = int(os.getenv("DOCUMENT_COMPRESSION_MIN_BYTES", "512"))
+
+# Unwrapped per-patient data keys kept in memory (document/services/data_keys.py)
+DOCUMENT_DATA_KEY_CACHE_SIZE = int(os.getenv("DOCUMENT_DATA_KEY_CACHE_SIZE", "10000"))
+DOCUMENT_DATA_KEY_CACHE_TTL = int(os.getenv("DOCUMENT_DATA_KEY_CACHE_TTL", "600"))
+
+# Master key the blind index HMAC key is derived from (document/services/blind_index.py).
+# Defaults to AES_LEGACY_KEY_ID, which stays put when AES_KEY_ID is rotated; changing
+# it means rebuilding every token with `manage.py reindex_blind_tokens`.
+BLIND_INDEX_KEY_ID = int(os.getenv("BLIND_INDEX_KEY_ID", str(AES_LEGACY_KEY_ID)))
+if BLIND_INDEX_KEY_ID not in AES_KEYRING:
+    raise ValueError("BLIND_INDEX_KEY_ID must be a key id of AES_KEYS.")
 # END AES-KEY
 
+# Batched decryption (Document.decrypt_many)
+DOCUMENT_DECRYPT_WORKERS = int(os.getenv("DOCUMENT_DECRYPT_WORKERS", "4"))
+DOCUMENT_DECRYPT_PARALLEL_THRESHOLD = int(os.getenv("DOCUMENT_DECRYPT_PARALLEL_THRESHOLD", "8"))
+
+# In-memory LRU cache of decrypted results, bounded in bytes (0 disables it)
+DOCUMENT_PLAINTEXT_CACHE_BYTES = int(os.getenv("DOCUMENT_PLAINTEXT_CACHE_BYTES", "0"))
+DOCUMENT_PLAINTEXT_CACHE_TTL = int(os.getenv("DOCUMENT_PLAINTEXT_CACHE_TTL", "300"))
+
+# Rows read from the Mongo cursor per chunk when streaming history as NDJSON
+DOCUMENT_HISTORY_STREAM_CHUNK_SIZE = int(os.getenv("DOCUMENT_HISTORY_STREAM_CHUNK_SIZE", "100"))
+
+# Maximum number of documents accepted by one POST /api/documents/bulk/
+DOCUMENT_BULK_MAX_ITEMS = int(os.getenv("DOCUMENT_BULK_MAX_ITEMS", "200"))
+
+# Maximum number of ids accepted by one POST /api/documents/verify-batch/
+DOCUMENT_VERIFY_BATCH_MAX_IDS = int(os.getenv("DOCUMENT_VERIFY_BATCH_MAX_IDS", "500"))
+
+# Patient type-ahead (authentication/search.py): patients returned by ?search=
+PATIENT_SEARCH_MAX_RESULTS = int(os.getenv("PATIENT_SEARCH_MAX_RESULTS", "50"))
+
+# Serve the patients-all and doctors lists straight from values() rows instead of
+# ModelSerializers (ValuesSerializer in document/serializers.py)
+API_FAST_SERIALIZERS = os.getenv("API_FAST_SERIALIZERS", "True") == "True"
+
+# Failed login counters (authentication/lockout.py) are forgotten this long after
+# an email's last failure
+LOGIN_LOCKOUT_WINDOW_SECONDS = int(os.getenv("LOGIN_LOCKOUT_WINDOW_SECONDS", "86400"))
+
 ######## Load Blockchain Configurations #######
 CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS")
 PRIVATE_KEY = os.getenv("PRIVATE_KEY")
@@ -48,6 +106,30 @@ if not CONTRACT_ADDRESS:
 if not PRIVATE_KEY:
     raise ValueError("Missing PRIVATE_KEY in .env file.")
 
+# Anchoring outbox drained by `manage.py anchor_documents` (document/services/anchoring.py)
+ANCHOR_BATCH_SIZE = int(os.getenv("ANCHOR_BATCH_SIZE", "50"))
+ANCHOR_POLL_INTERVAL = float(os.getenv("ANCHOR_POLL_INTERVAL", "5"))
+ANCHOR_MAX_ATTEMPTS = int(os.getenv("ANCHOR_MAX_ATTEMPTS", "8"))
+ANCHOR_BACKOFF_BASE_SECONDS = int(os.getenv("ANCHOR_BACKOFF_BASE_SECONDS", "30"))
+ANCHOR_BACKOFF_MAX_SECONDS = int(os.getenv("ANCHOR_BACKOFF_MAX_SECONDS", "3600"))
+ANCHOR_LEASE_SECONDS = int(os.getenv("ANCHOR_LEASE_SECONDS", "120"))
+ANCHOR_RECEIPT_TIMEOUT_SECONDS = int(os.getenv("ANCHOR_RECEIPT_TIMEOUT_SECONDS", "600"))
+ANCHOR_RECONCILE_LOOKBACK = int(os.getenv("ANCHOR_RECONCILE_LOOKBACK", "1000"))
+
+# "single" sends one transaction per document; "merkle" anchors one Merkle root per
+# batch, cut when it reaches ANCHOR_MERKLE_MAX_LEAVES or its oldest document has
+# waited ANCHOR_MERKLE_WINDOW_SECONDS
+ANCHOR_MODE = os.getenv("ANCHOR_MODE", "single")
+ANCHOR_MERKLE_MAX_LEAVES = int(os.getenv("ANCHOR_MERKLE_MAX_LEAVES", "256"))
+ANCHOR_MERKLE_WINDOW_SECONDS = int(os.getenv("ANCHOR_MERKLE_WINDOW_SECONDS", "60"))
+
+# Shared BlockchainService (document/services/blockchain.py): pooled keep-alive
+# HTTP session to RPC_URL, optional warm-up at boot, optional check on every read
+BLOCKCHAIN_RPC_TIMEOUT = float(os.getenv("BLOCKCHAIN_RPC_TIMEOUT", "10"))
+BLOCKCHAIN_HTTP_POOL_SIZE = int(os.getenv("BLOCKCHAIN_HTTP_POOL_SIZE", "10"))
+BLOCKCHAIN_WARMUP = os.getenv("BLOCKCHAIN_WARMUP", "False") == "True"
+DOCUMENT_VERIFY_ON_READ = os.getenv("DOCUMENT_VERIFY_ON_READ", "False") == "True"
+
 INSTALLED_APPS = [
     'authentication',
     'document',
@@ -82,7 +164,12 @@ REST_FRAMEWORK = {
         'anon' : '10/min',
         'get_scope': '20/min',
         'post_scope': '10/min',
-    }
+    },
+    # orjson encoding for JSON responses (document/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'document.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     # 'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     # 'PAGE_SIZE': 1, 
     # 'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend', 'rest_framework.filters.SearchFilter'],
@@ -96,6 +183,16 @@ CACHES = {
     }
 }
 
+# Dashboard/stats response cache (document/services/stats_cache.py). With the
+# per-process LocMemCache above, writes made by other workers or by management
+# commands only show up once the entries expire, after STATS_CACHE_TIMEOUT seconds.
+STATS_CACHE_TIMEOUT = int(os.getenv("STATS_CACHE_TIMEOUT", "300"))
+STATS_CACHE_LOCK_SECONDS = int(os.getenv("STATS_CACHE_LOCK_SECONDS", "30"))
+STATS_CACHE_WAIT_SECONDS = int(os.getenv("STATS_CACHE_WAIT_SECONDS", "10"))
+
+# Serialized category/field schema kept per process (document/services/schema_cache.py)
+CATEGORY_SCHEMA_CACHE_TTL = int(os.getenv("CATEGORY_SCHEMA_CACHE_TTL", "300"))
+
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=7), 
@@ -198,6 +295,10 @@ else:
         }
     }
 
+# djongo cannot replay every historical migration (e.g. ALTER COLUMN TYPE), so the
+# test database is created straight from the current models
+DATABASES['default']['TEST'] = {'MIGRATE': False}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
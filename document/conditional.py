@@ -0,0 +1,50 @@
+"""
+Conditional GET helpers: answer `If-None-Match` (or `If-Modified-Since`)
+with 304 Not Modified before doing the work of building a response.
+"""
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+
+CACHE_CONTROL = 'private, no-cache'  # Browsers may keep a copy but must revalidate it
+
+
+def is_conditional(request):
+    return 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+
+
+def etag_matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    # Weak comparison, as RFC 7232 requires for If-None-Match
+    etags = {tag[2:] if tag.startswith('W/') else tag for tag in parse_etags(header)}
+    return '*' in etags or etag in etags
+
+
+def not_modified(request, etag, last_modified=None):
+    if 'HTTP_IF_NONE_MATCH' in request.META:
+        # If-None-Match takes precedence over If-Modified-Since
+        return etag_matches(request, etag)
+    since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE'))
+    return last_modified is not None and since is not None and int(last_modified.timestamp()) <= since
+
+
+def with_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    response['Cache-Control'] = CACHE_CONTROL
+    return response
+
+
+def not_modified_response(etag, last_modified=None):
+    return with_validators(Response(status=status.HTTP_304_NOT_MODIFIED), etag, last_modified)
+
+
+def conditional_response(request, etag, build, last_modified=None):
+    """304 if the client's copy is current, else the Response `build()` returns, with validators."""
+    if not_modified(request, etag, last_modified):
+        return not_modified_response(etag, last_modified)
+    return with_validators(build(), etag, last_modified)
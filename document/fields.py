@@ -0,0 +1,25 @@
+import base64
+
+from djongo import models
+
+
+class CiphertextField(models.BinaryField):
+    """
+    Raw ciphertext stored as BSON binary instead of a base64 string.
+
+    Rows written before this field existed still hold base64 text:
+    `from_db_value` decodes those, so both formats read back as bytes while
+    `manage.py migrate_ciphertext` converts the old rows in place.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        if isinstance(value, str):
+            # Legacy base64 row
+            return base64.b64decode(value)
+        return value
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        # pymongo stores bytes as BSON binary as-is, no driver wrapper needed
+        if isinstance(value, (bytearray, memoryview)):
+            return bytes(value)
+        return value
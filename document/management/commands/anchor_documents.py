@@ -0,0 +1,67 @@
+import logging
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from document.services import anchoring
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Anchor document hashes on chain by draining the document_anchor outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Run a single cycle and exit.")
+        parser.add_argument('--interval', type=float, default=settings.ANCHOR_POLL_INTERVAL,
+                            help="Seconds to sleep between cycles.")
+        parser.add_argument('--batch-size', type=int, default=settings.ANCHOR_BATCH_SIZE,
+                            help="Rows submitted and receipts checked per cycle.")
+        parser.add_argument('--rpc-url', default=None,
+                            help="Node to send transactions to (defaults to RPC_URL), e.g. a local Ganache.")
+        parser.add_argument('--backfill', action='store_true',
+                            help="First enqueue every document that has never been anchored.")
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            added = anchoring.enqueue_missing(since_id=0)
+            self.stdout.write(f"Enqueued {added} documents for anchoring.")
+
+        worker = anchoring.AnchorWorker(rpc_url=options['rpc_url'], batch_size=options['batch_size'])
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        while True:
+            backlog = False
+            try:
+                stats = worker.run_once()
+            except Exception:
+                # Node or database unreachable: keep the worker alive and try again
+                logger.exception("❌ Anchoring cycle failed")
+            else:
+                if any(stats.values()):
+                    self.stdout.write(", ".join(f"{key}={value}" for key, value in stats.items()))
+                # A full cycle means more rows are waiting: go again without sleeping
+                backlog = stats['sent'] >= worker.batch_size
+
+            if options['once'] or self.stopping:
+                break
+            if not backlog:
+                self.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS("Anchoring worker stopped."))
+
+    def stop(self, signum, frame):
+        # Finish the current cycle, then exit
+        self.stopping = True
+
+    def sleep(self, seconds):
+        deadline = time.monotonic() + seconds
+        while not self.stopping and time.monotonic() < deadline:
+            time.sleep(max(0, min(0.5, deadline - time.monotonic())))
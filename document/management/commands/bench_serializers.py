@@ -0,0 +1,101 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from authentication.models import CustomUser
+from authentication.views import AllPatientsViewSet, DoctorListAPIView
+from document.models import Document
+from document.renderers import ORJSONRenderer, orjson
+from document.views import DocumentHistoryAPIView
+
+
+# (label, API_FAST_SERIALIZERS, renderer)
+MODES = [
+    ('DRF', False, JSONRenderer),
+    ('fast', True, ORJSONRenderer),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare requests per second of the patients-all, doctors and history endpoints "
+        "between the DRF path (ModelSerializer, JSONRenderer, result as a string) and the "
+        "fast path (values() rows, orjson, ?result_format=object). Runs the views in-process "
+        "against the configured database and only reads."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50,
+                            help="Timed requests per endpoint and mode.")
+        parser.add_argument('--user', help="Email of the user to authenticate as. Default: the first admin.")
+        parser.add_argument('--patient', type=int, help="History patient. Default: that of the latest document.")
+        parser.add_argument('--category', type=int, help="History category. Default: that of the latest document.")
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.filter(email=options['user']) if options['user'] else \
+            CustomUser.objects.filter(role='Admin')
+        user = users.first()
+        if user is None:
+            raise CommandError("No user to authenticate as: pass --user.")
+        if orjson is None:
+            self.stderr.write("orjson is not installed: the fast path renders with the json module.")
+
+        endpoints = [
+            ('patients-all', AllPatientsViewSet, {'get': 'list'}, '/api/auth/patients-all/', {}, {}),
+            ('doctors', DoctorListAPIView, None, '/api/auth/doctors/', {}, {}),
+        ]
+        history = self.history_params(options)
+        if history:
+            endpoints.append((
+                'history', DocumentHistoryAPIView, None, '/api/documents/history/',
+                history, {**history, 'result_format': 'object'},
+            ))
+        else:
+            self.stderr.write("No document found: history is not benchmarked.")
+
+        for label, view_class, actions, path, drf_params, fast_params in endpoints:
+            rates = {}
+            for mode, fast, renderer in MODES:
+                initkwargs = {'throttle_classes': [], 'renderer_classes': [renderer]}
+                view = view_class.as_view(actions, **initkwargs) if actions else view_class.as_view(**initkwargs)
+                with override_settings(API_FAST_SERIALIZERS=fast):
+                    rates[mode], size = self.measure(
+                        view, path, fast_params if fast else drf_params, user, options['requests']
+                    )
+            self.stdout.write(
+                f"{label:<14} DRF {rates['DRF']:9.1f} req/s   fast {rates['fast']:9.1f} req/s   "
+                f"x{rates['fast'] / rates['DRF']:.2f}   ({size / 1024:.1f} KB)"
+            )
+
+    @staticmethod
+    def history_params(options):
+        if options['patient'] and options['category']:
+            return {'patient_id': options['patient'], 'category_id': options['category']}
+        latest = Document.objects.order_by('-id').values('patient_id', 'category_id').first()
+        if latest is None:
+            return None
+        return {'patient_id': options['patient'] or latest['patient_id'],
+                'category_id': options['category'] or latest['category_id']}
+
+    @staticmethod
+    def measure(view, path, params, user, count):
+        """Requests per second of `view`, rendering included, and the size of a response."""
+        factory = APIRequestFactory()
+
+        def request():
+            http_request = factory.get(path, params)
+            force_authenticate(http_request, user=user)
+            response = view(http_request)
+            response.render()
+            if response.status_code != 200:
+                raise CommandError(f"{path} answered {response.status_code}: {response.content[:200]!r}")
+            return len(response.content)
+
+        size = request()  # Warm-up: connections, data keys, plaintext cache
+        started = time.perf_counter()
+        for _ in range(count):
+            request()
+        return count / (time.perf_counter() - started), size
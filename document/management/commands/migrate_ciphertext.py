@@ -0,0 +1,139 @@
+import base64
+import binascii
+import time
+
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from document.models import Document, DocumentAnchor
+from document.services import data_keys, envelope
+from document.services.mongo import get_collection
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert document ciphertext stored as base64 text to BSON binary, in batches. "
+        "With --reseal, re-encrypt the documents still under a master key (legacy AES-CBC "
+        "or master-key AES-GCM) with their patient's data key, so that the old master keys "
+        "can be retired. Safe to run while the application serves traffic, and to re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Rows converted per bulk write.")
+        parser.add_argument('--pause', type=float, default=0,
+                            help="Seconds to sleep between batches, to go easy on production.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Count the rows left to convert without writing.")
+        parser.add_argument('--reseal', action='store_true',
+                            help="After converting, re-encrypt master-key documents with their patient's data key.")
+
+    def handle(self, *args, **options):
+        collection = get_collection(Document)
+        legacy = {'result': {'$type': 'string'}}
+
+        remaining = collection.count_documents(legacy)
+        self.stdout.write(f"{remaining} documents still store base64 ciphertext.")
+        if not options['dry_run'] and remaining:
+            self.convert(collection, legacy, remaining, options)
+        if options['reseal']:
+            self.reseal(collection, options)
+
+    def convert(self, collection, legacy, remaining, options):
+        converted = skipped = 0
+        last_id = 0
+        while True:
+            rows = list(
+                collection.find({**legacy, 'id': {'$gt': last_id}}, projection={'_id': 0, 'id': 1, 'result': 1})
+                .sort('id', 1)
+                .limit(options['batch_size'])
+            )
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+
+            updates = []
+            for row in rows:
+                try:
+                    ciphertext = base64.b64decode(row['result'], validate=True)
+                except binascii.Error:
+                    self.stderr.write(f"Document {row['id']}: result is not valid base64, left as is.")
+                    skipped += 1
+                    continue
+                # Only replace the exact value read, in case the row changed meanwhile
+                updates.append(UpdateOne({'id': row['id'], 'result': row['result']}, {'$set': {'result': ciphertext}}))
+
+            if updates:
+                converted += collection.bulk_write(updates, ordered=False).modified_count
+            self.stdout.write(f"  {converted}/{remaining} converted (up to document {last_id})")
+
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(f"Converted {converted} documents, skipped {skipped}."))
+
+    def reseal(self, collection, options):
+        """
+        Re-encrypt every binary row that is not under a data key yet. Envelopes
+        carry their format in the header, so all binary rows are scanned once;
+        rows already under a data key are skipped, which makes re-runs cheap.
+        Anchored documents are left as is: resealing changes the hash the chain holds.
+        """
+        resealed = failed = pending = anchored = 0
+        last_id = 0
+        while True:
+            rows = list(
+                collection.find({'result': {'$type': 'binData'}, 'id': {'$gt': last_id}},
+                                projection={'_id': 0, 'id': 1, 'patient_id': 1, 'result': 1, 'hash': 1})
+                .sort('id', 1)
+                .limit(options['batch_size'])
+            )
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+
+            stale = [row for row in rows if self.under_master_key(bytes(row['result']), row['hash'])]
+            if stale:
+                kept = set(DocumentAnchor.objects.filter(document_id__in=[row['id'] for row in stale])
+                           .values_list('document_id', flat=True))
+                anchored += len(kept)
+                stale = [row for row in stale if row['id'] not in kept]
+            pending += len(stale)
+            if options['dry_run'] or not stale:
+                continue
+
+            updates = []
+            for row in stale:
+                try:
+                    plaintext = envelope.open_envelope(bytes(row['result']), stored_hash=row['hash'])
+                    data_key = data_keys.get_data_key(row['patient_id'], create=True)
+                    ciphertext = envelope.seal(plaintext, data_key=data_key)
+                except Exception as e:
+                    self.stderr.write(f"Document {row['id']}: cannot reseal ({e!r}), left as is.")
+                    failed += 1
+                    continue
+                # Same plaintext, so the blind tokens stay valid; only if the row did not change meanwhile
+                updates.append(UpdateOne(
+                    {'id': row['id'], 'hash': row['hash']},
+                    {'$set': {'result': ciphertext, 'hash': envelope.content_hash(ciphertext)}},
+                ))
+
+            if updates:
+                resealed += collection.bulk_write(updates, ordered=False).modified_count
+            self.stdout.write(f"  {resealed} resealed (up to document {last_id})")
+
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        if anchored:
+            self.stdout.write(f"{anchored} anchored documents stay under their master key.")
+        if options['dry_run']:
+            self.stdout.write(f"{pending} documents can be resealed under their patient's data key.")
+            return
+        self.stdout.write(self.style.SUCCESS(f"Resealed {resealed} documents, {failed} failed."))
+
+    @staticmethod
+    def under_master_key(blob, stored_hash):
+        if envelope.is_legacy(blob, stored_hash):
+            return True
+        return envelope.parse_header(blob)[0] == envelope.FORMAT_GCM
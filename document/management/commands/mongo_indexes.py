@@ -0,0 +1,154 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from document.services.mongo import get_database, managed_indexes
+
+
+# The filters and sorts the views run on every request. Values are
+# placeholders: the planner picks the same plan whatever they are.
+HOT_QUERIES = [
+    {
+        'label': 'DocumentHistoryAPIView / DocumentLastAPIView',
+        'collection': 'document',
+        'filter': {'patient_id': 1, 'category_id': 1},
+        'sort': [('created_at', -1), ('id', -1)],
+    },
+    {
+        'label': 'DocumentHistoryAPIView ?filter_field=',
+        'collection': 'document',
+        'filter': {'blind_tokens': '00' * 16, 'patient_id': 1},
+    },
+    {
+        'label': 'HospitalViewSet.doctors / DoctorsByHospitalAPIView',
+        'collection': 'authentication_customuser',
+        'filter': {'hospital_id': 1, 'role': 'Doctor'},
+    },
+    {
+        'label': 'DoctorListAPIView',
+        'collection': 'authentication_customuser',
+        'filter': {'role': 'Doctor'},
+    },
+    {
+        'label': 'PatientViewSet ?search=',
+        'collection': 'authentication_patient',
+        'filter': {'search_tokens': {'$all': ['p:a']}},
+    },
+    {
+        'label': 'FieldViewSet',
+        'collection': 'field',
+        'filter': {'category_id': 1},
+    },
+    {
+        'label': 'anchor_documents worker',
+        'collection': 'document_anchor',
+        'filter': {'status': 'pending', 'next_attempt_at': {'$lte': datetime.utcnow()}},
+        'sort': [('next_attempt_at', 1)],
+    },
+    {
+        'label': 'anchor_documents worker (Merkle batches)',
+        'collection': 'anchor_batch',
+        'filter': {'status': 'pending', 'next_attempt_at': {'$lte': datetime.utcnow()}},
+        'sort': [('next_attempt_at', 1)],
+    },
+]
+
+
+def plan_stages(plan):
+    """Flatten a winning plan into its list of (stage, index name) pairs."""
+    stages = [(plan.get('stage'), plan.get('indexName'))]
+    if 'inputStage' in plan:
+        stages += plan_stages(plan['inputStage'])
+    for child in plan.get('inputStages', []):
+        stages += plan_stages(child)
+    return stages
+
+
+# Indexes this command once created and that are no longer declared, as
+# (collection, index name). Add an entry here when removing an index from a
+# model so that `--prune` drops it.
+RETIRED_INDEXES = []
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the MongoDB indexes declared on the models and print the explain() "
+        "plan of each hot query used by the views. With --prune, also drop the indexes "
+        "this command owns that are no longer declared; other indexes (djongo's "
+        "foreign key and unique indexes, ones added by hand) are never touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report what would change without touching the indexes.")
+        parser.add_argument('--prune', action='store_true',
+                            help="Drop retired or redefined indexes owned by this command.")
+        parser.add_argument('--no-explain', action='store_true',
+                            help="Skip the explain() report.")
+
+    def handle(self, *args, **options):
+        db = get_database()
+        self.sync_indexes(db, dry_run=options['dry_run'], prune=options['prune'])
+        if not options['no_explain']:
+            self.explain_hot_queries(db)
+
+    def sync_indexes(self, db, dry_run=False, prune=False):
+        expected = {}
+        for collection, name, keys, index_options in managed_indexes():
+            expected.setdefault(collection, {})[name] = (keys, index_options)
+        retired = {}
+        for collection, name in RETIRED_INDEXES:
+            retired.setdefault(collection, set()).add(name)
+
+        for collection in sorted(set(expected) | set(retired)):
+            wanted = expected.get(collection, {})
+            existing = db[collection].index_information()
+            existing_keys = {tuple(info['key']): name for name, info in existing.items()}
+
+            # Owned indexes that must go: retired, or redeclared with other keys
+            stale = [
+                name for name, info in existing.items()
+                if name in retired.get(collection, ())
+                or (name in wanted and list(info['key']) != [tuple(key) for key in wanted[name][0]])
+            ]
+            for name in stale:
+                if not prune:
+                    self.stdout.write(self.style.WARNING(
+                        f"  stale   {collection}.{name} {existing[name]['key']} (drop it with --prune)"
+                    ))
+                    continue
+                self.stdout.write(self.style.WARNING(f"  drop    {collection}.{name} {existing[name]['key']}"))
+                if not dry_run:
+                    db[collection].drop_index(name)
+
+            for name, (keys, index_options) in wanted.items():
+                if name in stale and not prune:
+                    continue
+                if name not in stale and tuple(keys) in existing_keys:
+                    self.stdout.write(f"  ok      {collection}.{existing_keys[tuple(keys)]}")
+                    continue
+                self.stdout.write(self.style.SUCCESS(f"  create  {collection}.{name} {keys}"))
+                if not dry_run:
+                    db[collection].create_index(keys, name=name, background=True, **index_options)
+
+    def explain_hot_queries(self, db):
+        self.stdout.write("")
+        for query in HOT_QUERIES:
+            cursor = db[query['collection']].find(query['filter'])
+            if query.get('sort'):
+                cursor = cursor.sort(query['sort'])
+            explain = cursor.explain()
+
+            stages = plan_stages(explain['queryPlanner']['winningPlan'])
+            stats = explain.get('executionStats', {})
+            plan = ' <- '.join(f"{stage}({index})" if index else stage for stage, index in stages)
+
+            line = (
+                f"{query['label']}: {plan} | keys examined: {stats.get('totalKeysExamined', '?')}, "
+                f"docs examined: {stats.get('totalDocsExamined', '?')}, "
+                f"returned: {stats.get('nReturned', '?')}"
+            )
+            if any(stage == 'COLLSCAN' for stage, _ in stages):
+                self.stdout.write(self.style.ERROR(f"COLLSCAN  {line}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"OK        {line}"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from document.services import counters, stats_cache
+
+
+class Command(BaseCommand):
+    help = "Recompute the dashboard counters from scratch (use when they have drifted)."
+
+    def handle(self, *args, **options):
+        totals = counters.rebuild()
+        # Only reaches the web workers when CACHES is shared; otherwise their
+        # entries expire within STATS_CACHE_TIMEOUT
+        stats_cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f"Counters rebuilt: {totals['categories']} categories, {totals['hospitals']} hospitals, "
+            f"{totals['documents']} documents, {totals['doctors']} doctors."
+        ))
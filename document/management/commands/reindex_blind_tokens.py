@@ -0,0 +1,69 @@
+import time
+
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from document.models import Document, Field
+from document.services import blind_index
+from document.services.mongo import get_collection
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the blind index tokens of existing documents, after blind_index "
+        "was turned on or off for a field or BLIND_INDEX_KEY_ID changed. "
+        "Decrypts each document once; safe to re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--category', type=int, action='append', dest='categories',
+                            help="Only reindex this category (repeatable). Default: every category.")
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help="Documents decrypted and updated per bulk write.")
+        parser.add_argument('--pause', type=float, default=0,
+                            help="Seconds to sleep between batches, to go easy on production.")
+
+    def handle(self, *args, **options):
+        category_ids = options['categories'] or list(
+            Field.objects.values_list('category_id', flat=True).distinct()
+        )
+        fields = blind_index.indexed_fields(category_ids)
+        collection = get_collection(Document)
+
+        for category_id, category_fields in fields.items():
+            names = ', '.join(name for _, name in category_fields) or "no field"
+            self.stdout.write(f"Category {category_id}: indexing {names}")
+
+            updated = 0
+            last_id = 0
+            while True:
+                documents = list(
+                    Document.objects.filter(category_id=category_id, id__gt=last_id)
+                    .only('id', 'patient_id', 'result', 'hash')
+                    .order_by('id')[:options['batch_size']]
+                )
+                if not documents:
+                    break
+                last_id = documents[-1].id
+
+                plaintexts = Document.decrypt_many(documents, on_error=lambda doc, e: self.report(doc, e))
+                updates = [
+                    # Matched on the hash too, in case the document was rewritten meanwhile
+                    UpdateOne(
+                        {'id': document.id, 'hash': document.hash},
+                        {'$set': {'blind_tokens': blind_index.tokens_for(plaintext, category_fields)}},
+                    )
+                    for document, plaintext in zip(documents, plaintexts) if plaintext is not None
+                ]
+                if updates:
+                    updated += collection.bulk_write(updates, ordered=False).modified_count
+                self.stdout.write(f"  {updated} updated (up to document {last_id})")
+
+                if options['pause']:
+                    time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS("Blind index tokens rebuilt."))
+
+    def report(self, document, error):
+        self.stderr.write(f"Document {document.id}: cannot decrypt ({error}), left as is.")
+        return None
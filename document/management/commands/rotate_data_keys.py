@@ -0,0 +1,81 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from pymongo import UpdateOne
+
+from document.models import PatientDataKey
+from document.services import data_keys
+from document.services.mongo import get_collection
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrap every patient data key under a master key (AES_KEY_ID by default). "
+        "Documents are not touched; safe to run while the application serves traffic."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--to', type=int, default=None,
+                            help="Master key id to rewrap under (must be in AES_KEYRING).")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Keys rewrapped per bulk write.")
+        parser.add_argument('--pause', type=float, default=0,
+                            help="Seconds to sleep between batches.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Count the keys left to rewrap without writing.")
+
+    def handle(self, *args, **options):
+        target = settings.AES_KEY_ID if options['to'] is None else options['to']
+        if target not in settings.AES_KEYRING:
+            raise CommandError(f"Master key {target} is not in AES_KEYRING.")
+
+        collection = get_collection(PatientDataKey)
+        stale = {'master_key_id': {'$ne': target}}
+        remaining = collection.count_documents(stale)
+        self.stdout.write(f"{remaining} data keys are not wrapped under master key {target}.")
+        if options['dry_run'] or not remaining:
+            return
+
+        rewrapped = failed = 0
+        last_id = 0
+        started = time.monotonic()
+        while True:
+            rows = list(
+                collection.find({**stale, 'id': {'$gt': last_id}},
+                                projection={'_id': 0, 'id': 1, 'patient_id': 1, 'master_key_id': 1, 'wrapped_key': 1})
+                .sort('id', 1)
+                .limit(options['batch_size'])
+            )
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+
+            updates = []
+            for row in rows:
+                try:
+                    fields = data_keys.rewrap(row, target)
+                except Exception as e:
+                    self.stderr.write(f"Patient {row['patient_id']}: cannot unwrap data key ({e}).")
+                    failed += 1
+                    continue
+                # Only if nobody rewrapped it meanwhile
+                updates.append(UpdateOne({'id': row['id'], 'master_key_id': row['master_key_id']}, {'$set': fields}))
+
+            if updates:
+                rewrapped += collection.bulk_write(updates, ordered=False).modified_count
+
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"  {rewrapped + failed}/{remaining} processed, {rewrapped} rewrapped, {failed} failed "
+                f"({rewrapped / max(elapsed, 1e-9):.0f} keys/s)"
+            )
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        if failed:
+            raise CommandError(f"Rewrapped {rewrapped} data keys, {failed} could not be unwrapped.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Rewrapped {rewrapped} data keys under master key {target}. "
+            f"Keep the old master keys in AES_KEYS while documents still use them: see migrate_ciphertext --reseal."
+        ))
@@ -0,0 +1,217 @@
+import base64
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from pymongo.errors import CursorNotFound
+
+from document.models import Document
+from document.services import data_keys, envelope
+from document.services.mongo import get_collection, get_database
+
+
+CHECKPOINT_COLLECTION = 'scrub_checkpoints'
+CHECKPOINT_ID = 'document'
+PROGRESS_INTERVAL = 10  # Seconds between progress lines
+
+
+def check_chunk(rows, keys):
+    """
+    Recheck each row's ciphertext against its stored hash (and GCM tag, see
+    services.envelope). Runs in the pool workers, which never touch MongoDB:
+    `keys` maps the chunk's patient ids to their data keys. Returns the
+    mismatches found and the number of ciphertext bytes checked.
+    """
+    def data_key(patient_id):
+        if patient_id not in keys:
+            raise ValueError(f"Patient {patient_id} has no data key.")
+        return keys[patient_id]
+
+    mismatches = []
+    checked_bytes = 0
+    for document_id, patient_id, result, stored_hash in rows:
+        try:
+            # Binary rows are checked as they are; legacy rows are base64 text
+            encrypted_bytes = base64.b64decode(result, validate=True) if isinstance(result, str) else result
+        except Exception as e:
+            mismatches.append({'document_id': document_id, 'problem': 'undecodable', 'detail': str(e)})
+            continue
+        checked_bytes += len(encrypted_bytes)
+        if not envelope.verify(encrypted_bytes, stored_hash, lambda: data_key(patient_id)):
+            mismatches.append({
+                'document_id': document_id,
+                'problem': 'hash_mismatch',
+                'stored_hash': stored_hash,
+                'computed_hash': envelope.content_hash(encrypted_bytes),
+            })
+    return mismatches, checked_bytes
+
+
+class RateLimiter:
+    """Sleeps just enough to keep the documents/s and MB/s averages under their limits."""
+
+    def __init__(self, max_docs_per_second=None, max_mb_per_second=None):
+        self.max_docs = max_docs_per_second
+        self.max_bytes = max_mb_per_second * 1024 * 1024 if max_mb_per_second else None
+        self.started = time.monotonic()
+        self.docs = 0
+        self.bytes = 0
+
+    def wait(self, docs, size):
+        self.docs += docs
+        self.bytes += size
+        earliest = 0
+        if self.max_docs:
+            earliest = max(earliest, self.docs / self.max_docs)
+        if self.max_bytes:
+            earliest = max(earliest, self.bytes / self.max_bytes)
+        delay = earliest - (time.monotonic() - self.started)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Command(BaseCommand):
+    """
+    The pool workers get the unwrapped data keys of each chunk's patients,
+    pickled over the pool's pipes, so for the length of a scan those keys
+    also live in the worker processes' memory (and in any core dump or swap
+    of them). Run it on a host trusted with the master key.
+    """
+    help = (
+        "Recheck every stored document ciphertext and report the ones that no longer "
+        "match their hash. An interrupted scan resumes from its checkpoint "
+        "unless --restart is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Hashing processes.")
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Documents read from MongoDB and hashed per task.")
+        parser.add_argument('--report', default='scrub_report.jsonl',
+                            help="File the mismatches are appended to, one JSON object per line.")
+        parser.add_argument('--restart', action='store_true',
+                            help="Drop the checkpoint of an interrupted scan and start over.")
+        parser.add_argument('--max-docs-per-second', type=float, default=None,
+                            help="Throttle the scan to run next to production traffic.")
+        parser.add_argument('--max-mb-per-second', type=float, default=None,
+                            help="Throttle the scan by ciphertext volume read.")
+
+    def handle(self, *args, **options):
+        checkpoints = get_database()[CHECKPOINT_COLLECTION]
+        if options['restart']:
+            checkpoints.delete_one({'_id': CHECKPOINT_ID})
+
+        checkpoint = checkpoints.find_one({'_id': CHECKPOINT_ID})
+        if checkpoint is None or checkpoint.get('finished_at'):
+            # Only an interrupted run is resumed; a finished one starts a new scan
+            checkpoint = {
+                '_id': CHECKPOINT_ID, 'last_id': 0, 'scanned': 0, 'bytes': 0, 'mismatches': 0,
+                'started_at': timezone.now(),
+            }
+        if checkpoint['last_id']:
+            self.stdout.write(f"Resuming after document {checkpoint['last_id']} "
+                              f"({checkpoint['scanned']} already scanned).")
+
+        limiter = RateLimiter(options['max_docs_per_second'], options['max_mb_per_second'])
+        max_in_flight = options['workers'] * 2
+        run = {'scanned': 0, 'bytes': 0, 'mismatches': 0}
+        started = last_progress = time.monotonic()
+
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool, \
+                open(options['report'], 'a') as report:
+            in_flight = deque()
+
+            def collect():
+                # Chunks complete in submission order, so the checkpoint only moves past ids that were checked
+                last_id, count, future = in_flight.popleft()
+                mismatches, hashed_bytes = future.result()
+                for mismatch in mismatches:
+                    report.write(json.dumps(mismatch) + "\n")
+                report.flush()
+
+                run['mismatches'] += len(mismatches)
+                checkpoint['last_id'] = last_id
+                checkpoint['scanned'] += count
+                checkpoint['bytes'] += hashed_bytes
+                checkpoint['mismatches'] += len(mismatches)
+                checkpoint['updated_at'] = timezone.now()
+                checkpoints.replace_one({'_id': CHECKPOINT_ID}, checkpoint, upsert=True)
+
+            for rows in self.read_chunks(checkpoint['last_id'], options['chunk_size']):
+                size = sum(len(result) for _, _, result, _ in rows)
+                limiter.wait(len(rows), size)
+
+                keys = self.load_data_keys({patient_id for _, patient_id, _, _ in rows})
+                in_flight.append((rows[-1][0], len(rows), pool.submit(check_chunk, rows, keys)))
+                run['scanned'] += len(rows)
+                run['bytes'] += size
+                if len(in_flight) >= max_in_flight:
+                    collect()
+
+                if time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                    last_progress = time.monotonic()
+                    self.stdout.write(self.throughput(run, last_progress - started))
+
+            while in_flight:
+                collect()
+
+        checkpoints.update_one({'_id': CHECKPOINT_ID}, {'$set': {'finished_at': timezone.now()}})
+        self.stdout.write(self.throughput(run, time.monotonic() - started))
+
+        if run['mismatches']:
+            raise CommandError(f"{run['mismatches']} documents failed the check, see {options['report']}.")
+        self.stdout.write(self.style.SUCCESS("All scanned documents match their hash."))
+
+    @staticmethod
+    def load_data_keys(patient_ids):
+        keys = {}
+        for patient_id in patient_ids:
+            try:
+                keys[patient_id] = data_keys.get_data_key(patient_id)
+            except ValueError:
+                pass  # No data key: the patient's documents predate envelope encryption
+        return keys
+
+    def read_chunks(self, after_id, chunk_size):
+        """Yield lists of (id, patient_id, result, hash) in id order, reopening the cursor if the server drops it."""
+        collection = get_collection(Document)
+        while True:
+            cursor = collection.find(
+                {'id': {'$gt': after_id}},
+                projection={'_id': 0, 'id': 1, 'patient_id': 1, 'result': 1, 'hash': 1},
+            ).sort('id', 1).batch_size(chunk_size)
+
+            rows = []
+            try:
+                for row in cursor:
+                    rows.append((row['id'], row['patient_id'], row['result'], row['hash']))
+                    if len(rows) == chunk_size:
+                        yield rows
+                        after_id = rows[-1][0]
+                        rows = []
+            except CursorNotFound:
+                # Idle too long under a tight rate limit: carry on from the last row read
+                if rows:
+                    yield rows
+                    after_id = rows[-1][0]
+                continue
+            finally:
+                cursor.close()
+
+            if rows:
+                yield rows
+            return
+
+    @staticmethod
+    def throughput(run, elapsed):
+        elapsed = max(elapsed, 1e-9)
+        return (
+            f"{run['scanned']} documents, {run['bytes'] / 1024 / 1024:.1f} MB in {elapsed:.1f}s "
+            f"({run['scanned'] / elapsed:.0f} docs/s, {run['bytes'] / 1024 / 1024 / elapsed:.2f} MB/s), "
+            f"{run['mismatches']} mismatches"
+        )
@@ -0,0 +1,48 @@
+# Generated by Django 3.1.12 on 2026-10-18 09:15
+
+from django.db import migrations, models
+
+
+# djongo does not reliably translate index DDL, so the indexes are built with
+# pymongo and only recorded in the migration state through AddIndex.
+INDEXES = [
+    ('document', 'document_history_idx', [('patient_id', 1), ('category_id', 1), ('created_at', -1), ('id', -1)]),
+    ('field', 'field_category_idx', [('category_id', 1)]),
+]
+
+
+def create_indexes(apps, schema_editor):
+    db = schema_editor.connection.connection
+    for collection, name, keys in INDEXES:
+        db[collection].create_index(keys, name=name, background=True)
+
+
+def drop_indexes(apps, schema_editor):
+    db = schema_editor.connection.connection
+    for collection, name, keys in INDEXES:
+        db[collection].drop_index(name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0003_auto_20250304_1238'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='document',
+                    index=models.Index(fields=['patient', 'category', '-created_at', '-id'], name='document_history_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='field',
+                    index=models.Index(fields=['category'], name='field_category_idx'),
+                ),
+            ],
+        ),
+    ]
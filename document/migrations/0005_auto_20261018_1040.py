@@ -0,0 +1,42 @@
+# Generated by Django 3.1.12 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+# See 0004: indexes are built with pymongo, AddIndex only updates the state.
+INDEXES = [
+    ('document', 'document_category_idx', [('category_id', 1)]),
+]
+
+
+def create_indexes(apps, schema_editor):
+    db = schema_editor.connection.connection
+    for collection, name, keys in INDEXES:
+        db[collection].create_index(keys, name=name, background=True)
+
+
+def drop_indexes(apps, schema_editor):
+    db = schema_editor.connection.connection
+    for collection, name, keys in INDEXES:
+        db[collection].drop_index(name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0004_auto_20261018_0915'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='document',
+                    index=models.Index(fields=['category'], name='document_category_idx'),
+                ),
+            ],
+        ),
+    ]
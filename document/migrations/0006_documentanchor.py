@@ -0,0 +1,62 @@
+# Generated by Django 3.1.12 on 2026-10-18 11:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+# See 0004: indexes are built with pymongo, AddIndex only updates the state.
+INDEXES = [
+    ('document_anchor', 'anchor_status_due_idx', [('status', 1), ('next_attempt_at', 1)]),
+]
+
+
+def create_indexes(apps, schema_editor):
+    db = schema_editor.connection.connection
+    for collection, name, keys in INDEXES:
+        db[collection].create_index(keys, name=name, background=True)
+
+
+def drop_indexes(apps, schema_editor):
+    db = schema_editor.connection.connection
+    for collection, name, keys in INDEXES:
+        db[collection].drop_index(name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0005_auto_20261018_1040'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentAnchor',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('document_hash', models.CharField(max_length=64)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('confirmed', 'Confirmed'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('tx_hash', models.CharField(blank=True, default='', max_length=66)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='anchor', to='document.document')),
+            ],
+            options={
+                'db_table': 'document_anchor',
+            },
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='documentanchor',
+                    index=models.Index(fields=['status', 'next_attempt_at'], name='anchor_status_due_idx'),
+                ),
+            ],
+        ),
+    ]
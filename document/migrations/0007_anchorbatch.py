@@ -0,0 +1,86 @@
+# Generated by Django 3.1.12 on 2026-10-18 12:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import djongo.models.fields
+
+
+# See 0004: indexes are built with pymongo, AddIndex only updates the state.
+INDEXES = [
+    ('anchor_batch', 'anchor_batch_due_idx', [('status', 1), ('next_attempt_at', 1)]),
+    ('document_anchor', 'anchor_batch_idx', [('batch_id', 1)]),
+]
+
+
+def create_indexes(apps, schema_editor):
+    db = schema_editor.connection.connection
+    for collection, name, keys in INDEXES:
+        db[collection].create_index(keys, name=name, background=True)
+
+
+def drop_indexes(apps, schema_editor):
+    db = schema_editor.connection.connection
+    for collection, name, keys in INDEXES:
+        db[collection].drop_index(name)
+
+
+STATUS_CHOICES = [('pending', 'Pending'), ('batched', 'Batched'), ('sent', 'Sent'), ('confirmed', 'Confirmed'), ('failed', 'Failed')]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0006_documentanchor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnchorBatch',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=STATUS_CHOICES, default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('tx_hash', models.CharField(blank=True, default='', max_length=66)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('root', models.CharField(blank=True, default='', max_length=64)),
+                ('size', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'anchor_batch',
+            },
+        ),
+        migrations.AlterField(
+            model_name='documentanchor',
+            name='status',
+            field=models.CharField(choices=STATUS_CHOICES, default='pending', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='documentanchor',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='anchors', to='document.anchorbatch'),
+        ),
+        migrations.AddField(
+            model_name='documentanchor',
+            name='proof',
+            field=djongo.models.fields.JSONField(blank=True, default=None, null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='anchorbatch',
+                    index=models.Index(fields=['status', 'next_attempt_at'], name='anchor_batch_due_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='documentanchor',
+                    index=models.Index(fields=['batch'], name='anchor_batch_idx'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.1.12 on 2026-10-18 14:00
+
+from django.db import migrations
+import document.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0007_anchorbatch'),
+    ]
+
+    operations = [
+        # MongoDB has no column type to change and djongo cannot translate the
+        # ALTER, so only the state moves. Existing base64 rows keep reading
+        # through CiphertextField until `manage.py migrate_ciphertext` converts them.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='document',
+                    name='result',
+                    field=document.fields.CiphertextField(),
+                ),
+            ],
+        ),
+    ]
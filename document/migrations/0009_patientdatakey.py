@@ -0,0 +1,29 @@
+# Generated by Django 3.1.12 on 2026-10-18 15:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0003_auto_20261018_0915'),
+        ('document', '0008_auto_20261018_1400'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientDataKey',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('master_key_id', models.PositiveSmallIntegerField()),
+                ('wrapped_key', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('rotated_at', models.DateTimeField(blank=True, null=True)),
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='data_key', to='authentication.patient')),
+            ],
+            options={
+                'db_table': 'patient_data_key',
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.1.12 on 2026-10-18 16:20
+
+from django.db import migrations, models
+import djongo.models.fields
+
+
+# See 0004: indexes are built with pymongo, AddIndex only updates the state.
+INDEXES = [
+    ('document', 'document_blind_idx', [('blind_tokens', 1), ('patient_id', 1)]),
+]
+
+
+def create_indexes(apps, schema_editor):
+    db = schema_editor.connection.connection
+    for collection, name, keys in INDEXES:
+        db[collection].create_index(keys, name=name, background=True)
+
+
+def drop_indexes(apps, schema_editor):
+    db = schema_editor.connection.connection
+    for collection, name, keys in INDEXES:
+        db[collection].drop_index(name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0009_patientdatakey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='field',
+            name='blind_index',
+            field=models.BooleanField(default=False, help_text="Store a keyed hash of this field's value with each document so that documents can be filtered on it without decrypting them."),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='blind_tokens',
+            field=djongo.models.fields.JSONField(blank=True, default=list),
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='document',
+                    index=models.Index(fields=['blind_tokens', 'patient'], name='document_blind_idx'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.12 on 2026-10-18 18:05
+
+from django.db import migrations
+import djongo.models.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0010_blind_index'),
+    ]
+
+    operations = [
+        # djongo's JSONField rejects None, so the default becomes an empty list.
+        # Mongo has no column defaults: only the model state changes.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='documentanchor',
+                    name='proof',
+                    field=djongo.models.fields.JSONField(blank=True, default=list, null=True),
+                ),
+            ],
+        ),
+    ]
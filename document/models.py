@@ -1,13 +1,28 @@
 from authentication.models import CustomUser, Patient
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives import padding
-from cryptography.hazmat.backends import default_backend
-import hashlib
-import base64
-import os
+from concurrent.futures import ThreadPoolExecutor
+import threading
 from djongo import models
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+from document.fields import CiphertextField
+from document.services import blind_index, data_keys, envelope, plaintext_cache
+
+
+_decrypt_executor = None
+_decrypt_executor_lock = threading.Lock()
+
+
+def _get_decrypt_executor():
+    # Created lazily so that each gunicorn worker builds its own pool after fork
+    global _decrypt_executor
+    with _decrypt_executor_lock:
+        if _decrypt_executor is None:
+            _decrypt_executor = ThreadPoolExecutor(
+                max_workers=settings.DOCUMENT_DECRYPT_WORKERS,
+                thread_name_prefix="document-decrypt",
+            )
+        return _decrypt_executor
 
 
 class Category(models.Model):
@@ -52,9 +67,17 @@ class Field(models.Model):
         default=list,
         help_text="Allowed file types for file fields. Example: ['pdf', 'docx', 'jpg']"
     )
+    blind_index = models.BooleanField(
+        default=False,
+        help_text="Store a keyed hash of this field's value with each document so that "
+                  "documents can be filtered on it without decrypting them."
+    )
 
     class Meta:
         db_table = 'field'
+        indexes = [
+            models.Index(fields=['category'], name='field_category_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.field_type})"
@@ -72,6 +95,9 @@ class Field(models.Model):
         if self.field_type != 'file' and self.file_types:
             raise ValidationError("File types should only be set for file fields.")
 
+        if self.blind_index and self.field_type in ('file', 'textarea'):
+            raise ValidationError("Only short values can be blind-indexed, not file or textarea fields.")
+
     def save(self, *args, **kwargs):
         self.full_clean()  # Calls the clean method
         super().save(*args, **kwargs)
@@ -87,61 +113,212 @@ class Hospital(models.Model):
     def __str__(self):
         return self.name
 
+class PatientDataKey(models.Model):
+    """
+    Per-patient data key that encrypts the patient's documents, stored wrapped
+    (AES-GCM) under a master key of settings.AES_KEYRING. Rotating the master
+    key only rewraps these rows (`manage.py rotate_data_keys`), never the
+    documents. See services.data_keys.
+    """
+    id = models.BigAutoField(primary_key=True)
+    patient = models.OneToOneField(Patient, on_delete=models.CASCADE, related_name='data_key')
+    master_key_id = models.PositiveSmallIntegerField()
+    wrapped_key = models.BinaryField()  # nonce + AES-GCM(master key, data key)
+    created_at = models.DateTimeField(auto_now_add=True)
+    rotated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'patient_data_key'
+
+    def __str__(self):
+        return f"Data key of patient {self.patient_id} (master key {self.master_key_id})"
+
+
 class Document(models.Model):
     id = models.BigAutoField(primary_key=True)
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     doctor = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
-    result = models.TextField()        # Base64-encoded ciphertext
-    hash = models.CharField(max_length=64)  # SHA-256 of raw ciphertext
+    result = CiphertextField()         # services.envelope ciphertext; legacy rows are base64 text
+    hash = models.CharField(max_length=64)  # envelope.content_hash() of the ciphertext
+    blind_tokens = models.JSONField(blank=True, default=list)  # services.blind_index tokens
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         db_table = "document"
+        indexes = [
+            # History and keyset pagination: filter on (patient, category), newest first
+            models.Index(fields=['patient', 'category', '-created_at', '-id'], name='document_history_idx'),
+            # Per-category document counts (services.stats)
+            models.Index(fields=['category'], name='document_category_idx'),
+            # Filtering a patient's documents on a blind-indexed field (multikey)
+            models.Index(fields=['blind_tokens', 'patient'], name='document_blind_idx'),
+        ]
 
     @staticmethod
-    def encrypt_data(plaintext: str, key: bytes) -> bytes:
-        iv = os.urandom(16)
-        cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-        encryptor = cipher.encryptor()
-
-        padder = padding.PKCS7(algorithms.AES.block_size).padder()
-        padded_data = padder.update(plaintext.encode()) + padder.finalize()
-
-        ciphertext = encryptor.update(padded_data) + encryptor.finalize()
-        return iv + ciphertext
+    def encrypt_data(plaintext: str, patient_id: int) -> bytes:
+        # AES-GCM envelope (services.envelope) under the patient's data key
+        return envelope.seal(plaintext.encode(), data_key=data_keys.get_data_key(patient_id, create=True))
 
     @staticmethod
-    def decrypt_data(encrypted_bytes: bytes, key: bytes) -> str:
-        iv = encrypted_bytes[:16]
-        ciphertext = encrypted_bytes[16:]
-        cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-        decryptor = cipher.decryptor()
+    def decrypt_data(encrypted_bytes: bytes, patient_id: int, stored_hash: str = None, get_data_key=None) -> str:
+        # The format and key come from the envelope header; legacy CBC rows have none
+        # and are recognised by their stored hash. `get_data_key` replaces the lookup
+        # of the patient's data key (decrypt_many resolves them beforehand).
+        if get_data_key is None:
+            def get_data_key():
+                return data_keys.get_data_key(patient_id)
+        return envelope.open_envelope(encrypted_bytes, get_data_key, stored_hash).decode()
 
-        padded_data = decryptor.update(ciphertext) + decryptor.finalize()
-        unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
-        plaintext = unpadder.update(padded_data) + unpadder.finalize()
-        return plaintext.decode()
+    def encrypt_result(self, blind_fields=None):
+        """
+        Encrypt the plaintext held in `self.result` in place and set `self.hash`
+        and `self.blind_tokens`. Called by save(); bulk_create() callers must call
+        it themselves, passing the category's `blind_index.indexed_fields()` to
+        save a query per document.
+        """
+        if blind_fields is None:
+            blind_fields = blind_index.indexed_fields([self.category_id])[self.category_id]
+        self.blind_tokens = blind_index.tokens_for(self.result, blind_fields)
+        self.result = self.encrypt_data(self.result, self.patient_id)
+        # Hash of header, nonce and tag: the GCM tag already covers the payload
+        self.hash = envelope.content_hash(self.result)
 
     def save(self, *args, **kwargs):
-        encryption_key = settings.RAW_AES_KEY
-        if not encryption_key:
-            raise ValueError("AES_KEY not found in settings (RAW_AES_KEY).")
-
-        # Encrypt plaintext (self.result)
-        encrypted_bytes = self.encrypt_data(self.result, encryption_key)
-        # Base64-encode the ciphertext
-        self.result = base64.b64encode(encrypted_bytes).decode('utf-8')
-        # Compute SHA-256 of the raw encrypted bytes
-        self.hash = hashlib.sha256(encrypted_bytes).hexdigest()
-        print(f"🔵 Computed Hash (Before Storing): {self.hash}")
+        # A str is plaintext still to encrypt; bytes were loaded from the database
+        if isinstance(self.result, str):
+            self.encrypt_result()
+            print(f"🔵 Computed Hash (Before Storing): {self.hash}")
 
         super().save(*args, **kwargs)
 
     def get_plaintext_result(self) -> str:
-        encryption_key = settings.RAW_AES_KEY
-        if not encryption_key:
-            raise ValueError("AES_KEY not found in settings (RAW_AES_KEY).")
+        cached = plaintext_cache.get(self)
+        if cached is not None:
+            return cached
+
+        plaintext = self.decrypt_data(self.result, self.patient_id, self.hash)
+        plaintext_cache.put(self, plaintext)
+        return plaintext
+
+    @classmethod
+    def decrypt_many(cls, documents, on_error=None) -> list:
+        """
+        Decrypt a batch of documents and return the plaintexts in the same order.
+
+        The AES work runs on a bounded thread pool (cryptography releases the
+        GIL while decrypting). When `on_error` is given, a failing document is
+        replaced by the value of `on_error(document, exception)` instead of
+        aborting the batch.
+        """
+        documents = list(documents)
+        results = [plaintext_cache.get(document) for document in documents]
+        pending = [document for document, cached in zip(documents, results) if cached is None]
+
+        # Data keys are resolved here, once per patient: the pool threads never
+        # query the database and never look up the same key concurrently
+        keys = {}
+        for document in pending:
+            header = envelope.parse_header(document.result)
+            if header and header[0] == envelope.FORMAT_GCM_DATA_KEY and document.patient_id not in keys:
+                try:
+                    keys[document.patient_id] = data_keys.get_data_key(document.patient_id)
+                except Exception as e:
+                    keys[document.patient_id] = e
+
+        def decrypt(document):
+            def get_data_key():
+                data_key = keys.get(document.patient_id)
+                if isinstance(data_key, Exception):
+                    raise data_key
+                return data_key
+
+            try:
+                plaintext = cls.decrypt_data(document.result, document.patient_id, document.hash, get_data_key)
+                plaintext_cache.put(document, plaintext)
+                return plaintext
+            except Exception as e:
+                if on_error is None:
+                    raise
+                return on_error(document, e)
 
-        encrypted_bytes = base64.b64decode(self.result)
-        return self.decrypt_data(encrypted_bytes, encryption_key)
\ No newline at end of file
+        # Small batches are cheaper to decrypt inline than to hand to the pool
+        if len(pending) < settings.DOCUMENT_DECRYPT_PARALLEL_THRESHOLD:
+            plaintexts = iter([decrypt(document) for document in pending])
+        else:
+            plaintexts = _get_decrypt_executor().map(decrypt, pending)
+        return [next(plaintexts) if cached is None else cached for cached in results]
+
+
+class AnchorTask(models.Model):
+    """
+    Shared state of an on-chain anchoring job, driven by `manage.py anchor_documents`
+    (document/services/anchoring.py).
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_BATCHED = 'batched'      # Documents only: waiting on their AnchorBatch
+    STATUS_SENT = 'sent'            # Transaction submitted, waiting for its receipt
+    STATUS_CONFIRMED = 'confirmed'
+    STATUS_FAILED = 'failed'        # Gave up after ANCHOR_MAX_ATTEMPTS
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_BATCHED, 'Batched'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_CONFIRMED, 'Confirmed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    tx_hash = models.CharField(max_length=66, blank=True, default='')
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+
+
+class AnchorBatch(AnchorTask):
+    """
+    A Merkle tree over many document hashes (ANCHOR_MODE=merkle); only its root
+    is written on chain.
+    """
+    root = models.CharField(max_length=64, blank=True, default='')
+    size = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'anchor_batch'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='anchor_batch_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"Anchor batch {self.id} ({self.size} documents, {self.status})"
+
+
+class DocumentAnchor(AnchorTask):
+    """
+    Outbox row for anchoring a document hash on chain.
+
+    Written next to the document so that creating a document never waits on
+    the RPC node. The hash is either anchored on its own or, in Merkle mode,
+    as a leaf of `batch`, with `proof` holding its inclusion proof.
+    """
+    document = models.OneToOneField(Document, on_delete=models.CASCADE, related_name='anchor')
+    document_hash = models.CharField(max_length=64)
+    batch = models.ForeignKey(AnchorBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='anchors')
+    proof = models.JSONField(blank=True, null=True, default=list)  # Empty outside Merkle batches
+
+    class Meta:
+        db_table = 'document_anchor'
+        indexes = [
+            # The worker polls for due rows of a given status
+            models.Index(fields=['status', 'next_attempt_at'], name='anchor_status_due_idx'),
+            models.Index(fields=['batch'], name='anchor_batch_idx'),
+        ]
+
+    def __str__(self):
+        return f"Anchor for document {self.document_id} ({self.status})"
@@ -0,0 +1,70 @@
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # Optional: the renderers fall back to the json module
+    orjson = None
+
+
+_encoder = encoders.JSONEncoder()
+
+if orjson is not None:
+    # Dates and times go through DRF's encoder so the output matches JSONRenderer ("...Z")
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def dumps(data):
+    """Compact UTF-8 JSON of `data`, with orjson when it is installed."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, default=_encoder.default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            pass  # E.g. an integer over 64 bits: let the json module try
+    return json.dumps(data, cls=encoders.JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson, several times faster on the large
+    lists of the patient, doctor and history endpoints. Indented output (the
+    browsable API, `Accept: application/json; indent=4`) and installs without
+    orjson keep the stock renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = dumps(data)
+        # Same strict JavaScript subset as JSONRenderer
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Newline-delimited JSON: one JSON object per line.
+
+    Selected with `?format=ndjson` or `Accept: application/x-ndjson`. Views
+    that stream their rows build the lines themselves with `render_rows`;
+    `render` only covers regular (non-streamed) responses such as errors.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return self.render_rows(rows)
+
+    @staticmethod
+    def render_rows(rows):
+        return b''.join(dumps(row) + b'\n' for row in rows)
@@ -2,6 +2,7 @@ from authentication.models import CustomUser
 from .models import Category, Hospital, Document,Field
 import json
 from collections import OrderedDict
+from django.db.models import Manager
 from rest_framework import serializers
 
 class FieldSerializer(serializers.ModelSerializer):
@@ -9,7 +10,7 @@ class FieldSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Field
-        fields = ['id', 'name', 'field_type', 'required', 'category', 'options', 'file_types']
+        fields = ['id', 'name', 'field_type', 'required', 'category', 'options', 'file_types', 'blind_index']
         read_only_fields = ['id']
 
     def validate(self, data):
@@ -90,14 +91,62 @@ class DoctorSerializer(serializers.ModelSerializer):
         fields = ['id', 'email','username', 'role', 'hospital']
 
 
+class ValuesSerializer:
+    """
+    Fast path for read-only lists: maps `values_list()` rows straight to dicts,
+    skipping the per-field, per-row work of a ModelSerializer. The columns
+    are compiled once from the ModelSerializer it stands in for, which must
+    only have plain model fields and primary key relations.
+    Enabled with API_FAST_SERIALIZERS.
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self._columns = None
+
+    def compile(self):
+        if self._columns is None:
+            fields = self.serializer_class().fields
+            self._columns = (tuple(fields), tuple(field.source for field in fields.values()))
+        return self._columns
+
+    def many(self, queryset):
+        names, sources = self.compile()
+        return [dict(zip(names, row)) for row in queryset.values_list(*sources)]
+
+
+DOCTOR_VALUES = ValuesSerializer(DoctorSerializer)
+
+
+class DocumentListSerializer(serializers.ListSerializer):
+    """
+    Decrypts the whole list with Document.decrypt_many before serializing,
+    instead of decrypting row by row in get_decrypted_result.
+    """
+    def to_representation(self, data):
+        documents = list(data.all() if isinstance(data, Manager) else data)
+        plaintexts = Document.decrypt_many(
+            documents,
+            on_error=lambda doc, e: f"Error decrypting result: {str(e)}"
+        )
+        self.context['decrypted_results'] = {
+            doc.pk: plaintext for doc, plaintext in zip(documents, plaintexts)
+        }
+        return super().to_representation(documents)
+
+
 class DocumentSerializer(serializers.ModelSerializer):
     decrypted_result = serializers.SerializerMethodField()
 
     class Meta:
         model = Document
         fields = ['id', 'patient_id', 'category_id', 'doctor_id', 'decrypted_result', 'hash', 'created_at']
+        list_serializer_class = DocumentListSerializer
 
     def get_decrypted_result(self, obj):
+        decrypted_results = self.context.get('decrypted_results')
+        if decrypted_results is not None and obj.pk in decrypted_results:
+            return decrypted_results[obj.pk]
         try:
             return obj.get_plaintext_result()
         except Exception as e:
@@ -0,0 +1,459 @@
+"""
+Blockchain anchoring outbox.
+
+Documents are no longer anchored inside the request: DocumentAPIView writes
+a `DocumentAnchor` row next to each document and `manage.py anchor_documents`
+drains those rows through BlockchainService. A row goes pending -> sent when
+its transaction is submitted and sent -> confirmed once the receipt is mined.
+Failed submissions, reverted transactions and transactions that never get a
+receipt go back to pending with a jittered exponential backoff, and are
+marked failed after ANCHOR_MAX_ATTEMPTS.
+
+A transaction without a receipt after ANCHOR_RECEIPT_TIMEOUT_SECONDS may
+still be mined, so a row is never sent twice blindly: if its hash is already
+stored on chain the row is confirmed, if the node still knows the
+transaction the deadline is pushed back, and only a dropped transaction is
+sent again. A row that was sent before is checked on chain once more right
+before the new transaction goes out.
+
+With ANCHOR_MODE=merkle, pending documents are instead grouped into an
+`AnchorBatch` (document status "batched") and only the batch's Merkle root
+goes through that same lifecycle; each document keeps its inclusion proof
+and follows the batch to confirmed or failed.
+
+The document and its anchor are two inserts (djongo gives no multi-document
+transactions), so every cycle also re-enqueues recent documents that ended
+up without an anchor row.
+
+Several workers can run side by side: a due row is claimed with a
+conditional update that pushes `next_attempt_at` past the current time, so
+only one worker submits it.
+"""
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo import UpdateOne
+
+from document.models import AnchorBatch, Document, DocumentAnchor
+
+from . import merkle
+from .blockchain import get_blockchain_service
+from .mongo import get_collection
+
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_CHUNK = 500
+
+
+def backoff_delay(attempts):
+    """Seconds to wait before the next try after `attempts` failures."""
+    ceiling = min(
+        settings.ANCHOR_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1),
+        settings.ANCHOR_BACKOFF_MAX_SECONDS,
+    )
+    # Jitter so that rows failing together do not retry together
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def enqueue(documents):
+    """Create the pending anchor rows for documents that were just inserted."""
+    return DocumentAnchor.objects.bulk_create([
+        DocumentAnchor(document_id=document.id, document_hash=document.hash)
+        for document in documents
+    ])
+
+
+def enqueue_missing(since_id=None):
+    """
+    Create anchor rows for documents that have none and return how many were added.
+
+    Only documents past the newest anchored one (minus ANCHOR_RECONCILE_LOOKBACK
+    ids) are checked unless `since_id` is given; `since_id=0` backfills the
+    whole collection.
+    """
+    if since_id is None:
+        newest = (DocumentAnchor.objects.order_by('-document_id')
+                  .values_list('document_id', flat=True).first())
+        since_id = max((newest or 0) - settings.ANCHOR_RECONCILE_LOOKBACK, 0)
+
+    rows = (Document.objects.filter(id__gt=since_id).order_by('id')
+            .values_list('id', 'hash').iterator(chunk_size=RECONCILE_CHUNK))
+
+    added = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == RECONCILE_CHUNK:
+            added += _enqueue_unanchored(chunk)
+            chunk = []
+    if chunk:
+        added += _enqueue_unanchored(chunk)
+    return added
+
+
+def _enqueue_unanchored(rows):
+    anchored = set(DocumentAnchor.objects.filter(
+        document_id__in=[document_id for document_id, _ in rows]
+    ).values_list('document_id', flat=True))
+
+    missing = [
+        DocumentAnchor(document_id=document_id, document_hash=document_hash)
+        for document_id, document_hash in rows if document_id not in anchored
+    ]
+    if missing:
+        DocumentAnchor.objects.bulk_create(missing)
+        logger.info(f"🔵 Enqueued {len(missing)} unanchored documents")
+    return len(missing)
+
+
+def verify_on_chain(document, service):
+    """
+    Check `document.hash` against the chain, through the batch root and the
+    stored inclusion proof when the document was anchored in a Merkle batch.
+    Returns None while the document's anchor is not confirmed yet.
+    """
+    anchor = DocumentAnchor.objects.filter(document_id=document.id).only('status', 'batch', 'proof').first()
+    if anchor is None or anchor.status != DocumentAnchor.STATUS_CONFIRMED:
+        return None
+    if anchor.batch_id is not None:
+        return service.verify_document(document.id, document.hash, proof=anchor.proof, batch_id=anchor.batch_id)
+    return service.verify_document(document.id, document.hash)
+
+
+def verify_many_on_chain(documents, service):
+    """
+    Check many documents against the chain with one batched lookup.
+
+    Returns a dict of document id -> "valid", "invalid" or "missing". Like
+    verify_on_chain(), only documents whose anchor is confirmed are looked up;
+    the others are "missing". Documents sharing a Merkle batch share a single
+    root lookup.
+    """
+    documents = list(documents)
+    anchors = {
+        anchor.document_id: anchor
+        for anchor in DocumentAnchor.objects.filter(
+            document_id__in=[document.id for document in documents],
+            status=DocumentAnchor.STATUS_CONFIRMED,
+        ).only('document', 'batch', 'proof')
+    }
+    results = {document.id: "missing" for document in documents if document.id not in anchors}
+    documents = [document for document in documents if document.id in anchors]
+    if not documents:
+        return results
+
+    def lookup_id(document):
+        anchor = anchors[document.id]
+        if anchor.batch_id is not None:
+            return merkle.ROOT_ID_OFFSET + anchor.batch_id
+        return document.id
+
+    stored = service.get_stored_hashes({lookup_id(document) for document in documents})
+
+    for document in documents:
+        value = stored.get(lookup_id(document))
+        anchor = anchors[document.id]
+        if not value:
+            results[document.id] = "missing"
+        elif anchor.batch_id is not None:
+            results[document.id] = "valid" if merkle.verify(document.hash, anchor.proof or [], value) else "invalid"
+        else:
+            results[document.id] = "valid" if value == document.hash else "invalid"
+    return results
+
+
+class AnchorWorker:
+    """
+    One worker over the outbox. `service` defaults to a BlockchainService on
+    `rpc_url` (or settings.RPC_URL); pass any object with `store_document()`,
+    `get_receipt()`, `get_stored_hashes()` and `get_transaction()` (and
+    optionally the batched `store_documents()` and `get_receipts()`) to run
+    against a local test node or a stand-in.
+    """
+
+    def __init__(self, service=None, rpc_url=None, batch_size=None, mode=None):
+        self._service = service
+        self.rpc_url = rpc_url
+        self.batch_size = batch_size or settings.ANCHOR_BATCH_SIZE
+        self.mode = mode or settings.ANCHOR_MODE
+
+    @property
+    def service(self):
+        # Built on first use: loading the contract needs a reachable node
+        if self._service is None:
+            if self.rpc_url:
+                from document.services.eth_service import BlockchainService
+                self._service = BlockchainService(rpc_url=self.rpc_url)
+            else:
+                self._service = get_blockchain_service()
+        return self._service
+
+    def run_once(self):
+        """Run one cycle and return counts of what happened."""
+        stats = {'enqueued': enqueue_missing(), 'batched': 0, 'sent': 0, 'confirmed': 0, 'retried': 0, 'failed': 0}
+        if self.mode == 'merkle':
+            self.cut_batches(stats)
+        else:
+            self.submit_due(DocumentAnchor, stats)
+        # Batches and single sends left over from the other mode still complete
+        self.submit_due(AnchorBatch, stats)
+        self.check_receipts(DocumentAnchor, stats)
+        self.check_receipts(AnchorBatch, stats)
+        return stats
+
+    def cut_batches(self, stats):
+        """Group pending documents into batches of up to ANCHOR_MERKLE_MAX_LEAVES."""
+        max_leaves = settings.ANCHOR_MERKLE_MAX_LEAVES
+        while True:
+            now = timezone.now()
+            rows = list(DocumentAnchor.objects.filter(
+                status=DocumentAnchor.STATUS_PENDING,
+                batch=None,
+                next_attempt_at__lte=now,
+            ).order_by('id').values_list('id', 'created_at')[:max_leaves])
+            if not rows:
+                return
+
+            # A partial batch waits until its oldest document has waited out the window
+            window_start = now - timedelta(seconds=settings.ANCHOR_MERKLE_WINDOW_SECONDS)
+            if len(rows) < max_leaves and rows[0][1] > window_start:
+                return
+
+            # Not due until sealed, so no worker submits it with an empty root
+            batch = AnchorBatch.objects.create(
+                next_attempt_at=now + timedelta(seconds=settings.ANCHOR_LEASE_SECONDS)
+            )
+            DocumentAnchor.objects.filter(
+                pk__in=[pk for pk, _ in rows],
+                status=DocumentAnchor.STATUS_PENDING,
+                batch=None,
+            ).update(batch=batch, status=DocumentAnchor.STATUS_BATCHED, updated_at=now)
+
+            size = self.seal(batch)
+            if not size:
+                batch.delete()  # Another worker claimed every row first
+                continue
+
+            AnchorBatch.objects.filter(pk=batch.pk).update(next_attempt_at=timezone.now())
+            stats['batched'] += size
+            logger.info(f"🔵 Anchor batch {batch.id} built over {size} documents")
+
+    def seal(self, batch):
+        """Build the batch's tree from its members, store the proofs and the root."""
+        members = list(DocumentAnchor.objects.filter(batch=batch).order_by('id').values_list('id', 'document_hash'))
+        if not members:
+            return 0
+
+        root, proofs = merkle.build([document_hash for _, document_hash in members])
+        get_collection(DocumentAnchor).bulk_write([
+            UpdateOne({'id': pk}, {'$set': {'proof': proof}})
+            for (pk, _), proof in zip(members, proofs)
+        ], ordered=False)
+        AnchorBatch.objects.filter(pk=batch.pk).update(root=root, size=len(members))
+        batch.root, batch.size = root, len(members)
+        return len(members)
+
+    def anchor_args(self, task):
+        """The `(chain id, hash)` pair storeDocument is called with for `task`."""
+        if isinstance(task, AnchorBatch):
+            if not task.root:
+                self.seal(task)  # A worker stopped between building and sealing it
+            return merkle.ROOT_ID_OFFSET + task.id, task.root
+        return task.document_id, task.document_hash
+
+    def store_many(self, items):
+        service = self.service
+        if hasattr(service, 'store_documents'):
+            return service.store_documents(items)
+
+        results = []
+        for document_id, document_hash in items:
+            try:
+                results.append(service.store_document(document_id, document_hash))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def fetch_receipts(self, tx_hashes):
+        service = self.service
+        if hasattr(service, 'get_receipts'):
+            return service.get_receipts(tx_hashes)
+        return {tx_hash: service.get_receipt(tx_hash) for tx_hash in tx_hashes}
+
+    def claim(self, task, now):
+        lease_until = now + timedelta(seconds=settings.ANCHOR_LEASE_SECONDS)
+        claimed = type(task).objects.filter(
+            pk=task.pk,
+            status=task.STATUS_PENDING,
+            next_attempt_at__lte=now,
+        ).update(next_attempt_at=lease_until, updated_at=now)
+        return claimed == 1
+
+    def submit_due(self, model, stats):
+        now = timezone.now()
+        due = list(model.objects.filter(
+            status=model.STATUS_PENDING,
+            next_attempt_at__lte=now,
+        ).order_by('next_attempt_at')[:self.batch_size])
+        if not due:
+            return
+
+        self.service  # Fail the cycle before claiming anything if the node is unreachable
+        claimed = [task for task in due if self.claim(task, now)]  # Skip rows another worker got
+        claimed = self.skip_anchored(claimed, stats)
+        if not claimed:
+            return
+
+        # Sent back to back with locally managed nonces, receipts are checked later
+        results = self.store_many([self.anchor_args(task) for task in claimed])
+
+        sent_at = timezone.now()
+        for task, result in zip(claimed, results):
+            if isinstance(result, Exception):
+                logger.warning(f"⚠️ Anchoring {task} failed: {str(result)}")
+                stats[self.retry(task, result, model.STATUS_PENDING)] += 1
+                continue
+
+            model.objects.filter(pk=task.pk).update(
+                status=model.STATUS_SENT,
+                tx_hash=result,
+                last_error='',
+                # Deadline for the receipt before the transaction is sent again
+                next_attempt_at=sent_at + timedelta(seconds=settings.ANCHOR_RECEIPT_TIMEOUT_SECONDS),
+                updated_at=sent_at,
+            )
+            stats['sent'] += 1
+            logger.info(f"✅ {task} sent. Tx Hash: {result}")
+
+    def check_receipts(self, model, stats):
+        sent = list(model.objects.filter(
+            status=model.STATUS_SENT,
+        ).order_by('next_attempt_at')[:self.batch_size])
+        if not sent:
+            return
+
+        try:
+            receipts = self.fetch_receipts([task.tx_hash for task in sent])
+        except Exception as e:
+            # The node is unreachable, not the transactions lost: look again next cycle
+            logger.warning(f"⚠️ Receipt lookup failed: {str(e)}")
+            return
+
+        now = timezone.now()
+        timed_out = []
+        for task in sent:
+            receipt = receipts.get(task.tx_hash)
+            if receipt is None:
+                if task.next_attempt_at <= now:
+                    timed_out.append(task)
+                continue
+
+            if receipt['status'] == 1:
+                self.confirm(task, model.STATUS_SENT, stats)
+                logger.info(f"✅ {task} anchored in block {receipt['blockNumber']}")
+            else:
+                error = f"Transaction {task.tx_hash} reverted"
+                stats[self.retry(task, error, model.STATUS_SENT)] += 1
+
+        if timed_out:
+            self.handle_timeouts(model, timed_out, stats)
+
+    def handle_timeouts(self, model, tasks, stats):
+        """
+        Settle sent rows whose receipt did not come in time without ever
+        having two transactions for the same row in flight.
+        """
+        try:
+            anchored = self.anchored_on_chain(tasks)
+        except Exception as e:
+            logger.warning(f"⚠️ On-chain lookup failed: {str(e)}")
+            return
+
+        now = timezone.now()
+        for task in tasks:
+            if task.pk in anchored:
+                # Mined, the receipt lookup just missed it
+                self.confirm(task, model.STATUS_SENT, stats)
+                logger.info(f"✅ {task} found on chain after the receipt timeout")
+                continue
+
+            try:
+                known = self.service.get_transaction(task.tx_hash) is not None
+            except Exception as e:
+                logger.warning(f"⚠️ Transaction lookup failed for {task.tx_hash}: {str(e)}")
+                continue
+            if known:
+                # Still waiting to be mined: a new transaction could anchor it twice
+                model.objects.filter(pk=task.pk, status=model.STATUS_SENT, tx_hash=task.tx_hash).update(
+                    next_attempt_at=now + timedelta(seconds=settings.ANCHOR_RECEIPT_TIMEOUT_SECONDS),
+                    updated_at=now,
+                )
+                logger.warning(f"⚠️ {task}: {task.tx_hash} is still pending, waiting longer")
+                continue
+
+            error = f"{task.tx_hash} dropped without a receipt after {settings.ANCHOR_RECEIPT_TIMEOUT_SECONDS}s"
+            stats[self.retry(task, error, model.STATUS_SENT)] += 1
+
+    def anchored_on_chain(self, tasks):
+        """Primary keys of the tasks whose hash is already what the chain stores."""
+        args = {task.pk: self.anchor_args(task) for task in tasks}
+        stored = self.service.get_stored_hashes({chain_id for chain_id, _ in args.values()})
+        return {pk for pk, (chain_id, value) in args.items() if value and stored.get(chain_id) == value}
+
+    def skip_anchored(self, tasks, stats):
+        """
+        Confirm the claimed rows that were sent before and turn out to be on
+        chain already, and return the ones still to send.
+        """
+        resent = [task for task in tasks if task.tx_hash]
+        if not resent:
+            return tasks
+        try:
+            anchored = self.anchored_on_chain(resent)
+        except Exception as e:
+            # Unsure whether they are anchored: leave them until their lease runs out
+            logger.warning(f"⚠️ On-chain lookup failed: {str(e)}")
+            return [task for task in tasks if not task.tx_hash]
+
+        for task in resent:
+            if task.pk in anchored:
+                self.confirm(task, task.STATUS_PENDING, stats)
+                logger.info(f"✅ {task} already on chain, not sent again")
+        return [task for task in tasks if task.pk not in anchored]
+
+    def confirm(self, task, current_status, stats):
+        now = timezone.now()
+        type(task).objects.filter(
+            pk=task.pk, status=current_status, tx_hash=task.tx_hash
+        ).update(status=task.STATUS_CONFIRMED, updated_at=now)
+        if isinstance(task, AnchorBatch):
+            DocumentAnchor.objects.filter(batch=task).update(
+                status=DocumentAnchor.STATUS_CONFIRMED, tx_hash=task.tx_hash, updated_at=now
+            )
+        stats['confirmed'] += 1
+
+    def retry(self, task, error, current_status):
+        """Schedule the next attempt (or give up) and return the stats key to bump."""
+        attempts = task.attempts + 1
+        now = timezone.now()
+        update = {'attempts': attempts, 'last_error': str(error)[:1000], 'updated_at': now}
+
+        if attempts >= settings.ANCHOR_MAX_ATTEMPTS:
+            update['status'] = task.STATUS_FAILED
+            outcome = 'failed'
+            logger.error(f"❌ Giving up anchoring {task} after {attempts} attempts")
+        else:
+            update['status'] = task.STATUS_PENDING
+            update['next_attempt_at'] = now + timedelta(seconds=backoff_delay(attempts))
+            outcome = 'retried'
+
+        type(task).objects.filter(pk=task.pk, status=current_status).update(**update)
+        if outcome == 'failed' and isinstance(task, AnchorBatch):
+            DocumentAnchor.objects.filter(batch=task).update(
+                status=DocumentAnchor.STATUS_FAILED, last_error=update['last_error'], updated_at=now
+            )
+        return outcome
@@ -0,0 +1,113 @@
+"""
+Blind indexes: equality search on encrypted document fields.
+
+A `Field` with `blind_index` set gets one token per document written to its
+category, `HMAC-SHA256(key, field id | normalized value)` truncated to 128
+bits, stored in `Document.blind_tokens` next to the ciphertext. The array is
+indexed together with the patient, so `?filter_field=&filter_value=` on the
+history endpoint is one index lookup and only the matching rows get
+decrypted.
+
+The HMAC key is derived with HKDF from master key BLIND_INDEX_KEY_ID (by
+default AES_LEGACY_KEY_ID, which rotation leaves alone) and never
+leaves the server; without it a token reveals nothing but equality with other
+tokens of the same field. Values are normalized (Unicode NFKC, case folded,
+whitespace collapsed) so that "  Type A " and "type a" match.
+"""
+import hashlib
+import hmac
+import json
+import unicodedata
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from django.conf import settings
+
+from . import envelope
+
+
+TOKEN_BYTES = 16
+MAX_VALUE_LENGTH = 1024  # Longer values (free text, files) are not indexed
+HKDF_INFO = b'document blind index v1'
+
+_key = None
+
+
+def _get_key():
+    global _key
+    if _key is None:
+        _key = HKDF(
+            algorithm=hashes.SHA256(), length=32, salt=None, info=HKDF_INFO,
+        ).derive(envelope.get_key(settings.BLIND_INDEX_KEY_ID))
+    return _key
+
+
+def normalize(value):
+    """Canonical text of a field value, or None if it is not indexable."""
+    if isinstance(value, bool):
+        value = 'true' if value else 'false'
+    elif isinstance(value, (int, float)):
+        value = repr(value)
+    elif not isinstance(value, str):
+        return None
+    value = ' '.join(unicodedata.normalize('NFKC', value).casefold().split())
+    if not value or len(value) > MAX_VALUE_LENGTH:
+        return None
+    return value
+
+
+def token(field_id, value):
+    """Token of `value` for field `field_id`, or None if the value is not indexable."""
+    value = normalize(value)
+    if value is None:
+        return None
+    message = f"{field_id}\x00{value}".encode()
+    return hmac.new(_get_key(), message, hashlib.sha256).digest()[:TOKEN_BYTES].hex()
+
+
+def indexed_fields(category_ids):
+    """Map each category id to the `(field id, field name)` pairs it blind-indexes."""
+    from document.models import Field
+
+    fields = {category_id: [] for category_id in category_ids}
+    rows = Field.objects.filter(category_id__in=list(fields), blind_index__in=[True]).values_list('category_id', 'id', 'name')
+    for category_id, field_id, name in rows:
+        fields[category_id].append((field_id, name))
+    return fields
+
+
+def tokens_for(plaintext, fields):
+    """Tokens of a plaintext result (JSON object keyed by field name) for `fields`."""
+    if not fields:
+        return []
+    try:
+        values = json.loads(plaintext)
+    except (TypeError, ValueError):
+        return []
+    if not isinstance(values, dict):
+        return []
+
+    tokens = []
+    for field_id, name in fields:
+        value = values.get(name)
+        # A multi-select value indexes each of its options
+        for item in value if isinstance(value, list) else [value]:
+            item_token = token(field_id, item)
+            if item_token is not None and item_token not in tokens:
+                tokens.append(item_token)
+    return tokens
+
+
+def matching_ids(patient_id, field_id, value):
+    """Ids of the patient's documents whose field `field_id` equals `value`."""
+    from document.models import Document
+    from .mongo import get_collection
+
+    value_token = token(field_id, value)
+    if value_token is None:
+        return []
+    cursor = get_collection(Document).find(
+        {'blind_tokens': value_token, 'patient_id': patient_id},
+        projection={'_id': 0, 'id': 1},
+    )
+    return [row['id'] for row in cursor]
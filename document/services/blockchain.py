@@ -0,0 +1,73 @@
+"""
+Process-wide access to BlockchainService.
+
+Building the service reads and parses the contract ABI, derives the account
+from PRIVATE_KEY and opens an HTTP provider, and importing web3 alone is slow
+enough to hurt boot. `get_blockchain_service()` builds it once per process,
+on first use or from the optional warm-up thread, over a keep-alive session
+with a bounded connection pool and request timeouts.
+
+Forked children (gunicorn --preload) drop the instance inherited from the
+parent and build their own: pooled sockets must not be shared across fork.
+"""
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+_service = None
+_lock = threading.Lock()
+_warm_up_requested = False
+
+
+def get_blockchain_service():
+    global _service
+    if _service is None:
+        with _lock:
+            if _service is None:
+                # Imported here so that loading the views never imports web3
+                from document.services.eth_service import BlockchainService
+                _service = BlockchainService(session=_build_session())
+                logger.info(f"✅ Blockchain service ready (pid {os.getpid()})")
+    return _service
+
+
+def _build_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.BLOCKCHAIN_HTTP_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def warm_up():
+    """Build the service in a background thread so the first request does not pay for it."""
+    global _warm_up_requested
+    _warm_up_requested = True
+
+    def build():
+        try:
+            get_blockchain_service()
+        except Exception as e:
+            # The first request builds it (or reports the error) instead
+            logger.error(f"❌ Blockchain warm-up failed: {str(e)}")
+
+    threading.Thread(target=build, name="blockchain-warmup", daemon=True).start()
+
+
+def _reset_after_fork():
+    global _service, _lock
+    _service = None
+    _lock = threading.Lock()  # May have been held by another thread at fork time
+    if _warm_up_requested:
+        warm_up()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
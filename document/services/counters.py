@@ -0,0 +1,155 @@
+"""
+Incrementally maintained dashboard counters.
+
+The `dashboard_counters` collection holds one `totals` document plus one
+document per hospital and per category. Model signals (document/signals.py)
+keep them current with atomic `$inc` updates, so the dashboard and stats
+views read everything with a single `find()` instead of counting.
+
+Increments never upsert the count documents: until the collection has been
+seeded, `snapshot()` rebuilds it from the aggregation pipelines in
+services.stats, and `manage.py rebuild_counters` does the same on demand
+when the counters drift.
+"""
+from pymongo import DeleteMany, ReplaceOne, UpdateOne
+
+from authentication.models import CustomUser
+
+from . import stats
+from .mongo import get_database
+
+
+COLLECTION = 'dashboard_counters'
+TOTALS_ID = 'totals'
+
+
+def _collection():
+    return get_database()[COLLECTION]
+
+
+def _hospital_id(hospital_id):
+    return f'hospital:{hospital_id}'
+
+
+def _category_id(category_id):
+    return f'category:{category_id}'
+
+
+def record_documents(category_id, delta):
+    _collection().bulk_write([
+        UpdateOne({'_id': TOTALS_ID}, {'$inc': {'documents': delta}}),
+        UpdateOne({'_id': _category_id(category_id)}, {'$inc': {'num_documents': delta}}),
+    ], ordered=False)
+
+
+def move_doctor(before, after):
+    """
+    Apply a doctor's change of state. `before` and `after` are
+    `(is_doctor, hospital_id)` tuples.
+    """
+    operations = []
+    for (is_doctor, hospital_id), delta in ((before, -1), (after, 1)):
+        if not is_doctor:
+            continue
+        operations.append(UpdateOne({'_id': TOTALS_ID}, {'$inc': {'doctors': delta}}))
+        if hospital_id is not None:
+            operations.append(UpdateOne({'_id': _hospital_id(hospital_id)}, {'$inc': {'num_doctors': delta}}))
+    if operations:
+        _collection().bulk_write(operations, ordered=False)
+
+
+def save_hospital(hospital, created):
+    operations = [UpdateOne(
+        {'_id': _hospital_id(hospital.id)},
+        {'$set': {'kind': 'hospital', 'ref_id': hospital.id, 'name': hospital.name},
+         '$setOnInsert': {'num_doctors': 0}},
+        upsert=True,
+    )]
+    if created:
+        operations.append(UpdateOne({'_id': TOTALS_ID}, {'$inc': {'hospitals': 1}}))
+    _collection().bulk_write(operations, ordered=False)
+
+
+def delete_hospital(hospital_id):
+    _collection().bulk_write([
+        DeleteMany({'_id': _hospital_id(hospital_id)}),
+        UpdateOne({'_id': TOTALS_ID}, {'$inc': {'hospitals': -1}}),
+    ], ordered=False)
+
+
+def save_category(category, created):
+    operations = [UpdateOne(
+        {'_id': _category_id(category.id)},
+        {'$set': {'kind': 'category', 'ref_id': category.id, 'name': category.name},
+         '$setOnInsert': {'num_documents': 0}},
+        upsert=True,
+    )]
+    if created:
+        operations.append(UpdateOne({'_id': TOTALS_ID}, {'$inc': {'categories': 1}}))
+    _collection().bulk_write(operations, ordered=False)
+
+
+def delete_category(category_id):
+    _collection().bulk_write([
+        DeleteMany({'_id': _category_id(category_id)}),
+        UpdateOne({'_id': TOTALS_ID}, {'$inc': {'categories': -1}}),
+    ], ordered=False)
+
+
+def rebuild():
+    """Recompute every counter from scratch and replace the stored values."""
+    hospitals = stats.hospital_doctor_counts()
+    categories = stats.category_document_counts()
+
+    rows = [{
+        '_id': TOTALS_ID,
+        'categories': len(categories),
+        'hospitals': len(hospitals),
+        'documents': sum(c['num_documents'] for c in categories),
+        'doctors': CustomUser.objects.filter(role='Doctor').count(),
+    }]
+    rows += [
+        {'_id': _hospital_id(h['id']), 'kind': 'hospital', 'ref_id': h['id'],
+         'name': h['name'], 'num_doctors': h['num_doctors']}
+        for h in hospitals
+    ]
+    rows += [
+        {'_id': _category_id(c['id']), 'kind': 'category', 'ref_id': c['id'],
+         'name': c['name'], 'num_documents': c['num_documents']}
+        for c in categories
+    ]
+
+    operations = [ReplaceOne({'_id': row['_id']}, row, upsert=True) for row in rows]
+    operations.append(DeleteMany({'_id': {'$nin': [row['_id'] for row in rows]}}))
+    _collection().bulk_write(operations, ordered=True)
+    return rows[0]
+
+
+def snapshot():
+    """
+    Return the current counters as
+    `{"totals": {...}, "hospital_stats": [...], "category_stats": [...]}`.
+    """
+    rows = list(_collection().find({}))
+    totals = next((row for row in rows if row['_id'] == TOTALS_ID), None)
+    if totals is None:
+        # Never seeded (or wiped): build the counters once, then read them back
+        rebuild()
+        rows = list(_collection().find({}))
+        totals = next(row for row in rows if row['_id'] == TOTALS_ID)
+
+    hospital_stats = sorted(
+        ({'id': row['ref_id'], 'name': row.get('name'), 'num_doctors': row.get('num_doctors', 0)}
+         for row in rows if row.get('kind') == 'hospital'),
+        key=lambda item: item['id'],
+    )
+    category_stats = sorted(
+        ({'id': row['ref_id'], 'name': row.get('name'), 'num_documents': row.get('num_documents', 0)}
+         for row in rows if row.get('kind') == 'category'),
+        key=lambda item: item['id'],
+    )
+    return {
+        'totals': {key: totals.get(key, 0) for key in ('categories', 'hospitals', 'documents', 'doctors')},
+        'hospital_stats': hospital_stats,
+        'category_stats': category_stats,
+    }
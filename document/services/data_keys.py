@@ -0,0 +1,107 @@
+"""
+Per-patient data keys (envelope encryption).
+
+Each patient's documents are encrypted with a random 256-bit data key. The
+data key is stored in `patient_data_key`, wrapped with AES-GCM under a
+master key from settings.AES_KEYRING. Rotating a master key then means
+rewrapping one small row per patient (`manage.py rotate_data_keys`)
+instead of re-encrypting every document.
+
+Unwrapped data keys are kept in a bounded in-memory LRU with a TTL
+(DOCUMENT_DATA_KEY_CACHE_SIZE entries, DOCUMENT_DATA_KEY_CACHE_TTL seconds).
+Rewrapping does not change a data key, so rotation never has to
+invalidate the cache.
+"""
+import logging
+import os
+import struct
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+from django.utils import timezone
+
+from . import envelope
+from .lru import LRUCache
+
+
+logger = logging.getLogger(__name__)
+
+DATA_KEY_SIZE = 32
+NONCE_SIZE = 12
+
+_cache = LRUCache(
+    max_bytes=settings.DOCUMENT_DATA_KEY_CACHE_SIZE,
+    ttl=settings.DOCUMENT_DATA_KEY_CACHE_TTL,
+    sizeof=lambda key: 1,  # Bounded by number of keys
+)
+
+
+def _aad(patient_id, master_key_id):
+    # Ties a wrapped key to its patient and master key: rows cannot be swapped
+    return struct.pack('>QB', patient_id, master_key_id)
+
+
+def wrap(data_key, patient_id, master_key_id):
+    nonce = os.urandom(NONCE_SIZE)
+    aead = AESGCM(envelope.get_key(master_key_id))
+    return nonce + aead.encrypt(nonce, data_key, _aad(patient_id, master_key_id))
+
+
+def unwrap(wrapped_key, patient_id, master_key_id):
+    wrapped_key = bytes(wrapped_key)
+    aead = AESGCM(envelope.get_key(master_key_id))
+    return aead.decrypt(wrapped_key[:NONCE_SIZE], wrapped_key[NONCE_SIZE:], _aad(patient_id, master_key_id))
+
+
+def get_data_key(patient_id, create=False):
+    """
+    Return the patient's unwrapped data key. With `create`, a patient without
+    one gets a new key wrapped under the current master key (AES_KEY_ID).
+    """
+    from document.models import PatientDataKey
+
+    data_key = _cache.get(patient_id)
+    if data_key is not None:
+        return data_key
+
+    row = PatientDataKey.objects.filter(patient_id=patient_id).first()
+    if row is None:
+        if not create:
+            raise ValueError(f"Patient {patient_id} has no data key.")
+        row = _create(patient_id)
+
+    data_key = unwrap(row.wrapped_key, patient_id, row.master_key_id)
+    _cache.set(patient_id, data_key)
+    return data_key
+
+
+def _create(patient_id):
+    from document.models import PatientDataKey
+
+    master_key_id = settings.AES_KEY_ID
+    try:
+        return PatientDataKey.objects.create(
+            patient_id=patient_id,
+            master_key_id=master_key_id,
+            wrapped_key=wrap(os.urandom(DATA_KEY_SIZE), patient_id, master_key_id),
+        )
+    except Exception:
+        # Lost a race with another request creating the same patient's key
+        row = PatientDataKey.objects.filter(patient_id=patient_id).first()
+        if row is None:
+            raise
+        return row
+
+
+def rewrap(row, master_key_id):
+    """Return the `$set` fields that move `row` under another master key."""
+    data_key = unwrap(row['wrapped_key'], row['patient_id'], row['master_key_id'])
+    return {
+        'master_key_id': master_key_id,
+        'wrapped_key': wrap(data_key, row['patient_id'], master_key_id),
+        'rotated_at': timezone.now(),
+    }
+
+
+def discard(patient_id):
+    _cache.discard(patient_id)
@@ -0,0 +1,186 @@
+"""
+Versioned ciphertext envelope for `Document.result`.
+
+    magic "DM" (2) | format (1) | flags (1) | key id (1) | nonce (12) | ciphertext | GCM tag (16)
+
+The 5-byte header is authenticated as associated data, so the format, flags
+and key id cannot be altered without failing decryption. The key id selects
+the key from settings.AES_KEYRING for FORMAT_GCM. FORMAT_GCM_DATA_KEY
+envelopes are encrypted with the patient's data key instead
+(services.data_keys) and carry key id 0.
+
+Rows written before the envelope are a bare 16-byte IV followed by AES-CBC
+ciphertext. They are recognised by the missing magic or, if a random IV
+happens to start with it, by their stored hash, which covers the whole
+ciphertext instead of header, nonce and tag. They stay readable with the
+key settings.AES_LEGACY_KEY_ID. An envelope that fails GCM authentication
+is never retried as CBC: it has been tampered with.
+
+Plaintexts of at least DOCUMENT_COMPRESSION_MIN_BYTES are zlib-compressed
+before encryption when that makes them smaller, which is marked by
+FLAG_ZLIB in the flags byte. Results are JSON with repeated field names and
+long free text, so this usually shrinks storage, Mongo transfer and AES work.
+
+The hash of an envelope only covers header, nonce and tag. The tag already
+authenticates every ciphertext byte, so writes skip a second SHA-256 pass
+over the payload. Legacy rows keep their hash over the whole ciphertext.
+"""
+import hashlib
+import os
+import struct
+import zlib
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+
+
+MAGIC = b'DM'
+FORMAT_GCM = 0x01           # Encrypted directly with a master key
+FORMAT_GCM_DATA_KEY = 0x02  # Encrypted with the patient's data key
+FORMATS = (FORMAT_GCM, FORMAT_GCM_DATA_KEY)
+HEADER = struct.Struct('>2sBBB')  # magic, format, flags, key id
+FLAG_ZLIB = 0x01
+KNOWN_FLAGS = FLAG_ZLIB
+NONCE_SIZE = 12
+TAG_SIZE = 16
+CBC_IV_SIZE = 16
+
+_aeads = {}
+
+
+def get_key(key_id):
+    try:
+        return settings.AES_KEYRING[key_id]
+    except KeyError:
+        raise ValueError(f"Unknown AES key id {key_id}: add it to AES_KEYS.")
+
+
+def _aead(key_id):
+    # One AESGCM per key id, reused across documents and threads
+    aead = _aeads.get(key_id)
+    if aead is None:
+        aead = _aeads[key_id] = AESGCM(get_key(key_id))
+    return aead
+
+
+def parse_header(blob):
+    """Return `(format, flags, key_id)`, or None for a legacy CBC row."""
+    if len(blob) < HEADER.size + NONCE_SIZE + TAG_SIZE:
+        return None
+    magic, fmt, flags, key_id = HEADER.unpack_from(blob)
+    if magic != MAGIC or fmt not in FORMATS:
+        return None
+    return fmt, flags, key_id
+
+
+def seal(plaintext: bytes, key_id=None, data_key=None) -> bytes:
+    """
+    Compress (if worth it) and encrypt `plaintext` into a new AES-GCM envelope,
+    with `data_key` when given, else with master key `key_id` (AES_KEY_ID).
+    """
+    if data_key is not None:
+        fmt, key_id, aead = FORMAT_GCM_DATA_KEY, 0, AESGCM(data_key)
+    else:
+        key_id = settings.AES_KEY_ID if key_id is None else key_id
+        fmt, aead = FORMAT_GCM, _aead(key_id)
+
+    flags = 0
+    if settings.DOCUMENT_COMPRESSION_LEVEL and len(plaintext) >= settings.DOCUMENT_COMPRESSION_MIN_BYTES:
+        compressed = zlib.compress(plaintext, settings.DOCUMENT_COMPRESSION_LEVEL)
+        if len(compressed) < len(plaintext):
+            plaintext, flags = compressed, flags | FLAG_ZLIB
+
+    header = HEADER.pack(MAGIC, fmt, flags, key_id)
+    nonce = os.urandom(NONCE_SIZE)
+    return header + nonce + aead.encrypt(nonce, plaintext, header)
+
+
+def is_legacy(blob: bytes, stored_hash=None) -> bool:
+    """
+    Whether `blob` is a legacy CBC row. A row whose IV starts like a header is
+    told apart by `stored_hash`, the SHA-256 of the whole ciphertext.
+    """
+    return _classify(blob, stored_hash)[0]
+
+
+def _classify(blob, stored_hash):
+    """
+    Return `(legacy, digest)`. `digest` is the SHA-256 of the whole blob when
+    it had to be computed, else None. An envelope whose header hash matches
+    `stored_hash` is never hashed in full.
+    """
+    if parse_header(blob) is None:
+        return True, None
+    if stored_hash is None or _envelope_hash(blob) == stored_hash:
+        return False, None
+    digest = hashlib.sha256(blob).hexdigest()
+    return digest == stored_hash, digest
+
+
+def open_envelope(blob: bytes, get_data_key=None, stored_hash=None) -> bytes:
+    """
+    Decrypt an envelope or a legacy CBC row, whichever `blob` is.
+    `get_data_key()` supplies the data key, only called for FORMAT_GCM_DATA_KEY.
+    `stored_hash` (`Document.hash`) is needed to read the rare legacy row that
+    looks like an envelope. Raises InvalidTag if an envelope fails authentication.
+    """
+    if is_legacy(blob, stored_hash):
+        return _decrypt_cbc(blob)
+
+    fmt, flags, key_id = parse_header(blob)
+    header = blob[:HEADER.size]
+    nonce = blob[HEADER.size:HEADER.size + NONCE_SIZE]
+    if fmt == FORMAT_GCM_DATA_KEY:
+        if get_data_key is None:
+            raise ValueError("This ciphertext needs its patient's data key.")
+        aead = AESGCM(get_data_key())
+    else:
+        aead = _aead(key_id)
+    plaintext = aead.decrypt(nonce, blob[HEADER.size + NONCE_SIZE:], header)
+
+    if flags & ~KNOWN_FLAGS:
+        raise ValueError(f"Unsupported envelope flags {flags:#04x}.")
+    if flags & FLAG_ZLIB:
+        plaintext = zlib.decompress(plaintext)
+    return plaintext
+
+
+def _decrypt_cbc(blob):
+    key = get_key(settings.AES_LEGACY_KEY_ID)
+    iv, ciphertext = blob[:CBC_IV_SIZE], blob[CBC_IV_SIZE:]
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend()).decryptor()
+    padded_data = decryptor.update(ciphertext) + decryptor.finalize()
+    unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+    return unpadder.update(padded_data) + unpadder.finalize()
+
+
+def _envelope_hash(blob):
+    return hashlib.sha256(blob[:HEADER.size + NONCE_SIZE] + blob[-TAG_SIZE:]).hexdigest()
+
+
+def content_hash(blob: bytes) -> str:
+    """The hash stored in `Document.hash` for this ciphertext."""
+    if parse_header(blob) is not None:
+        return _envelope_hash(blob)
+    return hashlib.sha256(blob).hexdigest()
+
+
+def verify(blob: bytes, stored_hash: str, get_data_key=None) -> bool:
+    """
+    Check a stored ciphertext against its stored hash. For an envelope the GCM
+    tag is authenticated too, since the hash does not cover the payload.
+    """
+    legacy, digest = _classify(blob, stored_hash)
+    if legacy:
+        return (digest or hashlib.sha256(blob).hexdigest()) == stored_hash
+    if _envelope_hash(blob) != stored_hash:
+        return False
+    try:
+        open_envelope(blob, get_data_key)
+    except (InvalidTag, ValueError):
+        return False
+    return True
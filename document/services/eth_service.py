@@ -1,12 +1,57 @@
 import os
 import json
+import logging
+import threading
+from hexbytes import HexBytes
 from web3 import Web3
+from web3.exceptions import TransactionNotFound
 from django.conf import settings
+from document.services import merkle
+
+logger = logging.getLogger(__name__)
+
+# Node error messages that mean our local nonce no longer matches the chain
+NONCE_ERRORS = ("nonce too low", "nonce too high", "invalid nonce", "replacement transaction underpriced")
+
+
+class NonceManager:
+    """
+    Hands out consecutive nonces for one account without asking the node for
+    each transaction, so several signed transactions can be in flight at once.
+
+    The starting point is the account's pending transaction count, read on
+    first use and again after `resync()` (called when a send fails, since the
+    nonce it reserved may now be a gap).
+    """
+
+    def __init__(self, web3, address):
+        self.web3 = web3
+        self.address = address
+        self._lock = threading.Lock()
+        self._next = None
+
+    def next(self):
+        with self._lock:
+            if self._next is None:
+                self._next = self.web3.eth.get_transaction_count(self.address, 'pending')
+            nonce = self._next
+            self._next += 1
+            return nonce
+
+    def resync(self):
+        with self._lock:
+            self._next = None
+
 
 class BlockchainService:
-    def __init__(self):
-        # Load Web3 connection
-        self.web3 = Web3(Web3.HTTPProvider(settings.RPC_URL))
+    def __init__(self, rpc_url=None, session=None):
+        # Load Web3 connection (rpc_url lets the anchoring worker target a local test node,
+        # session lets services.blockchain share a pooled keep-alive session)
+        self.web3 = Web3(Web3.HTTPProvider(
+            rpc_url or settings.RPC_URL,
+            request_kwargs={'timeout': settings.BLOCKCHAIN_RPC_TIMEOUT},
+            session=session,
+        ))
 
 
         # Load Contract ABI & Address
@@ -25,44 +70,168 @@ class BlockchainService:
 
         self.account = self.web3.eth.account.from_key(settings.PRIVATE_KEY)
         self.contract = self.web3.eth.contract(address=self.contract_address, abi=contract_abi)
+        self.nonces = NonceManager(self.web3, self.account.address)
+        self._chain_id = None
 
-    def store_document(self, document_id, document_hash):
+    @property
+    def chain_id(self):
+        # Passed explicitly so build_transaction() does not ask the node every time
+        if self._chain_id is None:
+            self._chain_id = self.web3.eth.chain_id
+        return self._chain_id
+
+    def send_transaction(self, function_call):
         """
-        Stores the document hash and document ID on the blockchain.
+        Signs and sends a contract call with a locally managed nonce and returns
+        the hex tx hash. A nonce error triggers one resync and retry.
         """
-        try:
-            print(f"🔵 Storing on Blockchain: Document ID: {document_id}, Hash: {document_hash}")
-
-            tx = self.contract.functions.storeDocument(document_id, document_hash).build_transaction({
+        for attempt in range(2):
+            tx = function_call.build_transaction({
                 'from': self.account.address,
-                'nonce': self.web3.eth.get_transaction_count(self.account.address),
+                'nonce': self.nonces.next(),
+                'chainId': self.chain_id,
                 'gas': 2000000,
                 'gasPrice': self.web3.to_wei('50', 'gwei')
             })
-
             signed_tx = self.web3.eth.account.sign_transaction(tx, private_key=self.account.key)
-            tx_hash = self.web3.eth.send_raw_transaction(signed_tx.raw_transaction)
-
-            print(f"✅ Transaction Sent: {self.web3.to_hex(tx_hash)}")
+            try:
+                tx_hash = self.web3.eth.send_raw_transaction(signed_tx.raw_transaction)
+            except Exception as e:
+                # Whatever went wrong, the reserved nonce was not used
+                self.nonces.resync()
+                if "already known" in str(e).lower():
+                    return self.web3.to_hex(signed_tx.hash)
+                if attempt == 0 and any(error in str(e).lower() for error in NONCE_ERRORS):
+                    continue
+                raise
             return self.web3.to_hex(tx_hash)
 
+    def store_document(self, document_id, document_hash):
+        """
+        Stores the document hash and document ID on the blockchain.
+        """
+        try:
+            logger.info(f"🔵 Storing on Blockchain: Document ID: {document_id}, Hash: {document_hash}")
+            tx_hash = self.send_transaction(self.contract.functions.storeDocument(document_id, document_hash))
+            logger.info(f"✅ Transaction Sent: {tx_hash}")
+            return tx_hash
+
         except Exception as e:
-            print(f"❌ Blockchain storage failed: {str(e)}")
+            logger.error(f"❌ Blockchain storage failed: {str(e)}")
             raise
 
+    def store_documents(self, items):
+        """
+        Sends one storeDocument transaction per `(document_id, document_hash)`
+        without waiting for receipts. Returns, in order, the tx hash of each
+        item or the exception that prevented sending it.
+        """
+        results = []
+        for document_id, document_hash in items:
+            try:
+                results.append(self.send_transaction(self.contract.functions.storeDocument(document_id, document_hash)))
+            except Exception as e:
+                logger.error(f"❌ Blockchain storage failed for {document_id}: {str(e)}")
+                results.append(e)
+        return results
+
+    def get_receipt(self, tx_hash):
+        """
+        Returns the receipt of a submitted transaction, or None while it is not mined yet.
+        """
+        try:
+            return self.web3.eth.get_transaction_receipt(tx_hash)
+        except TransactionNotFound:
+            return None
 
+    def get_transaction(self, tx_hash):
+        """
+        Returns a submitted transaction, or None once the node has dropped it.
+        """
+        try:
+            return self.web3.eth.get_transaction(tx_hash)
+        except TransactionNotFound:
+            return None
 
-    def verify_document(self, document_id, document_hash):
+    def get_receipts(self, tx_hashes):
+        """
+        Receipts of many transactions in one JSON-RPC batch, as a dict keyed by tx
+        hash ({"status", "blockNumber"} or None while not mined yet).
+        """
+        if not tx_hashes:
+            return {}
+
+        try:
+            responses = self.web3.provider.make_batch_request(
+                [("eth_getTransactionReceipt", [tx_hash]) for tx_hash in tx_hashes]
+            )
+        except NotImplementedError:
+            # Provider without batch support: one call per transaction
+            return {tx_hash: self.get_receipt(tx_hash) for tx_hash in tx_hashes}
+
+        if isinstance(responses, dict):
+            # The node rejected the batch as a whole
+            raise ValueError(f"Receipt batch failed: {responses.get('error')}")
+
+        receipts = {}
+        for tx_hash, response in zip(tx_hashes, responses):
+            if response.get("error"):
+                raise ValueError(f"Receipt lookup failed for {tx_hash}: {response['error']}")
+            receipt = response.get("result")
+            receipts[tx_hash] = receipt and {
+                "status": int(receipt["status"], 16),
+                "blockNumber": int(receipt["blockNumber"], 16),
+            }
+        return receipts
+
+
+    def get_stored_hashes(self, chain_ids):
+        """
+        getDocumentHash for many ids (document ids or Merkle root slots) in one
+        JSON-RPC batch of eth_calls. Returns a dict keyed by id, with '' where
+        nothing is stored.
+        """
+        chain_ids = list(chain_ids)
+        if not chain_ids:
+            return {}
+
+        calls = [
+            ("eth_call", [{"to": self.contract_address, "data": self.contract.encode_abi("getDocumentHash", args=[chain_id])}, "latest"])
+            for chain_id in chain_ids
+        ]
+        try:
+            responses = self.web3.provider.make_batch_request(calls)
+        except NotImplementedError:
+            # Provider without batch support: one call per id
+            return {chain_id: self.contract.functions.getDocumentHash(chain_id).call() for chain_id in chain_ids}
+
+        if isinstance(responses, dict):
+            raise ValueError(f"eth_call batch failed: {responses.get('error')}")
+
+        stored = {}
+        for chain_id, response in zip(chain_ids, responses):
+            if response.get("error"):
+                raise ValueError(f"getDocumentHash({chain_id}) failed: {response['error']}")
+            stored[chain_id] = self.web3.codec.decode(["string"], HexBytes(response["result"]))[0]
+        return stored
+
+    def verify_document(self, document_id, document_hash, proof=None, batch_id=None):
         """
         Retrieves the document hash from the blockchain and verifies it.
+        For a document anchored in a Merkle batch, pass its inclusion proof and
+        batch id: the batch root is read once and the proof is checked locally.
         """
         try:
+            if batch_id is not None:
+                root = self.contract.functions.getDocumentHash(merkle.ROOT_ID_OFFSET + batch_id).call()
+                return merkle.verify(document_hash, proof or [], root)
+
             stored_hash = self.contract.functions.getDocumentHash(document_id).call()  # ✅ NEW
-            print(f"Stored Hash on Blockchain: {stored_hash}")  # Debugging
-            print(f"Expected Hash (MongoDB): {document_hash}")  # Debugging
+            logger.debug(f"Stored Hash on Blockchain: {stored_hash}")
+            logger.debug(f"Expected Hash (MongoDB): {document_hash}")
             return stored_hash == document_hash
         except Exception as e:
-            print(f"Blockchain verification failed: {str(e)}")
+            logger.error(f"❌ Blockchain verification failed: {str(e)}")
             return False
 
 
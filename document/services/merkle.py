@@ -0,0 +1,71 @@
+"""
+Merkle trees over document hashes, so that a whole batch of documents is
+anchored with a single on-chain root.
+
+Leaves and inner nodes are hashed with different prefixes (0x00 / 0x01, as
+in RFC 6962) so an inner node can never be passed off as a leaf. A node
+without a sibling is promoted to the next level unchanged instead of being
+paired with itself.
+"""
+import hashlib
+
+
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+# Roots go through the same storeDocument(id, hash) call as single documents,
+# under ids far above any document id: ROOT_ID_OFFSET + AnchorBatch.id
+ROOT_ID_OFFSET = 2 ** 255
+
+
+def leaf_hash(document_hash):
+    return hashlib.sha256(LEAF_PREFIX + bytes.fromhex(document_hash)).digest()
+
+
+def node_hash(left, right):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def build(document_hashes):
+    """
+    Build the tree over hex `document_hashes` and return `(root, proofs)`.
+
+    `root` is hex; `proofs[i]` is the inclusion proof of `document_hashes[i]`,
+    the list of `{"side": "left"|"right", "hash": <hex>}` siblings from the
+    leaf up to the root.
+    """
+    if not document_hashes:
+        raise ValueError("Cannot build a Merkle tree without leaves.")
+
+    level = [leaf_hash(document_hash) for document_hash in document_hashes]
+    positions = list(range(len(level)))  # Position of each leaf's ancestor in `level`
+    proofs = [[] for _ in document_hashes]
+
+    while len(level) > 1:
+        for leaf, position in enumerate(positions):
+            sibling = position ^ 1
+            if sibling < len(level):
+                proofs[leaf].append({
+                    'side': 'left' if sibling < position else 'right',
+                    'hash': level[sibling].hex(),
+                })
+            positions[leaf] = position // 2
+
+        level = [
+            node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+            for i in range(0, len(level), 2)
+        ]
+
+    return level[0].hex(), proofs
+
+
+def verify(document_hash, proof, root):
+    """Check that `document_hash` is included under the hex `root`."""
+    try:
+        node = leaf_hash(document_hash)
+        for step in proof:
+            sibling = bytes.fromhex(step['hash'])
+            node = node_hash(sibling, node) if step['side'] == 'left' else node_hash(node, sibling)
+    except (KeyError, TypeError, ValueError):
+        return False
+    return node.hex() == root
@@ -0,0 +1,51 @@
+"""
+Direct pymongo access for the work djongo's SQL translation cannot do
+efficiently (index management, explain plans, aggregation pipelines).
+"""
+from django.apps import apps
+from django.db import connections
+
+
+# App labels whose models live in the project database
+MANAGED_APPS = ('authentication', 'document')
+
+# Indexes of collections only written through pymongo, which have no model to declare them:
+# (collection, index name, keys, create_index options)
+COLLECTION_INDEXES = [
+    # Failed login counters expire on their own (authentication/lockout.py)
+    ('login_lockouts', 'login_lockout_ttl_idx', [('expires_at', 1)], {'expireAfterSeconds': 0}),
+]
+
+
+def get_database(using='default'):
+    """Return the pymongo `Database` behind the djongo connection."""
+    connection = connections[using]
+    connection.ensure_connection()
+    return connection.connection
+
+
+def get_collection(model, using='default'):
+    return get_database(using)[model._meta.db_table]
+
+
+def index_keys(model, index):
+    """Translate a Django `models.Index` into a pymongo key list."""
+    keys = []
+    for field_name in index.fields:
+        direction = -1 if field_name.startswith('-') else 1
+        field = model._meta.get_field(field_name.lstrip('-'))
+        keys.append((field.column, direction))
+    return keys
+
+
+def managed_indexes():
+    """
+    Yields `(collection_name, index_name, keys, options)` for every index the
+    project declares, i.e. the `Meta.indexes` of the managed apps' models and
+    COLLECTION_INDEXES.
+    """
+    for app_label in MANAGED_APPS:
+        for model in apps.get_app_config(app_label).get_models():
+            for index in model._meta.indexes:
+                yield model._meta.db_table, index.name, index_keys(model, index), {}
+    yield from COLLECTION_INDEXES
@@ -0,0 +1,35 @@
+"""
+Opt-in cache of decrypted document results (DOCUMENT_PLAINTEXT_CACHE_BYTES).
+
+Documents never change after creation, so an entry is only served when the
+stored hash still matches: the effective key is `(document_id, hash)` and a
+stale read is impossible. Entries are dropped explicitly when a document is
+deleted (document/signals.py).
+"""
+import sys
+
+from django.conf import settings
+
+from .lru import LRUCache
+
+
+_cache = LRUCache(
+    max_bytes=settings.DOCUMENT_PLAINTEXT_CACHE_BYTES,
+    ttl=settings.DOCUMENT_PLAINTEXT_CACHE_TTL,
+    sizeof=lambda entry: sys.getsizeof(entry[1]),
+)
+
+
+def get(document):
+    entry = _cache.get(document.id)
+    if entry is not None and entry[0] == document.hash:
+        return entry[1]
+    return None
+
+
+def put(document, plaintext):
+    _cache.set(document.id, (document.hash, plaintext))
+
+
+def discard(document_id):
+    _cache.discard(document_id)
@@ -0,0 +1,83 @@
+"""
+Process-level cache of the serialized category/field schema.
+
+Every form render loads the categories with their nested fields, which only
+change when an admin edits them. The whole tree is serialized once (with
+`prefetch_related`, so two queries) and kept in this process under a
+version number. The version lives in the Django cache like the stats cache
+generation, and `Category`/`Field` write signals bump it (document/signals.py).
+
+Each entry also carries ETags: a digest of the serialized tree and of each
+category, so equal content always gets the same ETag whichever worker built
+it. With a per-process cache backend a worker cannot see another one's bump,
+so entries also expire after CATEGORY_SCHEMA_CACHE_TTL seconds.
+"""
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+VERSION_KEY = 'category-schema:version'
+
+_entry = None
+_lock = threading.Lock()
+
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Start from the clock so a lost version never matches an old entry
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def invalidate():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def _etag(data):
+    encoded = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True).encode()
+    return '"%s"' % hashlib.sha256(encoded).hexdigest()[:32]
+
+
+def _build(version):
+    from document.models import Category
+    from document.serializers import CategorySerializer
+
+    categories = CategorySerializer(Category.objects.prefetch_related('fields').order_by('id'), many=True).data
+    # Plain dicts and lists, round-tripped so that callers never share ReturnDict state
+    categories = json.loads(json.dumps(categories, cls=DjangoJSONEncoder))
+    return {
+        'version': version,
+        'expires_at': time.monotonic() + settings.CATEGORY_SCHEMA_CACHE_TTL,
+        'categories': categories,
+        'etag': _etag(categories),
+        'by_id': {category['id']: (category, _etag(category)) for category in categories},
+    }
+
+
+def get():
+    """
+    The current schema entry: `categories` (the serialized list), its `etag`,
+    and `by_id`, mapping each category id to `(category, etag)`.
+    """
+    global _entry
+    version = _version()
+    entry = _entry
+    if entry is not None and entry['version'] == version and entry['expires_at'] > time.monotonic():
+        return entry
+
+    with _lock:
+        entry = _entry
+        if entry is None or entry['version'] != version or entry['expires_at'] <= time.monotonic():
+            entry = _entry = _build(version)
+    return entry
@@ -0,0 +1,67 @@
+"""
+Aggregation pipelines behind the admin statistics.
+
+Each function is a single round trip to MongoDB: the counting happens in
+`$lookup` sub-pipelines on the server, so no document ids are copied into
+Python.
+"""
+from authentication.models import CustomUser
+from document.models import Category, Document, Hospital
+
+from .mongo import get_collection
+
+
+def _count_lookup(from_collection, foreign_field, extra_match=None):
+    """`$lookup` stage counting the rows of `from_collection` that point at `$id`."""
+    conditions = [{'$eq': ['$' + foreign_field, '$$ref_id']}]
+    for field, value in (extra_match or {}).items():
+        conditions.append({'$eq': ['$' + field, value]})
+    return {
+        '$lookup': {
+            'from': from_collection,
+            'let': {'ref_id': '$id'},
+            'pipeline': [
+                {'$match': {'$expr': {'$and': conditions}}},
+                {'$count': 'n'},
+            ],
+            'as': 'counted',
+        }
+    }
+
+
+def _count_projection(name):
+    return {
+        '$project': {
+            '_id': 0,
+            'id': 1,
+            'name': 1,
+            name: {'$ifNull': [{'$arrayElemAt': ['$counted.n', 0]}, 0]},
+        }
+    }
+
+
+def hospital_doctor_counts():
+    """[{"id", "name", "num_doctors"}, ...] for every hospital."""
+    pipeline = [
+        {'$sort': {'id': 1}},
+        _count_lookup(
+            CustomUser._meta.db_table,
+            CustomUser._meta.get_field('hospital').column,
+            extra_match={'role': 'Doctor'},
+        ),
+        _count_projection('num_doctors'),
+    ]
+    return list(get_collection(Hospital).aggregate(pipeline))
+
+
+def category_document_counts():
+    """[{"id", "name", "num_documents"}, ...] for every category."""
+    pipeline = [
+        {'$sort': {'id': 1}},
+        _count_lookup(
+            Document._meta.db_table,
+            Document._meta.get_field('category').column,
+        ),
+        _count_projection('num_documents'),
+    ]
+    return list(get_collection(Category).aggregate(pipeline))
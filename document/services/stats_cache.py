@@ -0,0 +1,98 @@
+"""
+Response cache for the admin dashboard and stats views.
+
+Entries live in the Django cache under a generation number. Write signals
+bump the generation (document/signals.py), which invalidates every entry
+at once without having to know their keys.
+
+Recomputation is single-flight: on a miss, only the caller that wins the
+`cache.add` lock recomputes, and the others poll for its result instead of
+stampeding the database.
+
+The generation only reaches the processes sharing the cache backend. With
+the default LocMemCache each web worker has its own, so a write served by
+another worker or made by a management command (`rebuild_counters`,
+`anchor_documents`, shell scripts) leaves the other workers' entries in
+place: stats can be stale for up to STATS_CACHE_TIMEOUT seconds. Configure
+a shared CACHES backend (memcached, database) to invalidate everywhere.
+
+Entries must not hold patient data: the dashboard caches the ids of the
+recent documents and decrypts them on every read.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+KEY_PREFIX = 'stats-cache'
+GENERATION_KEY = f'{KEY_PREFIX}:generation'
+METRICS = ('hits', 'misses', 'waits')
+POLL_INTERVAL = 0.05
+
+_MISSING = object()
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Start from the clock so a lost generation never resurrects old entries
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def invalidate():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, time.time_ns(), None)
+
+
+def _count(metric):
+    key = f'{KEY_PREFIX}:{metric}'
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def metrics():
+    values = cache.get_many([f'{KEY_PREFIX}:{metric}' for metric in METRICS])
+    counts = {metric: values.get(f'{KEY_PREFIX}:{metric}', 0) for metric in METRICS}
+    lookups = counts['hits'] + counts['misses']
+    counts['hit_ratio'] = round(counts['hits'] / lookups, 4) if lookups else None
+    return counts
+
+
+def get_or_compute(name, compute):
+    """Return the cached value for `name`, computing it at most once per generation."""
+    key = f'{KEY_PREFIX}:{_generation()}:{name}'
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        _count('hits')
+        return value
+
+    _count('misses')
+    lock_key = f'{key}:lock'
+    deadline = time.monotonic() + settings.STATS_CACHE_WAIT_SECONDS
+
+    while True:
+        if cache.add(lock_key, 1, settings.STATS_CACHE_LOCK_SECONDS):
+            try:
+                value = compute()
+                cache.set(key, value, settings.STATS_CACHE_TIMEOUT)
+                return value
+            finally:
+                cache.delete(lock_key)
+
+        # Another request is recomputing: wait for its result
+        time.sleep(POLL_INTERVAL)
+        value = cache.get(key, _MISSING)
+        if value is not _MISSING:
+            _count('waits')
+            return value
+        if time.monotonic() >= deadline:
+            # The recomputing request is stuck; answer without touching the cache
+            return compute()
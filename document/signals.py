@@ -0,0 +1,139 @@
+import logging
+from collections import Counter
+from functools import wraps
+
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from authentication.models import CustomUser
+
+from .models import Category, Document, Field, Hospital, PatientDataKey
+from .services import counters, data_keys, plaintext_cache, schema_cache, stats_cache
+
+logger = logging.getLogger(__name__)
+
+
+def counter_update(handler):
+    """
+    A failed counter update must never fail the write that triggered it:
+    log it and let `manage.py rebuild_counters` repair the drift.
+    """
+    @wraps(handler)
+    def wrapper(*args, **kwargs):
+        try:
+            return handler(*args, **kwargs)
+        except Exception:
+            logger.exception("⚠️ Dashboard counter update failed in %s", handler.__name__)
+    return wrapper
+
+
+# Documents
+
+@receiver(post_save, sender=Document)
+@counter_update
+def count_created_document(sender, instance, created, **kwargs):
+    if created:
+        counters.record_documents(instance.category_id, 1)
+
+
+@receiver(post_delete, sender=Document)
+@counter_update
+def count_deleted_document(sender, instance, **kwargs):
+    counters.record_documents(instance.category_id, -1)
+
+
+@counter_update
+def count_bulk_created_documents(documents):
+    """bulk_create() sends no post_save, so bulk writers call this instead."""
+    for category_id, count in Counter(doc.category_id for doc in documents).items():
+        counters.record_documents(category_id, count)
+    stats_cache.invalidate()
+
+
+# Doctors
+
+def doctor_state(user):
+    # Read straight from __dict__ so a deferred field is never loaded here
+    role = user.__dict__.get('role')
+    if role is None:
+        return None
+    return role == 'Doctor', user.__dict__.get('hospital_id')
+
+
+@receiver(post_init, sender=CustomUser)
+def remember_doctor_state(sender, instance, **kwargs):
+    instance._counted_doctor_state = doctor_state(instance)
+
+
+@receiver(post_save, sender=CustomUser)
+@counter_update
+def count_saved_doctor(sender, instance, created, **kwargs):
+    before = (False, None) if created else instance._counted_doctor_state
+    after = doctor_state(instance)
+    if before is not None and after is not None and before != after:
+        counters.move_doctor(before, after)
+        stats_cache.invalidate()
+    instance._counted_doctor_state = after
+
+
+@receiver(post_delete, sender=CustomUser)
+@counter_update
+def count_deleted_doctor(sender, instance, **kwargs):
+    state = doctor_state(instance)
+    if state is not None:
+        counters.move_doctor(state, (False, None))
+        stats_cache.invalidate()
+
+
+# Hospitals and categories
+
+@receiver(post_save, sender=Hospital)
+@counter_update
+def count_saved_hospital(sender, instance, created, **kwargs):
+    counters.save_hospital(instance, created)
+
+
+@receiver(post_delete, sender=Hospital)
+@counter_update
+def count_deleted_hospital(sender, instance, **kwargs):
+    counters.delete_hospital(instance.id)
+
+
+@receiver(post_save, sender=Category)
+@counter_update
+def count_saved_category(sender, instance, created, **kwargs):
+    counters.save_category(instance, created)
+
+
+@receiver(post_delete, sender=Category)
+@counter_update
+def count_deleted_category(sender, instance, **kwargs):
+    counters.delete_category(instance.id)
+
+
+# Cached dashboard/stats responses (doctor changes are handled above)
+
+@receiver([post_save, post_delete], sender=Document)
+@receiver([post_save, post_delete], sender=Hospital)
+@receiver([post_save, post_delete], sender=Category)
+@counter_update
+def invalidate_stats_cache(sender, **kwargs):
+    stats_cache.invalidate()
+
+
+# Serialized category/field schema
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Field)
+def invalidate_schema_cache(sender, **kwargs):
+    schema_cache.invalidate()
+
+
+@receiver(post_delete, sender=Document)
+def forget_deleted_plaintext(sender, instance, **kwargs):
+    plaintext_cache.discard(instance.id)
+
+
+@receiver(post_delete, sender=PatientDataKey)
+def forget_deleted_data_key(sender, instance, **kwargs):
+    data_keys.discard(instance.patient_id)
@@ -1,3 +1,1307 @@
-from django.test import TestCase
+import base64
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import rlp
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils.http import http_date
+from django.utils import timezone
+from hexbytes import HexBytes
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, force_authenticate
+from web3.providers.base import BaseProvider
+
+from authentication.models import CustomUser, Patient
+from document.management.commands import mongo_indexes, scrub_documents
+from document.models import AnchorBatch, Category, Document, DocumentAnchor, Field, Hospital, PatientDataKey
+from document.services.anchoring import AnchorWorker, verify_many_on_chain
+from document import conditional, signals, views
+from document.services import (
+    blind_index, blockchain, counters, data_keys, envelope, eth_service, merkle, plaintext_cache, schema_cache,
+    stats, stats_cache,
+)
+from document.services.lru import LRUCache
+from document.services.mongo import get_collection, get_database
+from document.views import (
+    AdminDashboardAPIView, CategoryViewSet, DocumentBulkAPIView, DocumentHistoryAPIView,
+    VerifyDocumentBatchAPIView,
+)
+
+
+def legacy_ciphertext(plaintext: bytes, iv: bytes) -> bytes:
+    """A row as written before the envelope: IV + AES-CBC(PKCS7(plaintext))."""
+    padder = padding.PKCS7(algorithms.AES.block_size).padder()
+    padded = padder.update(plaintext) + padder.finalize()
+    key = settings.AES_KEYRING[settings.AES_LEGACY_KEY_ID]
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend()).encryptor()
+    return iv + encryptor.update(padded) + encryptor.finalize()
+
+
+def make_document(result='{"a": "b"}', patient=None, category=None, doctor=None):
+    patient = patient or Patient.objects.create(
+        numero_identite='P1', nom='Diallo', prenom='Awa', date_naissance=datetime.date(1990, 1, 1),
+        sex='F', numero_telephone='20000000',
+    )
+    category = category or Category.objects.create(name='Analyses')
+    doctor = doctor or CustomUser.objects.create_user(email='doctor@example.com', password='secret', role='Doctor')
+    document = Document(patient=patient, category=category, doctor=doctor, result=result)
+    document.save()
+    return document
+
+
+class EnvelopeTests(SimpleTestCase):
+    def test_round_trip_with_master_key(self):
+        blob = envelope.seal(b'{"a": "b"}')
+        self.assertEqual(envelope.parse_header(blob)[0], envelope.FORMAT_GCM)
+        self.assertEqual(envelope.open_envelope(blob), b'{"a": "b"}')
+        self.assertTrue(envelope.verify(blob, envelope.content_hash(blob)))
+
+    def test_round_trip_with_data_key(self):
+        data_key = os.urandom(32)
+        blob = envelope.seal(b'{"a": "b"}', data_key=data_key)
+        self.assertEqual(envelope.parse_header(blob), (envelope.FORMAT_GCM_DATA_KEY, 0, 0))
+        self.assertEqual(envelope.open_envelope(blob, lambda: data_key), b'{"a": "b"}')
+        with self.assertRaises(ValueError):
+            envelope.open_envelope(blob)
+
+    def test_large_plaintext_is_compressed(self):
+        plaintext = b'{"note": "%s"}' % (b'stable ' * 500)
+        blob = envelope.seal(plaintext)
+        self.assertTrue(envelope.parse_header(blob)[1] & envelope.FLAG_ZLIB)
+        self.assertLess(len(blob), len(plaintext))
+        self.assertEqual(envelope.open_envelope(blob), plaintext)
+
+    def test_flipped_payload_byte_fails(self):
+        # Regression: a GCM failure used to fall back to CBC, which accepted
+        # some tampered payloads or returned garbage
+        for data_key in (None, os.urandom(32)):
+            blob = envelope.seal(b'{"diagnosis": "negative"}' * 4, data_key=data_key)
+            stored_hash = envelope.content_hash(blob)
+            start = envelope.HEADER.size + envelope.NONCE_SIZE
+            for position in range(start, len(blob) - envelope.TAG_SIZE):
+                for bit in (0x01, 0x80):
+                    tampered = bytearray(blob)
+                    tampered[position] ^= bit
+                    tampered = bytes(tampered)
+                    self.assertFalse(envelope.verify(tampered, stored_hash, lambda: data_key))
+                    with self.assertRaises(InvalidTag):
+                        envelope.open_envelope(tampered, lambda: data_key, stored_hash)
+
+    def test_sealed_blob_is_not_hashed_in_full_on_read(self):
+        data_key = os.urandom(32)
+        blob = envelope.seal(b'{"note": "%s"}' % os.urandom(64).hex().encode(), data_key=data_key)
+        stored_hash = envelope.content_hash(blob)
+        with mock.patch.object(envelope.hashlib, 'sha256', wraps=hashlib.sha256) as sha256:
+            envelope.open_envelope(blob, lambda: data_key, stored_hash)
+            self.assertTrue(envelope.verify(blob, stored_hash, lambda: data_key))
+        self.assertTrue(all(len(call.args[0]) < len(blob) for call in sha256.call_args_list))
+
+    def test_legacy_row(self):
+        blob = legacy_ciphertext(b'{"a": "b"}', os.urandom(16))
+        self.assertIsNone(envelope.parse_header(blob))
+        self.assertEqual(envelope.open_envelope(blob), b'{"a": "b"}')
+        self.assertTrue(envelope.verify(blob, hashlib.sha256(blob).hexdigest()))
+
+    def test_legacy_row_whose_iv_looks_like_a_header(self):
+        iv = envelope.HEADER.pack(envelope.MAGIC, envelope.FORMAT_GCM, 0, settings.AES_KEY_ID) + os.urandom(11)
+        blob = legacy_ciphertext(b'{"diagnosis": "negative"}', iv)
+        stored_hash = hashlib.sha256(blob).hexdigest()
+        self.assertIsNotNone(envelope.parse_header(blob))
+        self.assertEqual(envelope.open_envelope(blob, stored_hash=stored_hash), b'{"diagnosis": "negative"}')
+        self.assertTrue(envelope.verify(blob, stored_hash))
+        # Without its legacy hash it is an envelope that fails authentication
+        with self.assertRaises(InvalidTag):
+            envelope.open_envelope(blob)
+        self.assertFalse(envelope.verify(blob, envelope.content_hash(blob)))
+
+
+class DataKeyTests(TestCase):
+    def test_wrapped_key_is_bound_to_its_patient_and_master_key(self):
+        data_key = os.urandom(32)
+        wrapped = data_keys.wrap(data_key, 7, settings.AES_KEY_ID)
+        self.assertEqual(data_keys.unwrap(wrapped, 7, settings.AES_KEY_ID), data_key)
+        with self.assertRaises(InvalidTag):
+            data_keys.unwrap(wrapped, 8, settings.AES_KEY_ID)
+
+    def test_documents_use_the_patient_data_key(self):
+        document = make_document('{"a": "b"}')
+        row = PatientDataKey.objects.get(patient_id=document.patient_id)
+        self.assertEqual(row.master_key_id, settings.AES_KEY_ID)
+        self.assertEqual(envelope.parse_header(document.result)[0], envelope.FORMAT_GCM_DATA_KEY)
+
+        data_keys.discard(document.patient_id)
+        self.assertEqual(
+            data_keys.get_data_key(document.patient_id),
+            data_keys.unwrap(row.wrapped_key, document.patient_id, row.master_key_id),
+        )
+        self.assertEqual(Document.objects.get(id=document.id).get_plaintext_result(), '{"a": "b"}')
+
+    def test_missing_key_is_only_created_on_write(self):
+        with self.assertRaises(ValueError):
+            data_keys.get_data_key(987654)
+
+    def test_rotation_rewraps_without_touching_documents(self):
+        document = make_document('{"a": "b"}')
+        data_key = data_keys.get_data_key(document.patient_id)
+        keyring = {**settings.AES_KEYRING, 9: os.urandom(32)}
+        with override_settings(AES_KEYRING=keyring):
+            call_command('rotate_data_keys', '--to', '9', stdout=StringIO())
+            row = PatientDataKey.objects.get(patient_id=document.patient_id)
+            self.assertEqual(row.master_key_id, 9)
+            self.assertIsNotNone(row.rotated_at)
+            self.assertEqual(data_keys.unwrap(row.wrapped_key, document.patient_id, 9), data_key)
+
+            data_keys.discard(document.patient_id)
+            stored = Document.objects.get(id=document.id)
+            self.assertEqual(stored.result, document.result)
+            self.assertEqual(stored.get_plaintext_result(), '{"a": "b"}')
+
+
+    def test_reseal_moves_master_key_documents_to_data_keys(self):
+        cbc = make_document('{"n": 0}')
+        gcm, sealed, anchored = [
+            make_document('{"n": %d}' % i, cbc.patient, cbc.category, cbc.doctor) for i in range(1, 4)
+        ]
+        collection = get_collection(Document)
+        for document, blob in ((cbc, legacy_ciphertext(b'{"n": 0}', os.urandom(16))),
+                               (gcm, envelope.seal(b'{"n": 1}')),
+                               (anchored, envelope.seal(b'{"n": 3}'))):
+            collection.update_one({'id': document.id},
+                                  {'$set': {'result': blob, 'hash': envelope.content_hash(blob)}})
+        DocumentAnchor.objects.create(document=anchored, document_hash=envelope.content_hash(blob))
+        before = {row['id']: row['result'] for row in collection.find({}, {'id': 1, 'result': 1})}
+
+        call_command('migrate_ciphertext', '--reseal', '--dry-run', stdout=StringIO())
+        self.assertEqual({row['id']: row['result'] for row in collection.find({}, {'id': 1, 'result': 1})}, before)
+
+        for _ in range(2):  # Re-running changes nothing
+            call_command('migrate_ciphertext', '--reseal', stdout=StringIO())
+            for i, document in enumerate((cbc, gcm, sealed, anchored)):
+                stored = Document.objects.get(id=document.id)
+                self.assertEqual(stored.hash, envelope.content_hash(stored.result))
+                self.assertEqual(stored.get_plaintext_result(), '{"n": %d}' % i)
+            formats = {document.id: envelope.parse_header(Document.objects.get(id=document.id).result)[0]
+                       for document in (cbc, gcm, sealed, anchored)}
+            self.assertEqual(formats, {
+                cbc.id: envelope.FORMAT_GCM_DATA_KEY, gcm.id: envelope.FORMAT_GCM_DATA_KEY,
+                sealed.id: envelope.FORMAT_GCM_DATA_KEY, anchored.id: envelope.FORMAT_GCM,
+            })
+        self.assertEqual(Document.objects.get(id=sealed.id).result, before[sealed.id])
+
+
+class CiphertextFieldTests(TestCase):
+    def setUp(self):
+        first = make_document('{"n": 0}')
+        self.documents = [first] + [
+            make_document('{"n": %d}' % i, first.patient, first.category, first.doctor) for i in range(1, 3)
+        ]
+        self.collection = get_collection(Document)
+        # Rows as written before CiphertextField: base64 text
+        for document in self.documents:
+            self.collection.update_one({'id': document.id},
+                                       {'$set': {'result': base64.b64encode(document.result).decode()}})
+
+    def stored(self):
+        return {row['id']: row['result'] for row in self.collection.find({}, {'id': 1, 'result': 1})}
+
+    def test_legacy_base64_reads_back_as_bytes(self):
+        stored = Document.objects.get(id=self.documents[0].id)
+        self.assertEqual(stored.result, self.documents[0].result)
+        self.assertEqual(stored.get_plaintext_result(), '{"n": 0}')
+
+    def test_migrate_ciphertext_converts_rows(self):
+        self.collection.update_one({'id': self.documents[2].id}, {'$set': {'result': 'not base64!'}})
+        before = self.stored()
+        call_command('migrate_ciphertext', '--dry-run', stdout=StringIO())
+        self.assertEqual(self.stored(), before)
+
+        for _ in range(2):  # Re-running changes nothing
+            call_command('migrate_ciphertext', '--batch-size', '1', stdout=StringIO(), stderr=StringIO())
+            stored = self.stored()
+            for document in self.documents[:2]:
+                self.assertEqual(stored[document.id], document.result)
+            self.assertEqual(stored[self.documents[2].id], 'not base64!')
+        self.assertEqual(Document.objects.get(id=self.documents[1].id).get_plaintext_result(), '{"n": 1}')
+
+
+@override_settings(DOCUMENT_DECRYPT_PARALLEL_THRESHOLD=4)
+class DecryptManyTests(TestCase):
+    def setUp(self):
+        first = make_document('{"n": 0}')
+        self.documents = [first] + [
+            make_document('{"n": %d}' % i, first.patient, first.category, first.doctor) for i in range(1, 10)
+        ]
+
+    def test_plaintexts_come_back_in_order(self):
+        expected = {document.id: '{"n": %d}' % i for i, document in enumerate(self.documents)}
+        for batch in (self.documents[:2], self.documents):  # Inline, then on the thread pool
+            documents = list(Document.objects.filter(id__in=[d.id for d in batch]).order_by('-id'))
+            self.assertEqual(Document.decrypt_many(documents), [expected[document.id] for document in documents])
+
+    def test_on_error_replaces_a_failing_document(self):
+        documents = list(Document.objects.filter(id__in=[d.id for d in self.documents]).order_by('id'))
+        tampered = bytearray(documents[3].result)
+        tampered[-1] ^= 1
+        documents[3].result = bytes(tampered)
+
+        plaintexts = Document.decrypt_many(documents, on_error=lambda document, e: type(e).__name__)
+        self.assertEqual(plaintexts[3], 'InvalidTag')
+        self.assertEqual(plaintexts[4], '{"n": 4}')
+        with self.assertRaises(InvalidTag):
+            Document.decrypt_many(documents)
+
+
+    def test_data_keys_are_resolved_once_in_the_calling_thread(self):
+        data_keys.discard(self.documents[0].patient_id)
+        documents = list(Document.objects.filter(id__in=[d.id for d in self.documents]))
+        threads = []
+
+        def get_data_key(patient_id, create=False):
+            threads.append(threading.current_thread())
+            return real_get_data_key(patient_id, create)
+
+        real_get_data_key = data_keys.get_data_key
+        with mock.patch.object(data_keys, 'get_data_key', side_effect=get_data_key):
+            self.assertEqual(len(Document.decrypt_many(documents)), len(documents))
+        self.assertEqual(threads, [threading.current_thread()])
+
+
+class ScrubDocumentsTests(TestCase):
+    def setUp(self):
+        first = make_document('{"n": 0}')
+        self.documents = [first] + [
+            make_document('{"n": %d}' % i, first.patient, first.category, first.doctor) for i in range(1, 4)
+        ]
+        get_database()[scrub_documents.CHECKPOINT_COLLECTION].delete_many({})
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.report = os.path.join(directory.name, 'report.jsonl')
+        # Threads instead of processes: same code path, no fork of the test runner
+        patcher = mock.patch.object(scrub_documents, 'ProcessPoolExecutor', ThreadPoolExecutor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def scrub(self, *args):
+        output = StringIO()
+        call_command('scrub_documents', '--workers', '1', '--chunk-size', '1', '--report', self.report,
+                     *args, stdout=output)
+        return output.getvalue()
+
+    def reported(self):
+        with open(self.report) as report:
+            return [json.loads(line) for line in report]
+
+    def checkpoint(self):
+        return get_database()[scrub_documents.CHECKPOINT_COLLECTION].find_one({'_id': scrub_documents.CHECKPOINT_ID})
+
+    def test_clean_scan(self):
+        self.assertIn('All scanned documents match', self.scrub())
+        self.assertEqual(self.checkpoint()['scanned'], 4)
+        self.assertIsNotNone(self.checkpoint()['finished_at'])
+
+    def test_corrupted_rows_are_reported(self):
+        tampered = bytearray(self.documents[1].result)
+        tampered[-20] ^= 1
+        collection = get_collection(Document)
+        collection.update_one({'id': self.documents[1].id}, {'$set': {'result': bytes(tampered)}})
+        collection.update_one({'id': self.documents[2].id}, {'$set': {'result': 'not base64!'}})
+
+        with self.assertRaises(CommandError):
+            self.scrub()
+        problems = {entry['document_id']: entry['problem'] for entry in self.reported()}
+        self.assertEqual(problems, {self.documents[1].id: 'hash_mismatch', self.documents[2].id: 'undecodable'})
+
+    def test_interrupted_scan_resumes_from_its_checkpoint(self):
+        calls = []
+        real_check_chunk = scrub_documents.check_chunk
+
+        def check_chunk(rows, keys):
+            calls.append(rows[0][0])
+            if len(calls) == 3:
+                raise RuntimeError("worker died")
+            return real_check_chunk(rows, keys)
+
+        with mock.patch.object(scrub_documents, 'check_chunk', side_effect=check_chunk), \
+                self.assertRaises(RuntimeError):
+            self.scrub()
+        self.assertEqual(self.checkpoint()['last_id'], self.documents[1].id)
+        self.assertNotIn('finished_at', self.checkpoint())
+
+        # Rows before the checkpoint are not read again
+        collection = get_collection(Document)
+        collection.update_one({'id': self.documents[0].id}, {'$set': {'result': 'not base64!'}})
+        output = self.scrub()
+        self.assertIn(f"Resuming after document {self.documents[1].id}", output)
+        self.assertEqual(self.checkpoint()['scanned'], 4)
+
+        with self.assertRaises(CommandError):
+            self.scrub('--restart')
+        self.assertEqual([entry['document_id'] for entry in self.reported()], [self.documents[0].id])
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_evicts_least_recently_used_to_fit(self):
+        lru = LRUCache(max_bytes=10, ttl=60)
+        lru.set('a', 'xxxx')
+        lru.set('b', 'xxxx')
+        lru.get('a')
+        lru.set('c', 'xxxx')
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), ('xxxx', None, 'xxxx'))
+        self.assertEqual(lru.size, 8)
+
+    def test_oversized_values_and_disabled_cache_are_skipped(self):
+        lru = LRUCache(max_bytes=3, ttl=60)
+        lru.set('a', 'xxxx')
+        self.assertEqual(len(lru), 0)
+        disabled = LRUCache(max_bytes=0, ttl=60)
+        disabled.set('a', 'x')
+        self.assertIsNone(disabled.get('a'))
+
+    def test_entries_expire(self):
+        lru = LRUCache(max_bytes=10, ttl=60)
+        with mock.patch('document.services.lru.time.monotonic', return_value=1000):
+            lru.set('a', 'x')
+        with mock.patch('document.services.lru.time.monotonic', return_value=1059):
+            self.assertEqual(lru.get('a'), 'x')
+        with mock.patch('document.services.lru.time.monotonic', return_value=1061):
+            self.assertIsNone(lru.get('a'))
+        self.assertEqual(lru.size, 0)
+
+
+class PlaintextCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache = LRUCache(max_bytes=10000, ttl=60, sizeof=lambda entry: len(entry[1]))
+        patcher = mock.patch.object(plaintext_cache, '_cache', cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_entry_is_only_served_for_the_same_hash(self):
+        document = Document(id=1, hash='a' * 64)
+        plaintext_cache.put(document, '{"a": "b"}')
+        self.assertEqual(plaintext_cache.get(document), '{"a": "b"}')
+        self.assertIsNone(plaintext_cache.get(Document(id=1, hash='b' * 64)))
+
+        plaintext_cache.discard(1)
+        self.assertIsNone(plaintext_cache.get(document))
+
+
+class MongoIndexesTests(TestCase):
+    def sync(self, *args):
+        out = StringIO()
+        call_command('mongo_indexes', '--no-explain', *args, stdout=out)
+        return out.getvalue()
+
+    def index_names(self, collection):
+        return set(get_database()[collection].index_information())
+
+    def test_creates_declared_indexes(self):
+        get_database()['document'].drop_index('document_history_idx')
+        self.sync()
+        self.assertIn('document_history_idx', self.index_names('document'))
+
+    def test_prune_keeps_indexes_it_does_not_own(self):
+        get_database()['document'].create_index([('doctor_id', 1)], name='document_doctor_id_fk')
+        self.sync('--prune')
+        self.assertIn('document_doctor_id_fk', self.index_names('document'))
+
+    def test_prune_drops_retired_indexes(self):
+        get_database()['document'].create_index([('hash', 1)], name='document_hash_idx')
+        with mock.patch.object(mongo_indexes, 'RETIRED_INDEXES', [('document', 'document_hash_idx')]):
+            output = self.sync()
+            self.assertIn('stale', output)
+            self.assertIn('document_hash_idx', self.index_names('document'))
+            self.sync('--prune')
+        self.assertNotIn('document_hash_idx', self.index_names('document'))
+
+
+class StandInChain:
+    """In-memory stand-in for BlockchainService, mining only when told to."""
+
+    def __init__(self):
+        self.transactions = {}  # tx hash -> (chain id, hash)
+        self.receipts = {}
+        self.stored = {}
+        self.dropped = set()
+        self.fail_sends = False
+
+    def store_document(self, chain_id, value):
+        if self.fail_sends:
+            raise ConnectionError("node unreachable")
+        tx_hash = '0x%064x' % (len(self.transactions) + 1)
+        self.transactions[tx_hash] = (chain_id, value)
+        return tx_hash
+
+    def mine(self, tx_hash, status=1, with_receipt=True):
+        chain_id, value = self.transactions[tx_hash]
+        if status == 1:
+            self.stored[chain_id] = value
+        if with_receipt:
+            self.receipts[tx_hash] = {'status': status, 'blockNumber': len(self.receipts) + 1}
+
+    def get_receipt(self, tx_hash):
+        return self.receipts.get(tx_hash)
+
+    def get_transaction(self, tx_hash):
+        if tx_hash in self.dropped or tx_hash not in self.transactions:
+            return None
+        return {'hash': tx_hash}
+
+    def get_stored_hashes(self, chain_ids):
+        return {chain_id: self.stored.get(chain_id, '') for chain_id in chain_ids}
+
+    def sent_for(self, chain_id):
+        return [tx_hash for tx_hash, (sent_id, _) in self.transactions.items() if sent_id == chain_id]
+
+
+@override_settings(ANCHOR_MAX_ATTEMPTS=3)
+class AnchorWorkerTests(TestCase):
+    def setUp(self):
+        self.chain = StandInChain()
+        self.worker = AnchorWorker(service=self.chain, mode='single')
+        self.document = make_document()
+
+    def anchor(self):
+        return DocumentAnchor.objects.get(document_id=self.document.id)
+
+    def make_due(self):
+        DocumentAnchor.objects.filter(document_id=self.document.id).update(
+            next_attempt_at=timezone.now() - datetime.timedelta(seconds=1)
+        )
+
+    def test_send_then_confirm(self):
+        stats = self.worker.run_once()
+        self.assertEqual((stats['enqueued'], stats['sent']), (1, 1))
+        anchor = self.anchor()
+        self.assertEqual(anchor.status, DocumentAnchor.STATUS_SENT)
+        self.assertEqual(self.chain.transactions[anchor.tx_hash], (self.document.id, self.document.hash))
+
+        self.chain.mine(anchor.tx_hash)
+        stats = self.worker.run_once()
+        self.assertEqual(stats['confirmed'], 1)
+        self.assertEqual(self.anchor().status, DocumentAnchor.STATUS_CONFIRMED)
+
+    def test_timeout_while_pending_waits_instead_of_resending(self):
+        self.worker.run_once()
+        self.make_due()
+        self.worker.run_once()
+
+        anchor = self.anchor()
+        self.assertEqual(anchor.status, DocumentAnchor.STATUS_SENT)
+        self.assertGreater(anchor.next_attempt_at, timezone.now())
+        self.assertEqual(len(self.chain.sent_for(self.document.id)), 1)
+
+        self.chain.mine(anchor.tx_hash)
+        self.worker.run_once()
+        self.assertEqual(self.anchor().status, DocumentAnchor.STATUS_CONFIRMED)
+
+    def test_timeout_after_mining_confirms_without_resending(self):
+        self.worker.run_once()
+        self.chain.mine(self.anchor().tx_hash, with_receipt=False)
+        self.chain.dropped.add(self.anchor().tx_hash)
+        self.make_due()
+
+        stats = self.worker.run_once()
+        self.assertEqual(stats['confirmed'], 1)
+        self.assertEqual(self.anchor().status, DocumentAnchor.STATUS_CONFIRMED)
+        self.assertEqual(len(self.chain.sent_for(self.document.id)), 1)
+
+    def test_dropped_transaction_is_resent_once(self):
+        self.worker.run_once()
+        first = self.anchor().tx_hash
+        self.chain.dropped.add(first)
+        self.make_due()
+        stats = self.worker.run_once()
+        self.assertEqual(stats['retried'], 1)
+        self.assertEqual(self.anchor().status, DocumentAnchor.STATUS_PENDING)
+
+        self.make_due()
+        self.worker.run_once()
+        second = self.anchor().tx_hash
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.chain.sent_for(self.document.id), [first, second])
+
+        self.chain.mine(second)
+        self.worker.run_once()
+        self.assertEqual(self.anchor().status, DocumentAnchor.STATUS_CONFIRMED)
+
+    def test_resend_skipped_when_the_old_transaction_was_mined(self):
+        self.worker.run_once()
+        first = self.anchor().tx_hash
+        self.chain.dropped.add(first)
+        self.make_due()
+        self.worker.run_once()
+
+        # The dropped transaction was mined after all while the row waited out its backoff
+        self.chain.mine(first, with_receipt=False)
+        self.make_due()
+        stats = self.worker.run_once()
+        self.assertEqual((stats['sent'], stats['confirmed']), (0, 1))
+        self.assertEqual(self.anchor().status, DocumentAnchor.STATUS_CONFIRMED)
+        self.assertEqual(self.chain.sent_for(self.document.id), [first])
+
+    def test_failures_back_off_then_give_up(self):
+        self.chain.fail_sends = True
+        for attempt in range(1, 4):
+            stats = self.worker.run_once()
+            anchor = self.anchor()
+            self.assertEqual(anchor.attempts, attempt)
+            self.assertIn('node unreachable', anchor.last_error)
+            self.make_due()
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(self.anchor().status, DocumentAnchor.STATUS_FAILED)
+        self.assertEqual(self.chain.transactions, {})
+
+    def test_reverted_transaction_is_retried(self):
+        self.worker.run_once()
+        self.chain.mine(self.anchor().tx_hash, status=0)
+        stats = self.worker.run_once()
+        self.assertEqual(stats['retried'], 1)
+        self.assertEqual(self.anchor().status, DocumentAnchor.STATUS_PENDING)
+
+
+class BlockchainSingletonTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(eth_service, 'BlockchainService', side_effect=lambda session: object())
+        self.service_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(setattr, blockchain, '_service', None)
+        blockchain._service = None
+
+    def test_built_once_per_process(self):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            services = set(pool.map(lambda _: blockchain.get_blockchain_service(), range(16)))
+        self.assertEqual(len(services), 1)
+        self.assertEqual(self.service_class.call_count, 1)
+
+    def test_forked_child_builds_its_own(self):
+        parent_service, parent_lock = blockchain.get_blockchain_service(), blockchain._lock
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:  # Child: report and leave without running any test machinery
+            try:
+                reset = blockchain._service is None and blockchain._lock is not parent_lock
+                child_service = blockchain.get_blockchain_service()
+                os.write(write_end, b'1' if reset and child_service is not parent_service else b'0')
+            finally:
+                os._exit(0)
+        os.close(write_end)
+        os.waitpid(pid, 0)
+        with os.fdopen(read_end, 'rb') as child:
+            self.assertEqual(child.read(), b'1')
+        self.assertIs(blockchain.get_blockchain_service(), parent_service)
+
+
+class StandInProvider(BaseProvider):
+    """JSON-RPC stand-in for the node behind BlockchainService's Web3."""
+
+    def __init__(self, pending=5, batches=True):
+        super().__init__()
+        self.pending = pending      # Account's pending transaction count
+        self.batches = batches
+        self.sent = []              # Nonces of the accepted raw transactions
+        self.send_errors = []       # Error messages for the next sends, in order
+        self.receipts = {}
+        self.calls = []
+
+    def make_request(self, method, params):
+        self.calls.append(method)
+        if method == 'eth_getTransactionCount':
+            return {'jsonrpc': '2.0', 'id': 1, 'result': hex(self.pending)}
+        if method == 'eth_chainId':
+            return {'jsonrpc': '2.0', 'id': 1, 'result': hex(1337)}
+        if method == 'eth_sendRawTransaction':
+            if self.send_errors:
+                return {'jsonrpc': '2.0', 'id': 1, 'error': {'code': -32000, 'message': self.send_errors.pop(0)}}
+            nonce = int.from_bytes(rlp.decode(bytes(HexBytes(params[0])))[0], 'big')
+            if nonce != self.pending:
+                return {'jsonrpc': '2.0', 'id': 1, 'error': {'code': -32000, 'message': 'nonce too low'}}
+            self.sent.append(nonce)
+            self.pending += 1
+            return {'jsonrpc': '2.0', 'id': 1, 'result': '0x%064x' % nonce}
+        if method == 'eth_getTransactionReceipt':
+            return {'jsonrpc': '2.0', 'id': 1, 'result': self.receipts.get(params[0])}
+        raise NotImplementedError(method)
+
+    def make_batch_request(self, requests):
+        if not self.batches:
+            raise NotImplementedError
+        self.calls.append('batch')
+        return [{'jsonrpc': '2.0', 'id': i, 'result': self.receipts.get(params[0])}
+                for i, (method, params) in enumerate(requests)]
+
+
+class BlockchainServiceTests(SimpleTestCase):
+    def setUp(self):
+        self.provider = StandInProvider()
+        self.service = self.make_service(self.provider)
+
+    @staticmethod
+    def make_service(provider):
+        with mock.patch.object(eth_service.Web3, 'HTTPProvider', return_value=provider):
+            return eth_service.BlockchainService(rpc_url='http://node.invalid')
+
+    def store(self, document_id=1):
+        return self.service.store_document(document_id, 'a' * 64)
+
+    def test_nonces_are_consecutive_without_asking_the_node(self):
+        for document_id in range(3):
+            self.store(document_id)
+        self.assertEqual(self.provider.sent, [5, 6, 7])
+        self.assertEqual(self.provider.calls.count('eth_getTransactionCount'), 1)
+
+    def test_concurrent_callers_get_distinct_nonces(self):
+        nonces = eth_service.NonceManager(self.service.web3, self.service.account.address)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            allocated = list(pool.map(lambda _: nonces.next(), range(50)))
+        self.assertEqual(sorted(allocated), list(range(5, 55)))
+
+    def test_nonce_error_resyncs_and_retries_once(self):
+        self.store()
+        self.provider.pending = 9  # Another process sent from the same account
+        self.store()
+        self.assertEqual(self.provider.sent, [5, 9])
+        self.assertEqual(self.provider.calls.count('eth_getTransactionCount'), 2)
+
+        self.provider.send_errors = ['nonce too low', 'nonce too low']
+        with self.assertRaises(Exception):
+            self.store()
+        self.store()
+        self.assertEqual(self.provider.sent, [5, 9, 10])
+
+    def test_other_errors_release_the_nonce(self):
+        self.provider.send_errors = ['insufficient funds']
+        with self.assertRaises(Exception):
+            self.store()
+        self.store()
+        self.assertEqual(self.provider.sent, [5])
+
+    def test_already_known_returns_the_signed_hash(self):
+        self.provider.send_errors = ['already known']
+        tx_hash = self.store()
+        self.assertTrue(tx_hash.startswith('0x'))
+        self.assertEqual(len(tx_hash), 66)
+
+    def test_receipts_come_from_one_batch(self):
+        self.provider.receipts['0x1'] = {'status': '0x1', 'blockNumber': '0x10'}
+        self.provider.receipts['0x2'] = {'status': '0x0', 'blockNumber': '0x11'}
+        receipts = self.service.get_receipts(['0x1', '0x2', '0x3'])
+        self.assertEqual(receipts, {
+            '0x1': {'status': 1, 'blockNumber': 16},
+            '0x2': {'status': 0, 'blockNumber': 17},
+            '0x3': None,
+        })
+        self.assertEqual(self.provider.calls, ['batch'])
+        self.assertEqual(self.service.get_receipts([]), {})
+
+    def test_receipts_without_batch_support(self):
+        mined, pending = '0x%064x' % 1, '0x%064x' % 2
+        provider = StandInProvider(batches=False)
+        provider.receipts[mined] = {'status': '0x1', 'blockNumber': '0x10', 'transactionHash': mined}
+        receipts = self.make_service(provider).get_receipts([mined, pending])
+        self.assertEqual(receipts[mined]['blockNumber'], 16)
+        self.assertIsNone(receipts[pending])
+        self.assertEqual(provider.calls, ['eth_getTransactionReceipt'] * 2)
+
+
+class StatsPipelineTests(TestCase):
+    def test_counts_match_the_orm(self):
+        first = make_document()
+        chn, chu = Hospital.objects.create(name='CHN'), Hospital.objects.create(name='CHU')
+        Hospital.objects.create(name='Empty')
+        first.doctor.hospital = chn
+        first.doctor.save()
+        CustomUser.objects.create_user(email='b@example.com', password='secret', role='Doctor', hospital=chn)
+        CustomUser.objects.create_user(email='c@example.com', password='secret', role='Doctor', hospital=chu)
+        CustomUser.objects.create_user(email='admin@example.com', password='secret', role='Admin', hospital=chu)
+        other = Category.objects.create(name='Radiologie')
+        Category.objects.create(name='Empty')
+        for _ in range(2):
+            make_document('{"a": "b"}', first.patient, other, first.doctor)
+
+        self.assertEqual(stats.hospital_doctor_counts(), [
+            {'id': hospital.id, 'name': hospital.name,
+             'num_doctors': CustomUser.objects.filter(hospital=hospital, role='Doctor').count()}
+            for hospital in Hospital.objects.order_by('id')
+        ])
+        self.assertEqual(stats.category_document_counts(), [
+            {'id': category.id, 'name': category.name,
+             'num_documents': Document.objects.filter(category=category).count()}
+            for category in Category.objects.order_by('id')
+        ])
+        self.assertEqual([c['num_documents'] for c in stats.category_document_counts()], [1, 2, 0])
+
+
+class CountersTests(TestCase):
+    def setUp(self):
+        counters._collection().delete_many({})
+        self.hospital = Hospital.objects.create(name='CHN')
+        self.first = make_document('{"n": 0}')
+        self.first.doctor.hospital = self.hospital
+        self.first.doctor.save()
+        counters.rebuild()
+
+    def expected(self):
+        """The counters as counted from the tables themselves."""
+        doctors = CustomUser.objects.filter(role='Doctor')
+        return {
+            'totals': {
+                'categories': Category.objects.count(), 'hospitals': Hospital.objects.count(),
+                'documents': Document.objects.count(), 'doctors': doctors.count(),
+            },
+            'hospital_stats': [
+                {'id': hospital.id, 'name': hospital.name, 'num_doctors': doctors.filter(hospital=hospital).count()}
+                for hospital in Hospital.objects.order_by('id')
+            ],
+            'category_stats': [
+                {'id': category.id, 'name': category.name,
+                 'num_documents': Document.objects.filter(category=category).count()}
+                for category in Category.objects.order_by('id')
+            ],
+        }
+
+    def test_writes_keep_the_counters_current(self):
+        other = Category.objects.create(name='Radiologie')
+        make_document('{"n": 1}', self.first.patient, other, self.first.doctor)
+        bulk = [Document(patient=self.first.patient, category=other, doctor=self.first.doctor,
+                         result=b'x', hash='0' * 64)]
+        Document.objects.bulk_create(bulk)
+        signals.count_bulk_created_documents(bulk)
+        CustomUser.objects.create_user(email='second@example.com', password='secret', role='Doctor',
+                                       hospital=self.hospital)
+        self.assertEqual(counters.snapshot(), self.expected())
+
+        self.first.delete()
+        Hospital.objects.create(name='CHU')
+        self.assertEqual(counters.snapshot(), self.expected())
+
+    def test_rebuild_repairs_drift(self):
+        counters._collection().update_one({'_id': counters.TOTALS_ID}, {'$inc': {'documents': 100}})
+        counters._collection().delete_many({'kind': 'hospital'})
+        self.assertNotEqual(counters.snapshot(), self.expected())
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertEqual(counters.snapshot(), self.expected())
+
+    def test_snapshot_seeds_an_empty_collection(self):
+        counters._collection().delete_many({})
+        self.assertEqual(counters.snapshot(), self.expected())
+
+
+class StatsCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+        barrier = threading.Barrier(8)
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return {'documents': 3}
+
+        def request(_):
+            barrier.wait()
+            return stats_cache.get_or_compute('category_stats', compute)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(request, range(8)))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'documents': 3}] * 8)
+        self.assertEqual(stats_cache.get_or_compute('category_stats', compute), {'documents': 3})
+        metrics = stats_cache.metrics()
+        self.assertEqual((metrics['hits'], metrics['misses'], metrics['waits']), (1, 8, 7))
+        self.assertEqual(metrics['hit_ratio'], round(1 / 9, 4))
+
+    def test_writes_invalidate(self):
+        compute = mock.Mock(side_effect=lambda: compute.call_count)
+        self.assertEqual(stats_cache.get_or_compute('hospital_stats', compute), 1)
+        self.assertEqual(stats_cache.get_or_compute('hospital_stats', compute), 1)
+        Hospital.objects.create(name='CHN')
+        self.assertEqual(stats_cache.get_or_compute('hospital_stats', compute), 2)
+        make_document()
+        self.assertEqual(stats_cache.get_or_compute('hospital_stats', compute), 3)
+
+    @override_settings(STATS_CACHE_WAIT_SECONDS=0.1)
+    def test_stuck_recomputation_is_not_waited_on_forever(self):
+        key = f'{stats_cache.KEY_PREFIX}:{stats_cache._generation()}:category_stats'
+        cache.add(f'{key}:lock', 1, 60)
+        self.assertEqual(stats_cache.get_or_compute('category_stats', lambda: 'fresh'), 'fresh')
+        self.assertIsNone(cache.get(key))
+
+
+class AdminDashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = CustomUser.objects.create_user(email='admin@example.com', password='secret', role='Admin')
+
+    def get(self):
+        request = APIRequestFactory().get('/api/admin-dashboard/')
+        force_authenticate(request, user=self.admin)
+        snapshot = {
+            'totals': {'categories': 1, 'hospitals': 0, 'documents': 2, 'doctors': 1},
+            'hospital_stats': [], 'category_stats': [],
+        }
+        with mock.patch('document.views.counters.snapshot', return_value=snapshot):
+            response = AdminDashboardAPIView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_recent_documents_are_decrypted_on_read_only(self):
+        first = make_document('{"glycemie": "1.10"}')
+        second = make_document('{"glycemie": "0.95"}', patient=first.patient, category=first.category,
+                               doctor=first.doctor)
+
+        data = self.get()
+        self.assertEqual(
+            [(document['id'], document['decrypted_result']) for document in data['recent_documents']],
+            [(second.id, '{"glycemie": "0.95"}'), (first.id, '{"glycemie": "1.10"}')],
+        )
+
+        cached = [value for key, value in cache._cache.items() if b'glycemie' in value]
+        self.assertEqual(cached, [])
+        self.assertEqual(self.get()['recent_documents'], data['recent_documents'])
+
+
+class BlindIndexTests(TestCase):
+    def test_normalize(self):
+        self.assertEqual(blind_index.normalize('  Type\u00a0A '), 'type a')
+        self.assertEqual(blind_index.normalize('ＴＹＰＥ a'), 'type a')
+        self.assertEqual(blind_index.normalize(True), 'true')
+        self.assertEqual(blind_index.normalize(12), '12')
+        self.assertIsNone(blind_index.normalize(''))
+        self.assertIsNone(blind_index.normalize({'a': 1}))
+        self.assertIsNone(blind_index.normalize('x' * (blind_index.MAX_VALUE_LENGTH + 1)))
+
+    def test_tokens_are_keyed_by_field(self):
+        self.assertEqual(blind_index.token(1, 'Type A'), blind_index.token(1, ' type  a'))
+        self.assertNotEqual(blind_index.token(1, 'Type A'), blind_index.token(2, 'Type A'))
+        self.assertEqual(len(blind_index.token(1, 'Type A')), blind_index.TOKEN_BYTES * 2)
+
+    def test_tokens_for_multi_select_and_missing_values(self):
+        fields = [(1, 'groupe'), (2, 'allergies'), (3, 'absent')]
+        tokens = blind_index.tokens_for('{"groupe": "A+", "allergies": ["Pollen", "pollen", "Lait"]}', fields)
+        self.assertEqual(tokens, [
+            blind_index.token(1, 'A+'), blind_index.token(2, 'Pollen'), blind_index.token(2, 'Lait'),
+        ])
+        self.assertEqual(blind_index.tokens_for('not json', fields), [])
+        self.assertEqual(blind_index.tokens_for('{"groupe": "A+"}', []), [])
+
+
+class DocumentHistoryFilterTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Analyses')
+        self.field = Field.objects.create(category=self.category, name='groupe', field_type='text', blind_index=True)
+        self.first = make_document('{"groupe": "A+", "note": "ok"}', category=self.category)
+        self.patient, self.doctor = self.first.patient, self.first.doctor
+        self.other = make_document('{"groupe": "O-", "note": "ok"}', self.patient, self.category, self.doctor)
+
+    def get(self, **params):
+        request = APIRequestFactory().get('/api/documents/history/', {
+            'patient_id': self.patient.id, 'category_id': self.category.id, **params,
+        })
+        force_authenticate(request, user=self.doctor)
+        return DocumentHistoryAPIView.as_view(throttle_classes=[])(request)
+
+    def test_documents_get_tokens_of_indexed_fields(self):
+        self.assertEqual(self.first.blind_tokens, [blind_index.token(self.field.id, 'A+')])
+
+    def test_filter_on_a_blind_indexed_field(self):
+        response = self.get(filter_field=self.field.id, filter_value=' a+ ')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([document['id'] for document in response.data], [self.first.id])
+
+    def test_filter_value_is_required(self):
+        self.assertEqual(self.get(filter_field=self.field.id).status_code, 400)
+        self.assertEqual(self.get(filter_field=self.field.id, filter_value='').status_code, 400)
+
+    def test_filter_field_must_be_blind_indexed(self):
+        note = Field.objects.create(category=self.category, name='note', field_type='text')
+        self.assertEqual(self.get(filter_field=note.id, filter_value='ok').status_code, 400)
+
+
+class ConditionalTests(SimpleTestCase):
+    def request(self, **headers):
+        return RequestFactory().get('/', **headers)
+
+    def test_etag_matches_weakly_and_in_lists(self):
+        self.assertTrue(conditional.etag_matches(self.request(HTTP_IF_NONE_MATCH='"a"'), '"a"'))
+        self.assertTrue(conditional.etag_matches(self.request(HTTP_IF_NONE_MATCH='W/"a"'), '"a"'))
+        self.assertTrue(conditional.etag_matches(self.request(HTTP_IF_NONE_MATCH='"b", "a"'), '"a"'))
+        self.assertTrue(conditional.etag_matches(self.request(HTTP_IF_NONE_MATCH='*'), '"a"'))
+        self.assertFalse(conditional.etag_matches(self.request(HTTP_IF_NONE_MATCH='"b"'), '"a"'))
+        self.assertFalse(conditional.etag_matches(self.request(), '"a"'))
+
+    def test_if_none_match_takes_precedence(self):
+        modified = timezone.now()
+        request = self.request(HTTP_IF_NONE_MATCH='"b"', HTTP_IF_MODIFIED_SINCE=http_date(modified.timestamp() + 60))
+        self.assertFalse(conditional.not_modified(request, '"a"', modified))
+
+    def test_if_modified_since_needs_last_modified(self):
+        modified = timezone.now()
+        request = self.request(HTTP_IF_MODIFIED_SINCE=http_date(modified.timestamp() + 60))
+        self.assertTrue(conditional.not_modified(request, '"a"', modified))
+        self.assertFalse(conditional.not_modified(request, '"a"'))
+
+    def test_conditional_response_builds_only_when_modified(self):
+        built = []
+
+        def build():
+            built.append(True)
+            return Response({"ok": True})
+
+        response = conditional.conditional_response(self.request(HTTP_IF_NONE_MATCH='"a"'), '"a"', build)
+        self.assertEqual((response.status_code, response['ETag'], built), (304, '"a"', []))
+        response = conditional.conditional_response(self.request(HTTP_IF_NONE_MATCH='"b"'), '"a"', build)
+        self.assertEqual((response.status_code, response['ETag'], built), (200, '"a"', [True]))
+        self.assertEqual(response['Cache-Control'], conditional.CACHE_CONTROL)
+
+
+class DocumentHistoryPaginationTests(TestCase):
+    def setUp(self):
+        first = make_document('{"n": 0}')
+        self.owners = (first.patient, first.category, first.doctor)
+        documents = [first] + [make_document('{"n": %d}' % i, *self.owners) for i in range(1, 7)]
+        # Rows 2 to 4 share a timestamp: the id breaks the tie
+        start = timezone.now() - datetime.timedelta(days=1)
+        for document, minutes in zip(documents, [0, 1, 2, 2, 2, 3, 4]):
+            Document.objects.filter(id=document.id).update(created_at=start + datetime.timedelta(minutes=minutes))
+        self.expected = [
+            document.id for document in Document.objects.order_by('-created_at', '-id')
+        ]
+
+    def get(self, **params):
+        patient, category, doctor = self.owners
+        request = APIRequestFactory().get('/api/documents/history/', {
+            'patient_id': patient.id, 'category_id': category.id, **params,
+        })
+        force_authenticate(request, user=doctor)
+        return DocumentHistoryAPIView.as_view(throttle_classes=[])(request)
+
+    def test_next_and_prev_walk_every_document_once(self):
+        pages = [self.get(page_size=3).data]
+        while pages[-1]['next']:
+            pages.append(self.get(page_size=3, cursor=pages[-1]['next']).data)
+        ids = [[row['id'] for row in page['results']] for page in pages]
+        self.assertEqual([len(page) for page in ids], [3, 3, 1])
+        self.assertEqual(sum(ids, []), self.expected)
+        self.assertIsNone(pages[0]['prev'])
+
+        previous = self.get(page_size=3, cursor=pages[-1]['prev']).data
+        self.assertEqual([row['id'] for row in previous['results']], ids[1])
+        previous = self.get(page_size=3, cursor=previous['prev']).data
+        self.assertEqual([row['id'] for row in previous['results']], ids[0])
+        self.assertIsNone(previous['prev'])
+
+    def test_page_size_is_capped(self):
+        response = self.get(page_size=1000)
+        self.assertEqual(len(response.data['results']), len(self.expected))
+        self.assertIsNone(response.data['next'])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.get(cursor='not-a-cursor').status_code, 404)
+        self.assertEqual(self.get(cursor='eyJ0IjoieCIsImkiOjF9').status_code, 404)  # {"t":"x","i":1}
+
+
+@override_settings(DOCUMENT_HISTORY_STREAM_CHUNK_SIZE=2)
+class DocumentHistoryStreamTests(TestCase):
+    def setUp(self):
+        first = make_document('{"n": 0}')
+        self.owners = (first.patient, first.category, first.doctor)
+        for i in range(1, 5):
+            make_document('{"n": %d}' % i, *self.owners)
+
+    def get(self, user=None, patient_id=None, **params):
+        patient, category, doctor = self.owners
+        request = APIRequestFactory().get('/api/documents/history/', {
+            'patient_id': patient_id or patient.id, 'category_id': category.id, 'format': 'ndjson', **params,
+        })
+        force_authenticate(request, user=user or doctor)
+        return DocumentHistoryAPIView.as_view(throttle_classes=[])(request)
+
+    @staticmethod
+    def lines(response):
+        content = b''.join(response.streaming_content)
+        return [json.loads(line) for line in content.decode().splitlines()]
+
+    def test_one_json_object_per_line(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        rows = sorted(self.lines(response), key=lambda row: row['id'])
+        self.assertEqual([row['decrypted_result'] for row in rows], ['{"n": %d}' % i for i in range(5)])
+        parsed = sorted(self.lines(self.get(result_format='object')), key=lambda row: row['id'])
+        self.assertEqual(parsed[0]['decrypted_result'], {'n': 0})
+
+    def test_failure_mid_stream_is_reported_in_band(self):
+        real_decrypt = views.decrypt_history_chunk
+        calls = []
+
+        def decrypt(*args):
+            calls.append(1)
+            if len(calls) == 2:
+                raise ValueError("boom")
+            return real_decrypt(*args)
+
+        with mock.patch.object(views, 'decrypt_history_chunk', side_effect=decrypt):
+            rows = self.lines(self.get())
+        self.assertEqual(len(rows), 3)
+        self.assertIn('boom', rows[-1]['error'])
+
+    def test_unknown_patient_is_a_404(self):
+        response = self.get(patient_id=999999)
+        self.assertEqual(response.status_code, 404)
+        response.render()
+        self.assertEqual(len(response.content.splitlines()), 1)
+        self.assertIn('error', json.loads(response.content))
+
+    def test_doctors_and_admins_only(self):
+        other = CustomUser.objects.create_user(email='staff@example.com', password='secret', role='Staff')
+        self.assertEqual(self.get(other).status_code, 403)
+
+
+class CategorySchemaCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='doctor@example.com', password='secret', role='Doctor')
+        self.category = Category.objects.create(name='Analyses')
+        Field.objects.create(category=self.category, name='groupe', field_type='text')
+
+    def get(self, **headers):
+        request = APIRequestFactory().get('/api/category/', **headers)
+        force_authenticate(request, user=self.user)
+        return CategoryViewSet.as_view({'get': 'list'})(request)
+
+    def test_etag_revalidation(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([field['name'] for field in response.data[0]['fields']], ['groupe'])
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_field_change_invalidates_the_schema(self):
+        etag = self.get()['ETag']
+        Field.objects.create(category=self.category, name='rhesus', field_type='text')
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([field['name'] for field in response.data[0]['fields']], ['groupe', 'rhesus'])
+
+    def test_etag_depends_on_content_only(self):
+        first = schema_cache.get()
+        schema_cache.invalidate()
+        second = schema_cache.get()
+        self.assertIsNot(first, second)
+        self.assertEqual(first['etag'], second['etag'])
+        self.assertEqual(first['by_id'][self.category.id][1], second['by_id'][self.category.id][1])
+
+
+class DocumentHistoryConditionalTests(TestCase):
+    def setUp(self):
+        self.older = make_document('{"a": "1"}')
+        self.newer = make_document('{"a": "2"}', self.older.patient, self.older.category, self.older.doctor)
+
+    def get(self, params=None, **headers):
+        request = APIRequestFactory().get('/api/documents/history/', {
+            'patient_id': self.older.patient_id, 'category_id': self.older.category_id, **(params or {}),
+        }, **headers)
+        force_authenticate(request, user=self.older.doctor)
+        return DocumentHistoryAPIView.as_view(throttle_classes=[])(request)
+
+    def test_if_none_match(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_if_modified_since_is_ignored(self):
+        later = http_date(timezone.now().timestamp() + 3600)
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=later).status_code, 200)
+
+    def test_deleting_an_older_document_changes_the_etag(self):
+        etag = self.get()['ETag']
+        self.older.delete()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([document['id'] for document in response.data], [self.newer.id])
+
+    def test_result_format_object(self):
+        as_string = self.get()
+        as_object = self.get({'result_format': 'object'})
+        self.assertEqual(sorted(document['decrypted_result'] for document in as_string.data), ['{"a": "1"}', '{"a": "2"}'])
+        self.assertEqual(sorted(document['decrypted_result']['a'] for document in as_object.data), ['1', '2'])
+        # Same rows, different body: a cached string response must not answer an object request
+        self.assertNotEqual(as_object['ETag'], as_string['ETag'])
+        self.assertEqual(self.get({'result_format': 'object'}, HTTP_IF_NONE_MATCH=as_string['ETag']).status_code, 200)
+
+
+class DocumentBulkTests(TestCase):
+    def setUp(self):
+        self.document = make_document()
+        self.item = {'patient_id': self.document.patient_id, 'category_id': self.document.category_id,
+                     'doctor_id': self.document.doctor_id}
+
+    def post(self, items, user=None):
+        request = APIRequestFactory().post('/api/documents/bulk/', {'documents': items}, format='json')
+        force_authenticate(request, user=user or self.document.doctor)
+        return DocumentBulkAPIView.as_view(throttle_classes=[])(request)
+
+    def test_all_created(self):
+        response = self.post([{**self.item, 'result': {'n': i}} for i in range(3)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 3)
+        for i, result in enumerate(response.data['results']):
+            self.assertEqual((result['index'], result['status']), (i, 'created'))
+            document = Document.objects.get(id=result['document_id'])
+            self.assertEqual(document.hash, result['hash'])
+            self.assertEqual(document.get_plaintext_result(), '{"n": %d}' % i)
+        created = [result['document_id'] for result in response.data['results']]
+        self.assertEqual(DocumentAnchor.objects.filter(document_id__in=created).count(), 3)
+
+    def test_mixed_batch_is_a_multi_status(self):
+        response = self.post([
+            {**self.item, 'result': {'n': 0}},
+            {**self.item, 'result': None},
+            {**self.item, 'patient_id': 999999, 'result': {'n': 2}},
+            'not an object',
+        ])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 3))
+        statuses = [(result['index'], result['status']) for result in response.data['results']]
+        self.assertEqual(statuses, [(0, 'created'), (1, 'error'), (2, 'error'), (3, 'error')])
+        self.assertIn('patient', response.data['results'][2]['error'])
+        self.assertTrue(Document.objects.filter(id=response.data['results'][0]['document_id']).exists())
+
+    def test_invalid_batches_are_rejected(self):
+        self.assertEqual(self.post([]).status_code, 400)
+        response = self.post([{**self.item, 'doctor_id': 'x', 'result': {'n': 0}}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['created'], 0)
+        with override_settings(DOCUMENT_BULK_MAX_ITEMS=1):
+            self.assertEqual(self.post([{**self.item, 'result': {'n': i}} for i in range(2)]).status_code, 400)
+
+    def test_item_is_never_created_without_an_id(self):
+        with mock.patch.object(Document.objects, 'filter', return_value=Document.objects.none()):
+            response = self.post([{**self.item, 'result': {'n': 0}}])
+        result, = response.data['results']
+        self.assertEqual(result['status'], 'error')
+        self.assertNotIn('document_id', result)
+
+    def test_doctors_and_admins_only(self):
+        other = CustomUser.objects.create_user(email='staff@example.com', password='secret', role='Staff')
+        self.assertEqual(self.post([{**self.item, 'result': {'n': 0}}], other).status_code, 403)
+        admin = CustomUser.objects.create_user(email='admin@example.com', password='secret', role='Admin')
+        self.assertEqual(self.post([{**self.item, 'result': {'n': 0}}], admin).status_code, 201)
+
+
+class VerifyDocumentBatchTests(TestCase):
+    def setUp(self):
+        self.chain = StandInChain()
+        self.confirmed = make_document('{"a": "1"}')
+        owners = (self.confirmed.patient, self.confirmed.category, self.confirmed.doctor)
+        self.tampered = make_document('{"a": "2"}', *owners)
+        worker = AnchorWorker(service=self.chain, mode='single')
+        worker.run_once()
+        for tx_hash in list(self.chain.transactions):
+            self.chain.mine(tx_hash)
+        worker.run_once()
+
+        # Mined, but the worker has not seen the receipt yet
+        self.sent = make_document('{"a": "3"}', *owners)
+        worker.run_once()
+        self.chain.mine(DocumentAnchor.objects.get(document_id=self.sent.id).tx_hash)
+        self.unanchored = make_document('{"a": "4"}', *owners)
+        Document.objects.filter(id=self.tampered.id).update(hash='0' * 64)
+
+    def post(self, user, document_ids):
+        request = APIRequestFactory().post('/api/documents/verify-batch/', {'document_ids': document_ids}, format='json')
+        force_authenticate(request, user=user)
+        with mock.patch('document.views.get_blockchain_service', return_value=self.chain):
+            return VerifyDocumentBatchAPIView.as_view()(request)
+
+    def test_statuses(self):
+        ids = [self.confirmed.id, self.tampered.id, self.sent.id, self.unanchored.id, 999999]
+        response = self.post(self.confirmed.doctor, ids)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['results']],
+                         ['valid', 'invalid', 'missing', 'missing', 'missing'])
+        self.assertEqual((response.data['valid'], response.data['invalid'], response.data['missing']), (1, 1, 3))
+
+    def test_doctors_and_admins_only(self):
+        other = CustomUser.objects.create_user(email='staff@example.com', password='secret', role='Staff')
+        self.assertEqual(self.post(other, [self.confirmed.id]).status_code, 403)
+        admin = CustomUser.objects.create_user(email='admin@example.com', password='secret', role='Admin')
+        self.assertEqual(self.post(admin, [self.confirmed.id]).status_code, 200)
+
+
+class MerkleTests(SimpleTestCase):
+    hashes = [hashlib.sha256(str(i).encode()).hexdigest() for i in range(9)]
+
+    def test_every_leaf_proves_inclusion(self):
+        for size in range(1, len(self.hashes) + 1):
+            root, proofs = merkle.build(self.hashes[:size])
+            for document_hash, proof in zip(self.hashes, proofs):
+                self.assertTrue(merkle.verify(document_hash, proof, root), (size, document_hash))
+
+    def test_single_leaf_root_is_its_leaf_hash(self):
+        root, proofs = merkle.build(self.hashes[:1])
+        self.assertEqual(root, merkle.leaf_hash(self.hashes[0]).hex())
+        self.assertEqual(proofs, [[]])
+
+    def test_wrong_hash_or_proof_fails(self):
+        root, proofs = merkle.build(self.hashes[:5])
+        self.assertFalse(merkle.verify(self.hashes[6], proofs[0], root))
+        self.assertFalse(merkle.verify(self.hashes[0], proofs[1], root))
+        self.assertFalse(merkle.verify(self.hashes[0], proofs[0][:-1], root))
+        self.assertFalse(merkle.verify(self.hashes[0], [{'side': 'up'}], root))
+        self.assertFalse(merkle.verify('not hex', proofs[0], root))
+
+    def test_inner_node_is_not_a_leaf(self):
+        # Leaves and nodes are hashed with different prefixes (second preimage)
+        root, proofs = merkle.build(self.hashes[:4])
+        inner = proofs[0][1]['hash']
+        self.assertFalse(merkle.verify(inner, proofs[2][1:], root))
+
+    def test_empty_batch_is_rejected(self):
+        with self.assertRaises(ValueError):
+            merkle.build([])
+
+
+@override_settings(ANCHOR_MERKLE_WINDOW_SECONDS=0)
+class MerkleAnchoringTests(TestCase):
+    def test_batch_anchors_one_root_for_every_document(self):
+        chain = StandInChain()
+        first = make_document('{"a": "1"}')
+        documents = [first] + [
+            make_document('{"a": "%d"}' % i, first.patient, first.category, first.doctor) for i in range(2, 6)
+        ]
+        worker = AnchorWorker(service=chain, mode='merkle')
+        stats = worker.run_once()
+        self.assertEqual((stats['batched'], stats['sent']), (5, 1))
+
+        batch = AnchorBatch.objects.get()
+        (tx_hash, (chain_id, root)), = chain.transactions.items()
+        self.assertEqual((chain_id, root), (merkle.ROOT_ID_OFFSET + batch.id, batch.root))
+
+        chain.mine(tx_hash)
+        worker.run_once()
+        self.assertEqual(
+            set(DocumentAnchor.objects.values_list('status', flat=True)), {DocumentAnchor.STATUS_CONFIRMED}
+        )
+        statuses = verify_many_on_chain(Document.objects.all(), chain)
+        self.assertEqual(statuses, {document.id: 'valid' for document in documents})
+
+        Document.objects.filter(id=first.id).update(hash='0' * 64)
+        self.assertEqual(verify_many_on_chain(Document.objects.filter(id=first.id), chain), {first.id: 'invalid'})
@@ -1,4 +1,4 @@
-from .views import AdminDashboardAPIView, CategoryStatsView, CategoryViewSet, DoctorsByHospitalAPIView, DocumentHistoryAPIView, HospitalStatsView,HospitalViewSet,FieldViewSet,DocumentAPIView,VerifyDocumentIntegrityAPIView,DocumentLastAPIView
+from .views import AdminDashboardAPIView, StatsCacheAPIView, CategoryStatsView, CategoryViewSet, DoctorsByHospitalAPIView, DocumentHistoryAPIView, HospitalStatsView,HospitalViewSet,FieldViewSet,DocumentAPIView,DocumentBulkAPIView,VerifyDocumentBatchAPIView,VerifyDocumentIntegrityAPIView,DocumentLastAPIView
 from rest_framework.routers import DefaultRouter
 from django.urls import path
 from rest_framework_nested import routers
@@ -20,6 +20,7 @@ urlpatterns = router.urls + categories_router.urls
 # Additional endpoints
 urlpatterns += [
     path('documents/create/', DocumentAPIView.as_view(), name='create_document'),
+    path('documents/bulk/', DocumentBulkAPIView.as_view(), name='bulk_create_documents'),
     path('documents/<int:document_id>/', DocumentAPIView.as_view(), name='document-detail'),
 
     # path('documents/last/', DocumentLastAPIView.as_view(), name='document-last'),
@@ -28,6 +29,7 @@ urlpatterns += [
 
 
     path('documents/verify/<int:document_id>/', VerifyDocumentIntegrityAPIView.as_view(), name='verify_document'),
+    path('documents/verify-batch/', VerifyDocumentBatchAPIView.as_view(), name='verify_documents_batch'),
 
     path('hospitals/stats/', HospitalStatsView.as_view(), name='hospital_stats'),
     path('categories/stats/', CategoryStatsView.as_view(), name='category_stats'),
@@ -35,4 +37,5 @@ urlpatterns += [
     path('hospital/<int:hospital_id>/doctors/', DoctorsByHospitalAPIView.as_view(), name='doctors_by_hospital'),
 
     path('admin-dashboard/', AdminDashboardAPIView.as_view(), name='admin-dashboard'),
+    path('stats/cache/', StatsCacheAPIView.as_view(), name='stats-cache'),
 ]
@@ -7,14 +7,14 @@ from rest_framework import status
 from django.shortcuts import get_object_or_404
 from rest_framework.decorators import action
 
-# BlockchainService import removed from module level to avoid startup timeout
-# from document.services.eth_service import BlockchainService
+# BlockchainService is not imported at module level to avoid startup timeout:
+# get_blockchain_service() builds it lazily, once per worker process
+from document.services.blockchain import get_blockchain_service
 
-from .models import Category, Hospital, Document,Field
+from .models import Category, Hospital, Document,Field, DocumentAnchor
 from .serializers import CategorySerializer, DocumentSerializer, HospitalSerializer,FieldSerializer,DoctorSerializer
 from authentication.models import Patient, CustomUser
 import hashlib
-import base64
 import json
 from rest_framework.exceptions import NotFound
 from django.http import JsonResponse
@@ -22,15 +22,36 @@ from django.views.decorators.http import require_GET
 from django.contrib.auth.decorators import login_required
 from django.db.models import Count
 from rest_framework.permissions import AllowAny
-from collections import Counter
 from rest_framework.throttling import UserRateThrottle,AnonRateThrottle
 from rest_framework.throttling import ScopedRateThrottle
+from rest_framework.settings import api_settings
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from itertools import chain, islice
+from .renderers import NDJSONRenderer
+from .pagination import DocumentKeysetPagination, LatestDocumentPagination
+from .services import anchoring, blind_index, counters, data_keys, envelope, schema_cache, stats_cache
+from .conditional import conditional_response, is_conditional, not_modified, not_modified_response, with_validators
+from . import signals
 
 class CategoryViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
-    queryset = Category.objects.all()
+    queryset = Category.objects.prefetch_related('fields')
     serializer_class = CategorySerializer
 
+    # Reads come from the serialized schema cache, with an ETag (304 on If-None-Match)
+    def list(self, request, *args, **kwargs):
+        schema = schema_cache.get()
+        return conditional_response(request, schema['etag'], lambda: Response(schema['categories']))
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            category, etag = schema_cache.get()['by_id'][int(kwargs['pk'])]
+        except (KeyError, ValueError):
+            # Unknown here, or created through another worker since this copy was built
+            return super().retrieve(request, *args, **kwargs)
+        return conditional_response(request, etag, lambda: Response(category))
+
 
 class FieldViewSet(viewsets.ModelViewSet):
     throttle_classes = [ScopedRateThrottle]
@@ -44,6 +65,13 @@ class FieldViewSet(viewsets.ModelViewSet):
             raise NotFound(detail="The requested category does not exist.")
         return Field.objects.filter(category_id=category_pk)
 
+    def list(self, request, *args, **kwargs):
+        try:
+            category, etag = schema_cache.get()['by_id'][int(kwargs['category_pk'])]
+        except (KeyError, ValueError):
+            return super().list(request, *args, **kwargs)
+        return conditional_response(request, etag, lambda: Response(category['fields']))
+
     def perform_create(self, serializer):
         self.throttle_scope = 'post_scope'
         category_pk = self.kwargs.get('category_pk')
@@ -196,22 +224,26 @@ class DocumentAPIView(APIView):
 
             logger.info(f"✅ Document saved successfully: {document.id}")
 
-            # Hash encrypted result
-            encrypted_bytes = base64.b64decode(document.result)
-            document_hash = hashlib.sha256(encrypted_bytes).hexdigest()
+            # SHA-256 of the raw ciphertext, computed by save()
+            document_hash = document.hash
             logger.debug(f"🔹 Computed Document Hash: {document_hash}")
 
-            # try:
-            #     tx_hash = self.blockchain_service.store_document(document.id, document_hash)
-            #     logger.info(f"✅ Document hash stored on blockchain. Tx Hash: {tx_hash}")
-            # except Exception as e:
-            #     logger.error(f"❌ Blockchain Error: {str(e)}")
+            # Anchoring goes through the outbox drained by `manage.py anchor_documents`,
+            # so the request never waits on the chain. If this insert fails, the
+            # worker's reconciliation pass enqueues the document later.
+            try:
+                DocumentAnchor.objects.create(document=document, document_hash=document_hash)
+                anchor_status = DocumentAnchor.STATUS_PENDING
+            except Exception as e:
+                logger.error(f"❌ Could not enqueue document {document.id} for anchoring: {str(e)}")
+                anchor_status = None
 
             return Response(
                 {
                     "message": "Document created successfully",
                     "document_id": document.id,
                     "hash": document_hash,
+                    "anchor_status": anchor_status,
                 },
                 status=status.HTTP_201_CREATED
             )
@@ -236,6 +268,18 @@ class DocumentAPIView(APIView):
         Retrieve a specific document with decrypted result.
         """
         try:
+            # Documents never change once saved, so the stored hash is a strong ETag.
+            # Not while is_valid is checked on read: the chain status can change.
+            conditional = not settings.DOCUMENT_VERIFY_ON_READ
+            if conditional and is_conditional(request):
+                # Answer a revalidation without reading the ciphertext, let alone decrypting it
+                validators = Document.objects.filter(id=document_id).values_list("hash", "created_at").first()
+                if validators is None:
+                    raise Document.DoesNotExist
+                etag, last_modified = document_etag(validators[0]), validators[1]
+                if not_modified(request, etag, last_modified):
+                    return not_modified_response(etag, last_modified)
+
             document = Document.objects.get(id=document_id)
 
             # Optional: Add permission checks here
@@ -246,28 +290,32 @@ class DocumentAPIView(APIView):
             # Decrypt the result
             plaintext_result = document.get_plaintext_result()
 
-            # Blockchain verification disabled
-            # try:
-            #     is_valid = self.blockchain_service.verify_document(document.id, document.hash)
-            # except Exception as e:
-            #     logger.error(f"Blockchain verification failed: {str(e)}")
-            #     is_valid = False
+            # Blockchain verification, opt-in through DOCUMENT_VERIFY_ON_READ
             is_valid = None
+            if settings.DOCUMENT_VERIFY_ON_READ:
+                try:
+                    is_valid = anchoring.verify_on_chain(document, get_blockchain_service())
+                except Exception as e:
+                    logger.error(f"Blockchain verification failed: {str(e)}")
+                    is_valid = False
 
 
             # Prepare the response data
             response_data = {
                 "id": document.id,
-                "patient_id": document.patient.id,
-                "category_id": document.category.id,
-                "doctor_id": document.doctor.id,
+                "patient_id": document.patient_id,
+                "category_id": document.category_id,
+                "doctor_id": document.doctor_id,
                 "result": plaintext_result,  # Decrypted result
                 "hash": document.hash,
                 "is_valid": is_valid,  # Blockchain verification result
                 "created_at": document.created_at
             }
 
-            return Response(response_data, status=status.HTTP_200_OK)
+            response = Response(response_data, status=status.HTTP_200_OK)
+            if conditional:
+                with_validators(response, document_etag(document.hash), document.created_at)
+            return response
 
         except Document.DoesNotExist:
             return Response({"error": "Document not found."}, status=status.HTTP_404_NOT_FOUND)
@@ -276,15 +324,245 @@ class DocumentAPIView(APIView):
         
 
 
+class DocumentBulkAPIView(APIView):
+    """
+    Creates many documents in one request (lab integrations post a whole visit at once).
+
+    Body: a list of {"patient_id", "category_id", "doctor_id", "result"} objects,
+    or {"documents": [...]}. Every referenced patient, category and doctor is
+    resolved with a single $in query per model and the valid items are inserted
+    with one bulk_create. The response reports each item by its index.
+    """
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'post_scope'
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        if request.user.role != "Doctor" and request.user.role != "Admin":
+            return Response(
+                {"error": "Only doctors and admins can create documents."},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        items = request.data.get("documents") if isinstance(request.data, dict) else request.data
+
+        if not isinstance(items, list) or not items:
+            return Response({"error": "Expected a non-empty list of documents."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.DOCUMENT_BULK_MAX_ITEMS:
+            return Response(
+                {"error": f"At most {settings.DOCUMENT_BULK_MAX_ITEMS} documents can be created per request."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = [None] * len(items)
+        parsed = []
+        for index, item in enumerate(items):
+            try:
+                parsed.append((index,) + self.parse_item(item))
+            except ValueError as e:
+                results[index] = {"index": index, "status": "error", "error": str(e)}
+
+        # One $in query per related model for the whole batch
+        patients = Patient.objects.in_bulk({p for _, p, _, _, _ in parsed})
+        categories = Category.objects.in_bulk({c for _, _, c, _, _ in parsed})
+        doctors = CustomUser.objects.in_bulk({d for _, _, _, d, _ in parsed})
+        blind_fields = blind_index.indexed_fields(categories)
+
+        pending = []
+        for index, patient_id, category_id, doctor_id, result_data in parsed:
+            missing = [
+                name for name, pk, found in (
+                    ("patient", patient_id, patients),
+                    ("category", category_id, categories),
+                    ("doctor", doctor_id, doctors),
+                ) if pk not in found
+            ]
+            if missing:
+                results[index] = {
+                    "index": index,
+                    "status": "error",
+                    "error": f"Related object does not exist: {', '.join(missing)}"
+                }
+                continue
+
+            document = Document(
+                patient=patients[patient_id],
+                category=categories[category_id],
+                doctor=doctors[doctor_id],
+                result=result_data
+            )
+            try:
+                document.encrypt_result(blind_fields[category_id])
+            except Exception as e:
+                logger.exception("❌ Encryption failed for bulk item %s", index)
+                results[index] = {"index": index, "status": "error", "error": f"Encryption failed: {str(e)}"}
+                continue
+            pending.append((index, document))
+
+        if pending:
+            documents = [document for _, document in pending]
+            try:
+                Document.objects.bulk_create(documents)
+            except Exception as e:
+                logger.exception("❌ Bulk insert failed")
+                for index, _ in pending:
+                    results[index] = {"index": index, "status": "error", "error": f"Insert failed: {str(e)}"}
+                pending = []
+            else:
+                signals.count_bulk_created_documents(documents)
+
+        if pending:
+            # bulk_create does not return ids on djongo: read them back by hash,
+            # through the (patient, ...) index rather than a collection scan
+            ids_by_hash = dict(
+                Document.objects.filter(
+                    patient_id__in={document.patient_id for _, document in pending},
+                    hash__in=[document.hash for _, document in pending]
+                ).values_list("hash", "id")
+            )
+            for index, document in pending:
+                document.id = ids_by_hash.get(document.hash)
+                if document.id is None:
+                    # Never report "created" without an id; the hash lets the client look it up
+                    logger.error(f"❌ Bulk item {index} could not be read back after the insert")
+                    results[index] = {
+                        "index": index,
+                        "status": "error",
+                        "error": "Inserted, but its id could not be read back.",
+                        "hash": document.hash,
+                    }
+                    continue
+                results[index] = {
+                    "index": index,
+                    "status": "created",
+                    "document_id": document.id,
+                    "hash": document.hash,
+                }
+
+            try:
+                anchoring.enqueue([document for _, document in pending if document.id is not None])
+            except Exception as e:
+                # The worker's reconciliation pass picks these documents up later
+                logger.error(f"❌ Could not enqueue bulk documents for anchoring: {str(e)}")
+
+        created = sum(1 for result in results if result["status"] == "created")
+        if created == len(results):
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+
+        logger.info(f"✅ Bulk document creation: {created}/{len(results)} created")
+        return Response({"created": created, "failed": len(results) - created, "results": results}, status=response_status)
+
+    @staticmethod
+    def parse_item(item):
+        if not isinstance(item, dict):
+            raise ValueError("Each document must be an object.")
+
+        patient_id = item.get("patient_id")
+        category_id = item.get("category_id")
+        doctor_id = item.get("doctor_id")
+        result_data = item.get("result")
+
+        if not (patient_id and category_id and doctor_id and result_data):
+            raise ValueError("Missing required fields")
+
+        try:
+            patient_id, category_id, doctor_id = int(patient_id), int(category_id), int(doctor_id)
+        except (TypeError, ValueError):
+            raise ValueError("'patient_id', 'category_id' and 'doctor_id' must be integers.")
+
+        # Ensure result_data is a valid JSON string
+        if isinstance(result_data, (dict, list)):
+            result_data = json.dumps(result_data)
+
+        return patient_id, category_id, doctor_id, result_data
+
+
 logger = logging.getLogger(__name__)
 import traceback
 
+def history_item(doc, decrypted_result, is_valid=None):
+    return {
+        "id": doc.id,
+        "patient_id": doc.patient_id,
+        "category_id": doc.category_id,
+        "doctor_id": doc.doctor_id,
+        "decrypted_result": decrypted_result,
+        "hash": doc.hash,
+        "is_valid": is_valid,  # Only checked on ?verify=1
+        "created_at": doc.created_at
+    }
+
+
+def document_etag(document_hash):
+    return '"%s"' % document_hash
+
+
+def history_etag(documents, *state):
+    """
+    ETag of a history response: a digest of every (id, hash) listed, plus
+    `state` (e.g. the pagination flags). There is no Last-Modified: deleting
+    an older document changes the list but not its newest created_at.
+    """
+    digest = hashlib.sha256(repr(state).encode())
+    for doc in documents:
+        digest.update(f"{doc.id}:{doc.hash};".encode())
+    return '"%s"' % digest.hexdigest()[:32]
+
+
+VERIFICATION_IS_VALID = {"valid": True, "invalid": False, "missing": None}
+
+
+def verify_chunk(documents):
+    """is_valid for each document of a chunk, from one batched chain lookup."""
+    try:
+        statuses = anchoring.verify_many_on_chain(documents, get_blockchain_service())
+    except Exception as e:
+        logger.error(f"❌ Blockchain verification failed: {str(e)}")
+        return {}
+    return {document_id: VERIFICATION_IS_VALID[value] for document_id, value in statuses.items()}
+
+
+def parse_result(plaintext):
+    try:
+        return json.loads(plaintext)
+    except ValueError:
+        return plaintext  # Not JSON, or a decryption error message
+
+
+def decrypt_history_chunk(documents, verify=False, parse=False):
+    decrypted_results = Document.decrypt_many(
+        documents,
+        on_error=lambda doc, e: f"Failed to decrypt: {str(e)}"
+    )
+    if parse:
+        # ?result_format=object: the result as JSON, not a JSON string inside JSON
+        decrypted_results = [parse_result(result) for result in decrypted_results]
+    validity = verify_chunk(documents) if verify else {}
+    return [
+        history_item(doc, result, validity.get(doc.id))
+        for doc, result in zip(documents, decrypted_results)
+    ]
+
+
 class DocumentHistoryAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer]
+    pagination_class = DocumentKeysetPagination
 
     def get(self, request):
         patient_id = request.query_params.get("patient_id")
         category_id = request.query_params.get("category_id")
+        # ?verify=1 fills is_valid, with one batched chain lookup per page or chunk
+        verify = request.query_params.get("verify") in ("1", "true", "True")
+        # ?filter_field=<field id>&filter_value=... keeps the documents whose
+        # blind-indexed field equals the value (services.blind_index)
+        filter_field = request.query_params.get("filter_field")
+        filter_value = request.query_params.get("filter_value")
+        result_format = request.query_params.get("result_format", "string")
 
         if not patient_id or not category_id:
             return Response(
@@ -295,58 +573,87 @@ class DocumentHistoryAPIView(APIView):
         try:
             patient_id = int(patient_id)
             category_id = int(category_id)
+            filter_field = int(filter_field) if filter_field is not None else None
         except ValueError:
             return Response(
-                {"error": "'patient_id' and 'category_id' must be integers."},
+                {"error": "'patient_id', 'category_id' and 'filter_field' must be integers."},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        if result_format not in ("string", "object"):
+            return Response(
+                {"error": "'result_format' must be 'string' or 'object'."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        parse = result_format == "object"
+
+        if filter_field is not None and not Field.objects.filter(
+            id=filter_field, category_id=category_id, blind_index__in=[True]
+        ).exists():
+            return Response(
+                {"error": "'filter_field' must be a blind-indexed field of the category."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if filter_field is not None and not filter_value:
+            return Response(
+                {"error": "'filter_value' is required with 'filter_field'."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Remove doctor restriction: Allow all doctors to see the data
+        if request.user.role != "Doctor" and request.user.role != "Admin":
+            return Response(
+                {"error": "Only doctors and admins can access patient documents."},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
         try:
             # Fetch all documents for the patient and category
             documents = Document.objects.filter(
                 patient=patient_id,
                 category=category_id
             ).order_by('-created_at')
+            if filter_field is not None:
+                # One index lookup on the tokens; only the matches are read and decrypted
+                documents = documents.filter(id__in=blind_index.matching_ids(
+                    patient_id, filter_field, filter_value
+                ))
+
+            paginator = self.pagination_class()
+            if paginator.is_requested(request):
+                page = paginator.paginate_queryset(documents, request, view=self)
+                if not page and paginator.cursor_query_param not in request.query_params:
+                    return Response(
+                        {"error": "No document found for the given patient and category."},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+                # Only the page being returned is decrypted
+                return self.conditional(
+                    request, page, verify,
+                    lambda: paginator.get_paginated_response(decrypt_history_chunk(page, verify, parse)),
+                    parse, paginator.has_next, paginator.has_prev,
+                )
+
+            if request.accepted_renderer.format == NDJSONRenderer.format:
+                return self.stream(documents, verify, parse)
 
-            if not documents.exists():
+            documents = list(documents)
+            if not documents:
                 return Response(
                     {"error": "No document found for the given patient and category."},
                     status=status.HTTP_404_NOT_FOUND
                 )
 
-            # Remove doctor restriction: Allow all doctors to see the data
-            if request.user.role != "Doctor" and request.user.role != "Admin":
-                return Response(
-                    {"error": "Only doctors and admins can access patient documents."},
-                    status=status.HTTP_403_FORBIDDEN
-                )
-
-            # Blockchain verification disabled
-            # blockchain_service = BlockchainService()
-
-            # Decrypt and verify all documents
-            document_list = []
-            for doc in documents:
-                try:
-                    decrypted_result = doc.get_plaintext_result()
-                except Exception as decrypt_error:
-                    decrypted_result = f"Failed to decrypt: {str(decrypt_error)}"
-
-                # is_valid = blockchain_service.verify_document(doc.id, doc.hash)
-
-                document_list.append({
-                    "id": doc.id,
-                    "patient_id": doc.patient.id,
-                    "category_id": doc.category.id,
-                    "doctor_id": doc.doctor.id if doc.doctor else None,
-                    "decrypted_result": decrypted_result,
-                    "hash": doc.hash,
-                    "is_valid": None,
-                    "created_at": doc.created_at
-                })
-
-            return Response(document_list, status=status.HTTP_200_OK)
+            # Decrypt all documents in one batch
+            return self.conditional(
+                request, documents, verify,
+                lambda: Response(decrypt_history_chunk(documents, verify, parse), status=status.HTTP_200_OK),
+                parse,
+            )
 
+        except NotFound:
+            # Invalid pagination cursor
+            raise
         # except Exception as e:
         #     return Response(
         #         {"error": f"An unexpected error occurred: {str(e)}"},
@@ -367,10 +674,49 @@ class DocumentHistoryAPIView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @staticmethod
+    def conditional(request, documents, verify, build, *state):
+        """
+        Answer If-None-Match from the loaded rows, before anything is
+        decrypted. Not with ?verify=1: is_valid can change.
+        """
+        if verify:
+            return build()
+        return conditional_response(request, history_etag(documents, *state), build)
+
+    def stream(self, documents, verify=False, parse=False):
+        """
+        Streams the history as NDJSON, reading the Mongo cursor and decrypting
+        one chunk at a time so memory stays flat however long the history is.
+        """
+        chunk_size = settings.DOCUMENT_HISTORY_STREAM_CHUNK_SIZE
+        rows = documents.iterator(chunk_size=chunk_size)
+        chunks = iter(lambda: list(islice(rows, chunk_size)), [])
+
+        # Read the first chunk up front so an empty history is still a 404
+        first_chunk = next(chunks, None)
+        if first_chunk is None:
+            return Response(
+                {"error": "No document found for the given patient and category."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        def lines():
+            try:
+                for chunk in chain([first_chunk], chunks):
+                    yield NDJSONRenderer.render_rows(decrypt_history_chunk(chunk, verify, parse))
+            except Exception as e:
+                # Headers are already sent, so report the failure in-band
+                logger.exception("❌ Document history stream interrupted")
+                yield NDJSONRenderer.render_rows([{"error": f"Stream interrupted: {str(e)}"}])
+
+        return StreamingHttpResponse(lines(), content_type='application/x-ndjson; charset=utf-8')
+
 
 # WE DON'T USE THIS RIGHT NOW
 class DocumentLastAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = LatestDocumentPagination
 
     def get(self, request):
         # Extract query parameters
@@ -404,18 +750,21 @@ class DocumentLastAPIView(APIView):
                 category=category_id
             )
 
-            if not documents.exists():
+            # The first keyset page holds the latest document; a cursor steps further back
+            paginator = self.pagination_class()
+            page = paginator.paginate_queryset(documents, request, view=self)
+
+            if not page:
                 logger.info(f"No document found for patient_id={patient_id} and category_id={category_id}")
                 return Response(
                     {"error": "No document found for the given patient and category."},
                     status=status.HTTP_404_NOT_FOUND
                 )
 
-            # Find the latest document in Python
-            latest_document = max(documents, key=lambda doc: doc.created_at)
+            latest_document = page[0]
 
             # Permission check: Ensure the requesting user is the doctor who created the document
-            if latest_document.doctor != request.user:
+            if latest_document.doctor_id != request.user.id:
                 logger.warning(f"User {request.user.id} does not have permission to view document {latest_document.id}")
                 return Response(
                     {"error": "You do not have permission to view this document."},
@@ -435,8 +784,13 @@ class DocumentLastAPIView(APIView):
             # Serialize the document using DocumentSerializer
             serializer = DocumentSerializer(latest_document)
 
+            if paginator.is_requested(request):
+                return paginator.get_paginated_response([serializer.data])
             return Response(serializer.data, status=status.HTTP_200_OK)
 
+        except NotFound:
+            # Invalid pagination cursor
+            raise
         except Exception as e:
             logger.exception("An unexpected error occurred in DocumentLastAPIView")
             return Response(
@@ -444,17 +798,63 @@ class DocumentLastAPIView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+class VerifyDocumentBatchAPIView(APIView):
+    """
+    Checks many documents against the blockchain in one go.
+
+    Body: {"document_ids": [...]} or a plain list of ids. The stored hashes are
+    read with a single JSON-RPC batch of eth_calls (one per document, or one
+    per Merkle batch root), and each id gets "valid", "invalid" or "missing"
+    (unknown document, or its anchor is not confirmed yet).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        if request.user.role != "Doctor" and request.user.role != "Admin":
+            return Response(
+                {"error": "Only doctors and admins can verify documents."},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        document_ids = request.data.get("document_ids") if isinstance(request.data, dict) else request.data
+
+        if not isinstance(document_ids, list) or not document_ids:
+            return Response({"error": "Expected a non-empty list of document ids."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(document_ids) > settings.DOCUMENT_VERIFY_BATCH_MAX_IDS:
+            return Response(
+                {"error": f"At most {settings.DOCUMENT_VERIFY_BATCH_MAX_IDS} documents can be verified per request."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            document_ids = [int(document_id) for document_id in document_ids]
+        except (TypeError, ValueError):
+            return Response({"error": "Document ids must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        documents = Document.objects.filter(id__in=set(document_ids)).only("id", "hash")
+        try:
+            statuses = anchoring.verify_many_on_chain(documents, get_blockchain_service())
+        except Exception as e:
+            logger.error(f"❌ Blockchain verification failed: {str(e)}")
+            return Response({"error": f"Blockchain verification failed: {str(e)}"}, status=status.HTTP_502_BAD_GATEWAY)
+
+        results = [
+            {"document_id": document_id, "status": statuses.get(document_id, "missing")}
+            for document_id in document_ids
+        ]
+        summary = {key: sum(1 for result in results if result["status"] == key) for key in ("valid", "invalid", "missing")}
+        return Response({**summary, "results": results}, status=status.HTTP_200_OK)
+
+
 class VerifyDocumentIntegrityAPIView(APIView):
     """
-    Checks if the stored `hash` matches a fresh hash of the encrypted (base64) data.
+    Checks if the stored `hash` matches a fresh hash of the stored ciphertext
+    (and, for AES-GCM documents, that the authentication tag still verifies).
     """
     def get(self, request, document_id):
         try:
             document = Document.objects.get(id=document_id)
-            encrypted_bytes = base64.b64decode(document.result)
-            computed_hash = hashlib.sha256(encrypted_bytes).hexdigest()
 
-            if computed_hash == document.hash:
+            if envelope.verify(document.result, document.hash, lambda: data_keys.get_data_key(document.patient_id)):
                 return Response({"message": "Integrity verified: Hashes match."},
                                 status=status.HTTP_200_OK)
             else:
@@ -471,36 +871,18 @@ class HospitalStatsView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        hospitals = Hospital.objects.all()
-        data = []
-
-        for hospital in hospitals:
-            num_doctors = CustomUser.objects.filter(hospital=hospital, role="Doctor").count()
-            data.append({
-                "id": hospital.id,
-                "name": hospital.name,
-                "num_doctors": num_doctors
-            })
-
-        return Response(data)
+        return Response(stats_cache.get_or_compute(
+            "hospital_stats", lambda: counters.snapshot()["hospital_stats"]
+        ))
 
 
 class CategoryStatsView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        categories = Category.objects.all()
-        documents = Document.objects.values_list("category_id", flat=True)
-        
-        # حساب عدد المستندات لكل فئة
-        document_count = Counter(documents)
-
-        data = [
-            {"id": c.id, "name": c.name, "num_documents": document_count.get(c.id, 0)}
-            for c in categories
-        ]
-
-        return Response(data)
+        return Response(stats_cache.get_or_compute(
+            "category_stats", lambda: counters.snapshot()["category_stats"]
+        ))
     
 
 
@@ -510,51 +892,47 @@ class AdminDashboardAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        
-        # Aggregate overall statistics
-        total_categories = Category.objects.count()
-        total_hospitals = Hospital.objects.count()
-        total_documents = Document.objects.count()
-        total_doctors = CustomUser.objects.filter(role="Doctor").count()
-
-        # Build hospital statistics: count doctors per hospital
-        hospital_stats = []
-        hospitals = Hospital.objects.all()
-        for hospital in hospitals:
-            num_doctors = CustomUser.objects.filter(hospital=hospital, role="Doctor").count()
-            hospital_stats.append({
-                "id": hospital.id,
-                "name": hospital.name,
-                "num_doctors": num_doctors
-            })
-
-        # Build category statistics: count documents per category
-        document_category_ids = Document.objects.values_list("category_id", flat=True)
-        category_counts = Counter(document_category_ids)
-        category_stats = [
-            {
-                "id": category.id,
-                "name": category.name,
-                "num_documents": category_counts.get(category.id, 0)
-            }
-            for category in Category.objects.all()
-        ]
+        data = dict(stats_cache.get_or_compute("admin_dashboard_summary", self.build_dashboard))
+
+        # Only the ids are cached: the plaintext never goes into the shared cache
+        recent_ids = data.pop("recent_document_ids")
+        recent_documents = {document.id: document for document in Document.objects.filter(id__in=recent_ids)}
+        data["recent_documents"] = DocumentSerializer(
+            [recent_documents[document_id] for document_id in recent_ids if document_id in recent_documents],
+            many=True,
+        ).data
+        return Response(data, status=status.HTTP_200_OK)
 
-        # Get the 5 most recent documents and serialize them
-        recent_documents = Document.objects.order_by("-created_at")[:5]
-        serialized_documents = DocumentSerializer(recent_documents, many=True).data
-
-        data = {
-            "total_categories": total_categories,
-            "total_hospitals": total_hospitals,
-            "total_documents": total_documents,
-            "total_doctors": total_doctors,
-            "hospital_stats": hospital_stats,
-            "category_stats": category_stats,
-            "recent_documents": serialized_documents,
+    @staticmethod
+    def build_dashboard():
+        # Precomputed counters, kept up to date by document/signals.py
+        snapshot = counters.snapshot()
+        totals = snapshot["totals"]
+
+        return {
+            "total_categories": totals["categories"],
+            "total_hospitals": totals["hospitals"],
+            "total_documents": totals["documents"],
+            "total_doctors": totals["doctors"],
+            "hospital_stats": snapshot["hospital_stats"],
+            "category_stats": snapshot["category_stats"],
+            # The 5 most recent documents, serialized on read
+            "recent_document_ids": list(
+                Document.objects.order_by("-created_at").values_list("id", flat=True)[:5]
+            ),
         }
 
-        return Response(data, status=status.HTTP_200_OK)
+
+class StatsCacheAPIView(APIView):
+    """
+    Hit/miss counters of the dashboard and stats response cache.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        if request.user.role != "Admin":
+            return Response({"error": "Only admins can view cache statistics."}, status=status.HTTP_403_FORBIDDEN)
+        return Response(stats_cache.metrics(), status=status.HTTP_200_OK)
     
 
 class DoctorsByHospitalAPIView(APIView):